@@ -1,12 +1,15 @@
+from datetime import time
+from enum import Enum
 from functools import lru_cache
 from pathlib import Path
-from typing import Any
+from typing import Annotated, Any
 
-from pydantic import Field, field_validator
-from pydantic_settings import BaseSettings, SettingsConfigDict
+from pydantic import BaseModel, Field, field_validator, model_validator
+from pydantic_settings import BaseSettings, NoDecode, SettingsConfigDict
 
+from difficulty_rules import DifficultyRule
 from models.habitica import HabiticaDifficulty
-from models.todoist import TodoistPriority
+from models.todoist import TodoistPriority, TodoistTaskFilter
 
 _DEFAULT_PRIORITY_TO_DIFFICULTY = {
     TodoistPriority.P1: HabiticaDifficulty.HARD,
@@ -16,6 +19,38 @@ _DEFAULT_PRIORITY_TO_DIFFICULTY = {
 }
 
 
+class SyncMode(Enum):
+    TODO = "todo"
+    """Create a To Do in Habitica for each completed task, score it and delete it."""
+    HABIT = "habit"
+    """Score one of the habits kept in Habitica for each difficulty."""
+
+
+class TodoistSyncMethod(Enum):
+    COMPLETED = "completed"
+    """Query the archive of completed tasks."""
+    INCREMENTAL = "incremental"
+    """Fetch changed items only and detect completions from their changes."""
+
+
+class DatabaseSynchronous(Enum):
+    """See https://www.sqlite.org/pragma.html#pragma_synchronous."""
+
+    OFF = "OFF"
+    NORMAL = "NORMAL"
+    FULL = "FULL"
+    EXTRA = "EXTRA"
+
+
+class Account(BaseModel):
+    """Pair of Todoist and Habitica accounts synced together."""
+
+    todoist_api_key: str
+    todoist_user_id: int | None = None
+    habitica_user_id: str
+    habitica_api_key: str
+
+
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(env_file_encoding="utf-8")
 
@@ -24,7 +59,8 @@ class Settings(BaseSettings):
         description=(
             'See "user_id" mentioned in a link under "Calendar Subscription URL" at '
             "https://todoist.com/prefs/integrations. Needed only for shared projects to "
-            "score points for tasks owned by you."
+            "score points for tasks owned by you. Tasks assigned to someone else, or not assigned and completed by "
+            "someone else, are then skipped."
         ),
     )
     todoist_api_key: str = Field(..., description='See https://todoist.com/prefs/integrations under "API token".')
@@ -33,16 +69,113 @@ class Settings(BaseSettings):
         ...,
         description='See https://habitica.com/user/settings/api under "API Token", the "Show API Token" button.',
     )
+    todoist_include_project_ids: Annotated[list[str], NoDecode] = Field(
+        default_factory=list,
+        description=(
+            "Comma separated IDs of Todoist projects to sync completed tasks from. All projects if not set. With a "
+            "single project, only its tasks are fetched from Todoist."
+        ),
+    )
+    todoist_exclude_project_ids: Annotated[list[str], NoDecode] = Field(
+        default_factory=list, description="Comma separated IDs of Todoist projects to never sync completed tasks from."
+    )
+    todoist_include_labels: Annotated[list[str], NoDecode] = Field(
+        default_factory=list,
+        description=(
+            "Comma separated Todoist labels. If set, only completed tasks with at least one of them are synced. "
+            "Case-insensitive."
+        ),
+    )
+    todoist_exclude_labels: Annotated[list[str], NoDecode] = Field(
+        default_factory=list,
+        description=(
+            "Comma separated Todoist labels. Completed tasks with any of them are never synced. Case-insensitive."
+        ),
+    )
     sync_delay_seconds: int = Field(
         1,
         gt=0,
         validation_alias="sync_delay_minutes",
         description="Repeat sync automatically after N minutes.",
     )
+    max_sync_delay_seconds: int | None = Field(
+        None,
+        gt=0,
+        validation_alias="max_sync_delay_minutes",
+        description=(
+            "If set, the time between syncs doubles after each sync finding no completed tasks, up to N minutes. "
+            "It drops back to `SYNC_DELAY_MINUTES` as soon as a completed task is found."
+        ),
+    )
+    quiet_hours: Annotated[tuple[time, time] | None, NoDecode] = Field(
+        None,
+        description=(
+            "Daily period of time in the `HH:MM-HH:MM` format, e.g. `23:00-07:00`, when sync runs only every "
+            "`MAX_SYNC_DELAY_MINUTES` (or `SYNC_DELAY_MINUTES`, if not set). Uses the local time zone."
+        ),
+    )
+    max_task_attempts: int = Field(
+        10,
+        gt=0,
+        description=(
+            "How many times to retry a task failing to sync to Habitica before giving up on it. Retries are delayed "
+            "exponentially, from 1 minute up to 6 hours. Tasks that were given up on are kept in the sync cache in "
+            "the `DeadLetter` state."
+        ),
+    )
+    habitica_connect_timeout_seconds: float = Field(
+        5, gt=0, description="How long to wait for a connection to Habitica before retrying the request later."
+    )
+    habitica_read_timeout_seconds: float = Field(
+        30, gt=0, description="How long to wait for a response from Habitica before retrying the request later."
+    )
+    todoist_connect_timeout_seconds: float = Field(
+        5, gt=0, description="How long to wait for a connection to Todoist before retrying the sync later."
+    )
+    todoist_read_timeout_seconds: float = Field(
+        30, gt=0, description="How long to wait for a response from Todoist before retrying the sync later."
+    )
+    sync_concurrency: int = Field(
+        1,
+        gt=0,
+        description=(
+            "How many tasks are synced to Habitica at the same time. Tasks are still created, scored and deleted in "
+            "this order. All requests share the Habitica rate limit, so higher values only help when requests are "
+            "slow, not when the rate limit is reached."
+        ),
+    )
+    accounts: list[Account] = Field(
+        default_factory=list,
+        description=(
+            "Additional accounts synced by the same process, as a JSON list of objects with the keys "
+            "`todoist_api_key`, `habitica_user_id`, `habitica_api_key` and optionally `todoist_user_id`. Each "
+            "account has its own sync cache next to `DATABASE_FILE`, with the Habitica user ID in its name, and "
+            "its own Habitica rate limit. All other settings apply to all accounts. Webhooks are not supported "
+            "with additional accounts."
+        ),
+    )
     database_file: Path = Field(
         Path(".sync_cache/sync_cache.sqlite"),
         description="Where to store synchronisation details. No need to change.",
     )
+    completions_retention_days: int = Field(
+        30,
+        gt=0,
+        description=(
+            "How long to remember Todoist completions that were already queued for syncing. A completion seen "
+            "again within this time, for example reported by both a webhook and the regular sync, is not scored "
+            "twice."
+        ),
+    )
+    database_synchronous: DatabaseSynchronous = Field(  # type: ignore[assignment]
+        DatabaseSynchronous.NORMAL.value,  # The value is used for better documentation
+        validate_default=True,
+        description=(
+            "How often the sync cache is flushed to disk. `NORMAL` is safe against crashes of the application and "
+            "only risks losing the last sync on power loss. `FULL` and `EXTRA` are slower but survive power loss. "
+            "See https://www.sqlite.org/pragma.html#pragma_synchronous."
+        ),
+    )
     priority_to_difficulty: dict[TodoistPriority, HabiticaDifficulty] = Field(
         # The default is formed of the enum names for better documentation
         {key.name: value.name for key, value in _DEFAULT_PRIORITY_TO_DIFFICULTY.items()},  # type: ignore[misc]
@@ -62,11 +195,159 @@ class Settings(BaseSettings):
             "labels, the highest difficulty is used."
         ),
     )
+    difficulty_rules: list[DifficultyRule] = Field(
+        default_factory=list,
+        description=(
+            "Rules setting the difficulty of tasks, as a JSON list of objects with a `difficulty` and any of the "
+            "conditions `labels`, `priorities`, `project_ids` (lists matching any of their values), `content_regex` "
+            "(a regular expression searched in the task content), `has_due` and `is_recurring` (true or false). A "
+            "rule applies when all its conditions match. Example: "
+            '`[{"difficulty": "hard", "content_regex": "^(?i:workout)", "is_recurring": true}]`. Combined with '
+            "`label_to_difficulty`, the highest difficulty of all matching rules is used. Tasks matching no rule "
+            "use the `priority_to_difficulty` mapping."
+        ),
+    )
 
-    @field_validator("sync_delay_seconds")
+    sync_mode: SyncMode = Field(  # type: ignore[assignment]
+        SyncMode.TODO.value,  # The value is used for better documentation
+        validate_default=True,
+        description=(
+            "How completed Todoist tasks score points in Habitica. `todo` creates a To Do for each completed task, "
+            "scores it and deletes it. `habit` creates one habit per difficulty on first use and only scores it "
+            "for each completed task, which needs one API call per task instead of three."
+        ),
+    )
+    todoist_sync_method: TodoistSyncMethod = Field(  # type: ignore[assignment]
+        TodoistSyncMethod.COMPLETED.value,  # The value is used for better documentation
+        validate_default=True,
+        description=(
+            "How completed tasks are fetched from Todoist. `completed` queries the archive of completed tasks. "
+            "`incremental` fetches only items changed since the last sync, which makes each sync much cheaper. "
+            "Completion of a recurring task is then detected from its due date moving by exactly one occurrence, "
+            "so rescheduling it to another date does not score points. Only English recurrences such as "
+            "`every day`, `every 2 weeks` or `every monday, friday` are understood, use `completed` for others."
+        ),
+    )
+    webhook_port: int | None = Field(
+        None,
+        gt=0,
+        lt=65536,
+        description=(
+            "Port to receive Todoist webhooks on. When set, tasks completed in Todoist score points in Habitica "
+            "immediately and the regular sync only catches up on missed webhooks, so `SYNC_DELAY_MINUTES` can be "
+            "increased. Requires `TODOIST_CLIENT_SECRET`. See https://developer.todoist.com/sync/v9/#webhooks on "
+            "how to create a Todoist app subscribed to the `item:completed` event."
+        ),
+    )
+    todoist_client_secret: str | None = Field(
+        None,
+        description="Client secret of the Todoist app sending webhooks. Used to verify webhooks come from Todoist.",
+    )
+    metrics_port: int | None = Field(
+        None,
+        gt=0,
+        lt=65536,
+        description=(
+            "Port to serve metrics in the Prometheus text format on, at `/metrics`. Includes durations of Todoist "
+            "and Habitica API calls, time spent waiting for the Habitica rate limit, number of tasks in each sync "
+            "state, state transitions and age of the oldest task waiting to be synced. Disabled if not set."
+        ),
+    )
+    traffic_record_file: Path | None = Field(
+        None,
+        description=(
+            "File to append all requests to the Todoist and Habitica APIs to, with their responses and timings, to "
+            "replay them later with `--replay`. Credentials are never recorded, but responses contain the content of "
+            "tasks. Disabled if not set."
+        ),
+    )
+    habitica_bulk_cleanup: bool = Field(
+        False,
+        description=(
+            "Delete finished Habitica tasks in bulk once per sync, instead of one by one. Saves one API call per "
+            "task. Falls back to deleting tasks one by one if Habitica has any completed To Do's not created by "
+            "the sync, after paying for the extra call to check, so only enable it if you don't complete To Do's in "
+            "Habitica yourself. A To Do completed in Habitica between the check and the bulk delete is removed too."
+        ),
+    )
+
+    @model_validator(mode="after")
+    def validate_webhook_secret(self) -> "Settings":
+        if self.webhook_port is not None and not self.todoist_client_secret:
+            raise ValueError("todoist_client_secret must be set to receive webhooks")
+        return self
+
+    @model_validator(mode="after")
+    def validate_accounts(self) -> "Settings":
+        if self.accounts and self.webhook_port is not None:
+            raise ValueError("webhook_port must not be set when syncing additional accounts")
+        habitica_user_ids = [account.habitica_user_id for account in self.all_accounts]
+        if len(set(habitica_user_ids)) != len(habitica_user_ids):
+            raise ValueError("each account must have a different habitica_user_id")
+        return self
+
+    @model_validator(mode="after")
+    def validate_max_sync_delay(self) -> "Settings":
+        if self.max_sync_delay_seconds is not None and self.max_sync_delay_seconds < self.sync_delay_seconds:
+            raise ValueError("max_sync_delay_minutes must not be lower than sync_delay_minutes")
+        return self
+
+    @property
+    def all_accounts(self) -> list[Account]:
+        """The main account, followed by additional accounts."""
+        main_account = Account(
+            todoist_api_key=self.todoist_api_key,
+            todoist_user_id=self.todoist_user_id,
+            habitica_user_id=self.habitica_user_id,
+            habitica_api_key=self.habitica_api_key,
+        )
+        return [main_account, *self.accounts]
+
+    def account_database_file(self, account: Account) -> Path:
+        """Sync cache of given account. The main account uses `database_file` as is."""
+        if account.habitica_user_id == self.habitica_user_id:
+            return self.database_file
+        return self.database_file.with_name(
+            f"{self.database_file.stem}_{account.habitica_user_id}{self.database_file.suffix}"
+        )
+
+    def todoist_task_filter(self, account: Account) -> TodoistTaskFilter:
+        """Which Todoist tasks of given account are synced."""
+        return TodoistTaskFilter(
+            include_project_ids=frozenset(self.todoist_include_project_ids),
+            exclude_project_ids=frozenset(self.todoist_exclude_project_ids),
+            include_labels=frozenset(label.lower() for label in self.todoist_include_labels),
+            exclude_labels=frozenset(label.lower() for label in self.todoist_exclude_labels),
+            user_id=None if account.todoist_user_id is None else str(account.todoist_user_id),
+        )
+
+    @field_validator(
+        "todoist_include_project_ids",
+        "todoist_exclude_project_ids",
+        "todoist_include_labels",
+        "todoist_exclude_labels",
+        mode="before",
+    )
     @classmethod
-    def minutes_to_seconds(cls, value: int):  # pylint: disable=no-self-argument
-        return value * 60
+    def split_comma_separated(cls, value: str | list[str]) -> list[str]:
+        if isinstance(value, str):
+            return [item.strip() for item in value.split(",") if item.strip()]
+        return value
+
+    @field_validator("sync_delay_seconds", "max_sync_delay_seconds")
+    @classmethod
+    def minutes_to_seconds(cls, value: int | None):  # pylint: disable=no-self-argument
+        return None if value is None else value * 60
+
+    @field_validator("quiet_hours", mode="before")
+    @classmethod
+    def parse_quiet_hours(cls, value: str | tuple | None) -> tuple | None:
+        if isinstance(value, str):
+            start, separator, end = value.partition("-")
+            if not separator:
+                raise ValueError("quiet_hours must be in the HH:MM-HH:MM format")
+            return time.fromisoformat(start.strip()), time.fromisoformat(end.strip())
+        return value
 
     @field_validator("priority_to_difficulty", mode="before")
     @classmethod
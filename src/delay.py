@@ -1,5 +1,10 @@
 import logging
+import random
+import threading
 import time
+from collections.abc import Callable
+from datetime import datetime
+from datetime import time as time_of_day
 
 
 class DelayTimer:
@@ -8,7 +13,7 @@ class DelayTimer:
     If the time between calls is non-zero, it is subtracted from the maximum delay.
     """
 
-    def __init__(self, max_delay: int | float, msg: str | None):
+    def __init__(self, max_delay: int | float, msg: str | None, wake_up: threading.Event | None = None):
         """Constructor.
 
         Args:
@@ -16,16 +21,108 @@ class DelayTimer:
             msg: A message to log before sleep. If not set, none will be printed. Accepts one
                 keyword ``str.format`` argument ``delay`` with the number of second it will
                 sleep for.
+            wake_up: If set, the sleep ends early when the event is set.
         """
         self._max_delay = max_delay
         self._msg = msg
+        self._wake_up = wake_up
         self._last_api_call: float = max_delay * -1
         self._log = logging.getLogger(self.__class__.__name__)
 
-    def __call__(self) -> None:
-        """Sleep and prints a message."""
+    @property
+    def max_delay(self) -> float:
+        return self._max_delay
+
+    @max_delay.setter
+    def max_delay(self, value: float) -> None:
+        self._max_delay = value
+
+    def __call__(self) -> bool:
+        """Sleep and prints a message.
+
+        Returns:
+            False if woken up before the delay elapsed. The next call then sleeps only for the rest of the delay.
+        """
         if delay := max(0.0, self._max_delay - (time.monotonic() - self._last_api_call)):
             if self._msg is not None:
                 self._log.info(self._msg.format(delay=delay))
-            time.sleep(delay)
+            if self._wake_up is None:
+                time.sleep(delay)
+            elif self._wake_up.wait(delay):
+                self._wake_up.clear()
+                return False
         self._last_api_call = time.monotonic()
+        return True
+
+
+class AdaptiveSyncDelay:
+    """Chooses the delay before the next sync based on how many completed tasks the last sync found.
+
+    The delay drops to the minimum after a sync finding completed tasks and doubles after each sync finding none,
+    up to the maximum. The maximum is always used during quiet hours.
+    """
+
+    def __init__(
+        self,
+        min_delay: float,
+        max_delay: float,
+        quiet_hours: tuple[time_of_day, time_of_day] | None = None,
+        clock: Callable[[], datetime] = datetime.now,
+    ):
+        """Constructor.
+
+        Args:
+            min_delay: Delay after a sync finding completed tasks.
+            max_delay: Upper bound of the delay.
+            quiet_hours: Start and end of a daily period of time with the maximum delay. Can span midnight.
+            clock: Current local time, injectable for testing.
+        """
+        self._min_delay = min_delay
+        self._max_delay = max_delay
+        self._quiet_hours = quiet_hours
+        self._clock = clock
+        self._delay = min_delay
+        self._log = logging.getLogger(self.__class__.__name__)
+
+    def _is_quiet_time(self, now: time_of_day) -> bool:
+        if self._quiet_hours is None:
+            return False
+        start, end = self._quiet_hours
+        if start <= end:
+            return start <= now < end
+        return now >= start or now < end
+
+    def __call__(self, completed_tasks: int) -> float:
+        """Delay before the next sync.
+
+        Args:
+            completed_tasks: Number of completed tasks found by the last sync.
+        """
+        if completed_tasks:
+            self._delay = self._min_delay
+            reason = f"{completed_tasks} completed tasks found"
+        else:
+            self._delay = min(self._max_delay, self._delay * 2)
+            reason = "no completed tasks found"
+
+        if self._is_quiet_time(self._clock().time()):
+            self._log.info(f"Sync delay set to {self._max_delay:.0f}s during quiet hours.")
+            return self._max_delay
+
+        if self._min_delay != self._max_delay:
+            self._log.info(f"Sync delay set to {self._delay:.0f}s, {reason}.")
+        return self._delay
+
+
+def exponential_backoff(attempt: int, base_delay: float, max_delay: float) -> float:
+    """Delay before the next attempt, doubling with each attempt, with random jitter.
+
+    Half of the delay is random, so that tasks failing at the same time are not retried all at once.
+
+    Args:
+        attempt: Number of failed attempts so far, starting at 1.
+        base_delay: Delay after the first failed attempt.
+        max_delay: Upper bound of the delay.
+    """
+    delay = min(max_delay, base_delay * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
@@ -0,0 +1,187 @@
+"""Rules deciding the Habitica difficulty of completed Todoist tasks.
+
+Rules are compiled once into lookup tables, so that classifying a task costs about the same no matter how many rules
+are configured.
+"""
+
+import re
+from collections import defaultdict
+from collections.abc import Iterable, Sequence
+from typing import Any, TypeVar
+
+from pydantic import BaseModel, ConfigDict, field_validator
+
+from models.habitica import HabiticaDifficulty
+from models.todoist import CompletedTask, TodoistPriority
+
+_KeyT = TypeVar("_KeyT")
+_INDEXED_CONDITIONS = ("labels", "project_ids", "priorities")
+"""Conditions with a set of values, which rules are looked up by. In order of preference for indexing."""
+
+
+class DifficultyRule(BaseModel):
+    """Difficulty of tasks matching all conditions that are set. A rule without conditions matches all tasks."""
+
+    difficulty: HabiticaDifficulty
+    labels: frozenset[str] = frozenset()
+    """Matches tasks with any of these labels. Case-insensitive."""
+    priorities: frozenset[TodoistPriority] = frozenset()
+    project_ids: frozenset[str] = frozenset()
+    content_regex: re.Pattern[str] | None = None
+    """Matches tasks with content containing a match."""
+    has_due: bool | None = None
+    is_recurring: bool | None = None
+
+    model_config = ConfigDict(frozen=True)
+
+    @field_validator("difficulty", mode="before")
+    @classmethod
+    def parse_difficulty_name(cls, value: Any) -> Any:
+        return HabiticaDifficulty[value.upper()] if isinstance(value, str) and value.isalpha() else value
+
+    @field_validator("priorities", mode="before")
+    @classmethod
+    def parse_priority_names(cls, value: Any) -> Any:
+        if isinstance(value, (list, tuple, set, frozenset)):
+            return [TodoistPriority[_.upper()] if isinstance(_, str) else _ for _ in value]
+        return value
+
+    @field_validator("labels")
+    @classmethod
+    def lower_labels(cls, value: frozenset[str]) -> frozenset[str]:
+        return frozenset(label.lower() for label in value)
+
+    def matches(self, completed_task: CompletedTask, labels: frozenset[str]) -> bool:
+        """Whether all conditions match.
+
+        Args:
+            completed_task: Task to match.
+            labels: Lower case labels of the task.
+        """
+        return (
+            (not self.labels or not self.labels.isdisjoint(labels))
+            and (not self.priorities or completed_task.priority in self.priorities)
+            and (not self.project_ids or completed_task.project_id in self.project_ids)
+            and (self.has_due is None or completed_task.has_due is self.has_due)
+            and (self.is_recurring is None or completed_task.is_recurring is self.is_recurring)
+            and (self.content_regex is None or self.content_regex.search(completed_task.content) is not None)
+        )
+
+
+def _max(difficulty: HabiticaDifficulty | None, other: HabiticaDifficulty | None) -> HabiticaDifficulty | None:
+    if difficulty is None or other is None:
+        return other if difficulty is None else difficulty
+    return max(difficulty, other)
+
+
+def _raise_to(table: dict[_KeyT, HabiticaDifficulty], key: _KeyT, difficulty: HabiticaDifficulty) -> None:
+    table[key] = max(table[key], difficulty) if key in table else difficulty
+
+
+def _is_combinable(content_regex: re.Pattern[str] | None) -> bool:
+    """Whether the pattern matches the same when combined with others.
+
+    Groups would shift back references, and inline global flags must come first.
+    """
+    return content_regex is not None and content_regex.groups == 0 and content_regex.flags == re.UNICODE
+
+
+class DifficultyRules:
+    """Rules compiled into lookup tables. The highest difficulty of all matching rules wins.
+
+    Rules with a single label, project or priority condition are merged into tables mapping each value to a
+    difficulty. Other rules are indexed by one of their conditions and only checked for tasks matching it. Content
+    patterns without groups or flags are combined into one, so tasks matching none of them are ruled out with a single
+    search.
+    """
+
+    def __init__(
+        self,
+        rules: Iterable[DifficultyRule],
+        priority_to_difficulty: dict[TodoistPriority, HabiticaDifficulty],
+    ):
+        """Constructor.
+
+        Args:
+            rules: Rules in any order.
+            priority_to_difficulty: Difficulty of tasks matching no rule.
+        """
+        self._priority_to_difficulty = dict(priority_to_difficulty)
+        # Difficulty by value of the only condition of a rule, and rules with more conditions by value of one of them
+        self._tables: dict[str, dict[Any, HabiticaDifficulty]] = {name: {} for name in _INDEXED_CONDITIONS}
+        self._indexes: dict[str, defaultdict[Any, list[DifficultyRule]]] = {
+            name: defaultdict(list) for name in _INDEXED_CONDITIONS
+        }
+        self._content_rules: list[DifficultyRule] = []
+        self._other_rules: list[DifficultyRule] = []
+
+        for rule in rules:
+            self._add(rule)
+
+        self._content_prefilter: re.Pattern[str] | None = None
+        if self._content_rules:
+            try:
+                self._content_prefilter = re.compile(
+                    "|".join(f"(?:{rule.content_regex.pattern})" for rule in self._content_rules if rule.content_regex)
+                )
+            except re.error:
+                self._other_rules.extend(self._content_rules)
+                self._content_rules.clear()
+
+    @classmethod
+    def from_settings(
+        cls,
+        difficulty_rules: Iterable[DifficultyRule],
+        label_to_difficulty: dict[str, HabiticaDifficulty],
+        priority_to_difficulty: dict[TodoistPriority, HabiticaDifficulty],
+    ) -> "DifficultyRules":
+        label_rules = [
+            DifficultyRule(labels=frozenset([label]), difficulty=difficulty)
+            for label, difficulty in label_to_difficulty.items()
+        ]
+        return cls([*label_rules, *difficulty_rules], priority_to_difficulty)
+
+    def _add(self, rule: DifficultyRule) -> None:
+        conditions = rule.model_dump(exclude={"difficulty"}, exclude_defaults=True).keys()
+        for name in _INDEXED_CONDITIONS:
+            if not (values := getattr(rule, name)):
+                continue
+            for value in values:
+                if conditions == {name}:
+                    _raise_to(self._tables[name], value, rule.difficulty)
+                else:
+                    self._indexes[name][value].append(rule)
+            return
+
+        (self._content_rules if _is_combinable(rule.content_regex) else self._other_rules).append(rule)
+
+    def _candidate_rules(self, completed_task: CompletedTask, labels: frozenset[str]) -> list[DifficultyRule]:
+        candidates = [*self._other_rules]
+        for label in labels:
+            candidates.extend(self._indexes["labels"].get(label, ()))
+        candidates.extend(self._indexes["project_ids"].get(completed_task.project_id, ()))
+        candidates.extend(self._indexes["priorities"].get(completed_task.priority, ()))
+        if self._content_prefilter is not None and self._content_prefilter.search(completed_task.content) is not None:
+            candidates.extend(self._content_rules)
+        return candidates
+
+    def difficulty(self, completed_task: CompletedTask) -> HabiticaDifficulty:
+        labels = frozenset(label.lower() for label in completed_task.labels)
+        label_table = self._tables["labels"]
+        difficulty = _max(
+            self._tables["priorities"].get(completed_task.priority),
+            self._tables["project_ids"].get(completed_task.project_id),
+        )
+        for label in labels:
+            difficulty = _max(difficulty, label_table.get(label))
+
+        for rule in self._candidate_rules(completed_task, labels):
+            if rule.matches(completed_task, labels):
+                difficulty = _max(difficulty, rule.difficulty)
+
+        return self._priority_to_difficulty[completed_task.priority] if difficulty is None else difficulty
+
+    def classify(self, completed_tasks: Sequence[CompletedTask]) -> list[HabiticaDifficulty]:
+        """Difficulties of all given tasks, in the same order."""
+        difficulty = self.difficulty
+        return [difficulty(completed_task) for completed_task in completed_tasks]
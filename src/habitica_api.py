@@ -1,16 +1,35 @@
 import json
-from typing import Any, Final
+from http import HTTPStatus
+from typing import TYPE_CHECKING, Any, Final, NamedTuple
 
 import requests
 from pydantic import BaseModel, ConfigDict, Field
+from requests.adapters import BaseAdapter, HTTPAdapter
 
-from delay import DelayTimer
+from metrics import HABITICA_API_SECONDS, HABITICA_RATE_LIMIT_WAIT_SECONDS
 from models.habitica import HabiticaDifficulty
+from rate_limiter import TokenBucket, TokenBucketStore
+
+if TYPE_CHECKING:  # Only imported when traffic is recorded or replayed
+    from traffic import Traffic
 
 _API_URI_BASE: Final[str] = "https://habitica.com/api/v3"
 _SUCCESS_CODES = frozenset([requests.codes.ok, requests.codes.created])  # pylint: disable=no-member
-_API_CALLS_DELAY: Final[DelayTimer] = DelayTimer(30, "Waiting for {delay:.0f}s between API calls.")
+_RATE_LIMIT_CALLS: Final[int] = 30
+_RATE_LIMIT_PERIOD_SECONDS: Final[float] = 60
 """https://habitica.fandom.com/wiki/Guidance_for_Comrades#API_Server_Calls"""
+_RATE_LIMIT_MSG: Final[str] = "Habitica rate limit reached, waiting for {delay:.0f}s."
+_API_RATE_LIMITER: Final[TokenBucket] = TokenBucket(
+    _RATE_LIMIT_CALLS, _RATE_LIMIT_PERIOD_SECONDS, _RATE_LIMIT_MSG, on_wait=HABITICA_RATE_LIMIT_WAIT_SECONDS.inc
+)
+_MAX_RATE_LIMITED_RETRIES: Final[int] = 3
+_DEFAULT_CONNECT_TIMEOUT_SECONDS: Final[float] = 5
+_DEFAULT_READ_TIMEOUT_SECONDS: Final[float] = 30
+_DEFAULT_MAX_CONNECTIONS: Final[int] = 10
+
+
+class UnexpectedResponseError(requests.RequestException):
+    """Response not matching the request. Handled like network errors, so that the request is retried later."""
 
 
 class HabiticaAPIHeaders(BaseModel):
@@ -21,77 +40,133 @@ class HabiticaAPIHeaders(BaseModel):
     model_config = ConfigDict(populate_by_name=True)
 
 
+def shared_rate_limiter(store: TokenBucketStore, user_id: str) -> TokenBucket:
+    """Rate limiter of a Habitica account, with its state in given store to share it with other processes."""
+    return TokenBucket(
+        _RATE_LIMIT_CALLS,
+        _RATE_LIMIT_PERIOD_SECONDS,
+        _RATE_LIMIT_MSG,
+        on_wait=HABITICA_RATE_LIMIT_WAIT_SECONDS.inc,
+        store=store,
+        name=f"habitica_{user_id}",
+    )
+
+
+class _Endpoint(NamedTuple):
+    method: str
+    path: str
+    """Path relative to the API base, with `str.format` placeholders for path parameters."""
+
+
+_ENDPOINT_USER_TASKS: Final[_Endpoint] = _Endpoint("GET", "/tasks/user")
+_ENDPOINT_CREATE_USER_TASKS: Final[_Endpoint] = _Endpoint("POST", "/tasks/user")
+_ENDPOINT_SCORE_TASK: Final[_Endpoint] = _Endpoint("POST", "/tasks/{task_id}/score/{direction}")
+_ENDPOINT_DELETE_TASK: Final[_Endpoint] = _Endpoint("DELETE", "/tasks/{task_id}")
+_ENDPOINT_CLEAR_COMPLETED_TODOS: Final[_Endpoint] = _Endpoint("POST", "/tasks/clearCompletedTodos")
+
+
 class HabiticaAPI:
     """Access to Habitica API.
 
-    Based on https://github.com/philadams/habitica/blob/master/habitica/api.py
+    All requests go through one pooled session, so connections are kept alive and reused, also across threads.
     """
 
-    def __init__(
+    TRAFFIC_SERVICE: Final[str] = "habitica"
+
+    def __init__(  # noqa: PLR0913 # pylint: disable=too-many-arguments
         self,
         headers: HabiticaAPIHeaders,
-        resource: str | None = None,
-        aspect: str | None = None,
+        api_uri_base: str = _API_URI_BASE,
+        rate_limiter: TokenBucket = _API_RATE_LIMITER,
+        timeout: tuple[float, float] = (_DEFAULT_CONNECT_TIMEOUT_SECONDS, _DEFAULT_READ_TIMEOUT_SECONDS),
+        max_connections: int = _DEFAULT_MAX_CONNECTIONS,
+        traffic: "Traffic | None" = None,
     ):
-        self._resource = resource
-        self._aspect = aspect
-        self._headers = headers
-
-    def __getattr__(self, name):
-        try:
-            return object.__getattribute__(self, name)
-        except AttributeError:
-            if not self._resource:
-                return HabiticaAPI(headers=self._headers, resource=name)
-
-            return HabiticaAPI(headers=self._headers, resource=self._resource, aspect=name)
-
-    def __call__(self, **kwargs):
-        method = kwargs.pop("_method", "get")
-
-        # build up URL... Habitica's api is the *teeniest* bit annoying
-        # so either I need to find a cleaner way here, or I should
-        # get involved in the API itself and... help it.
-        if self._aspect:
-            aspect_id = kwargs.pop("_id", None)
-            direction = kwargs.pop("_direction", None)
-            uri = _API_URI_BASE
-            if aspect_id is not None:
-                uri = f"{uri}/{self._aspect}/{aspect_id}"
-            elif self._aspect == "tasks":
-                uri = f"{uri}/{self._aspect}/{self._resource}"
-            else:
-                uri = f"{uri}/{self._resource}/{self._aspect}"
-            if direction is not None:
-                uri = f"{uri}/score/{direction}"
-        else:
-            uri = f"{_API_URI_BASE}/{self._resource}"
-
-        # actually make the request of the API
-        http_headers = self._headers.model_dump(by_alias=True)
-        _API_CALLS_DELAY()
-        if method in ["put", "post", "delete"]:
-            res = getattr(requests, method)(uri, headers=http_headers, data=json.dumps(kwargs))
-        else:
-            res = getattr(requests, method)(uri, headers=http_headers, params=kwargs)
-
-        # print(res.url)  # debug...
+        """Constructor.
+
+        Args:
+            headers: Authentication headers.
+            api_uri_base: Base URL of the API.
+            rate_limiter: Rate limiter shared by all requests.
+            timeout: Connect and read timeouts of each request in seconds.
+            max_connections: Maximum number of connections kept open, which should match the number of threads
+                sending requests at the same time.
+            traffic: Records or replays all requests, if set.
+        """
+        self._api_uri_base = api_uri_base
+        self._rate_limiter = rate_limiter
+        self._timeout = timeout
+        self._session = requests.Session()
+        self._session.headers.update(headers.model_dump(by_alias=True))
+        adapter: BaseAdapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+        if traffic is not None:
+            adapter = traffic.adapter(self.TRAFFIC_SERVICE, adapter)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+    def close(self) -> None:
+        self._session.close()
+
+    def _request(
+        self,
+        endpoint: _Endpoint,
+        path_params: dict[str, str] | None = None,
+        params: dict[str, str] | None = None,
+        body: Any = None,
+    ) -> Any:
+        url = self._api_uri_base + (endpoint.path.format(**path_params) if path_params else endpoint.path)
+        data = None if body is None else json.dumps(body)
+
+        for _ in range(_MAX_RATE_LIMITED_RETRIES + 1):
+            self._rate_limiter()
+            res = self._session.request(endpoint.method, url, params=params, data=data, timeout=self._timeout)
+            too_many_requests = res.status_code == HTTPStatus.TOO_MANY_REQUESTS
+            self._rate_limiter.update(res.headers, too_many_requests=too_many_requests)
+            if not too_many_requests:
+                break
+
         if res.status_code not in _SUCCESS_CODES:
             try:
                 res.raise_for_status()
             except requests.HTTPError as exc:
-                raise requests.HTTPError(f"{exc}, JSON Payload: {res.json()}", res) from exc
+                raise requests.HTTPError(f"{exc}, JSON Payload: {res.json()}", response=res) from exc
 
         return res.json()["data"]
 
-    def create_task(self, text: str, priority: HabiticaDifficulty) -> dict[str, Any]:
-        """See https://habitica.com/apidoc/#api-Task-CreateUserTasks."""
-        return self.user.tasks(type="todo", text=text, priority=priority.value, _method="post")
-
+    @HABITICA_API_SECONDS.timed(method="create_tasks")
+    def create_tasks(
+        self, tasks: list[tuple[str, HabiticaDifficulty]], task_type: str = "todo"
+    ) -> list[dict[str, Any]]:
+        """Create multiple tasks in one request, in the same order as given.
+
+        See https://habitica.com/apidoc/#api-Task-CreateUserTasks.
+
+        Raises:
+            UnexpectedResponseError: The number of created tasks differs from the number of given tasks.
+        """
+        body = [{"type": task_type, "text": text, "priority": priority.value} for text, priority in tasks]
+        created = self._request(_ENDPOINT_CREATE_USER_TASKS, body=body)
+        created = created if isinstance(created, list) else [created]
+        if len(created) != len(tasks):
+            raise UnexpectedResponseError(f"Habitica returned {len(created)} created tasks for {len(tasks)} tasks.")
+        return created
+
+    @HABITICA_API_SECONDS.timed(method="score_task")
     def score_task(self, task_id: str, direction: str = "up") -> None:
         """See https://habitica.com/apidoc/#api-Task-ScoreTask."""
-        return self.user.tasks(_id=task_id, _direction=direction, _method="post")
+        return self._request(_ENDPOINT_SCORE_TASK, path_params={"task_id": task_id, "direction": direction})
 
+    @HABITICA_API_SECONDS.timed(method="delete_task")
     def delete_task(self, task_id: str) -> None:
         """See https://habitica.com/apidoc/#api-Task-DeleteTask."""
-        return self.user.tasks(_id=task_id, _method="delete")
+        return self._request(_ENDPOINT_DELETE_TASK, path_params={"task_id": task_id})
+
+    @HABITICA_API_SECONDS.timed(method="get_completed_todos")
+    def get_completed_todos(self) -> list[dict[str, Any]]:
+        """See https://habitica.com/apidoc/#api-Task-GetUserTasks."""
+        return self._request(_ENDPOINT_USER_TASKS, params={"type": "_allCompletedTodos"})
+
+    @HABITICA_API_SECONDS.timed(method="clear_completed_todos")
+    def clear_completed_todos(self) -> None:
+        """See https://habitica.com/apidoc/#api-Task-ClearCompletedTodos."""
+        return self._request(_ENDPOINT_CLEAR_COMPLETED_TODOS)
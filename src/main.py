@@ -1,22 +1,63 @@
 from __future__ import annotations
 
+import argparse
+import heapq
 import logging
+import math
+import queue
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager
+from enum import IntEnum
 from http import HTTPStatus
-from typing import Final
+from pathlib import Path
+from typing import TYPE_CHECKING, Final, TypeVar
 
 from pydantic import BaseModel, ConfigDict
 from requests import HTTPError
 
-from config import Settings, get_settings
-from delay import DelayTimer
-from habitica_api import HabiticaAPI, HabiticaAPIHeaders
+from config import Account, Settings, SyncMode, TodoistSyncMethod, get_settings
+from delay import AdaptiveSyncDelay, DelayTimer, exponential_backoff
+from difficulty_rules import DifficultyRules
+from habitica_api import HabiticaAPI, HabiticaAPIHeaders, shared_rate_limiter
+from metrics import REGISTRY, STATE_TRANSITIONS, render_gauge
 from models.generic_task import GenericTask
 from models.habitica import HabiticaDifficulty
-from models.todoist import TodoistPriority
+from models.todoist import CompletedSyncCursor, CompletedTask, IncrementalSyncCursor
 from tasks_cache import TasksCache
-from todoist_api import TodoistAPI
+from todoist_api import CompletedTasksPage, TodoistAPI
+
+if TYPE_CHECKING:  # Only imported when used, for a faster start
+    from concurrent.futures import ThreadPoolExecutor
+
+    from metrics_server import MetricsServer
+    from traffic import Traffic, TrafficRecorder
 
 _LOGGER = logging.getLogger(__name__)
+_MAX_TASKS_PER_CREATE_REQUEST: Final[int] = 100
+_RETRY_BASE_DELAY_SECONDS: Final[int] = 60
+_RETRY_MAX_DELAY_SECONDS: Final[int] = 6 * 60 * 60
+_DONE_STATE: Final[str] = "Done"
+_TODOIST_STATE: Final[str] = "Todoist"
+_SECONDS_PER_DAY: Final[int] = 24 * 60 * 60
+_LEASE_SECONDS: Final[int] = 5 * 60
+_LEASE_RENEWAL_SECONDS: Final[int] = _LEASE_SECONDS // 3
+_ACCOUNT_TIME_SLICE_SECONDS: Final[int] = 60
+_MAX_ACCOUNT_WORKERS: Final[int] = 8
+
+_T = TypeVar("_T")
+
+
+class ExitCode(IntEnum):
+    SUCCESS = 0
+    TODOIST_SYNC_FAILED = 1
+    TASKS_PENDING = 2
+    """Some tasks are waiting for a retry or were not processed within the time budget."""
 
 
 class FSMState(BaseModel):
@@ -29,11 +70,24 @@ class FSMState(BaseModel):
 
     def _set_state(self, state_cls: type[FSMState]) -> None:
         if self.__class__ is not state_cls:  # transition to a different state
-            self.context.set_state(state_cls(**self.model_dump()))
+            self.context.set_state(state_cls(context=self.context, generic_task=self.generic_task))
 
     def next_state(self) -> None:
         raise NotImplementedError
 
+    @classmethod
+    def next_states(cls, context: TasksSync, generic_tasks: list[GenericTask]) -> None:
+        """Move all given tasks in this state to their next state, concurrently."""
+
+        def next_state(generic_task: GenericTask) -> None:
+            try:
+                cls(context=context, generic_task=generic_task).next_state()
+            except OSError as ex:
+                _LOGGER.error(f"Unexpected network error when processing task '{generic_task.content}': {str(ex)}")
+                context.retry_later([generic_task])
+
+        context.run_concurrently(next_state, generic_tasks)
+
     @classmethod
     def name(cls) -> str:
         return cls.__name__.replace("State", "")
@@ -43,23 +97,43 @@ class FSMState(BaseModel):
         cls._STATES[state_cls.name()] = state_cls
 
     @classmethod
-    def factory(cls, context: TasksSync, generic_task: GenericTask) -> FSMState:
-        return cls._STATES[generic_task.state](context=context, generic_task=generic_task)
+    def states(cls) -> list[type[FSMState]]:
+        """All states in the order of registration, which is the order they are processed in."""
+        return list(cls._STATES.values())
 
 
 class StateHabiticaNew(FSMState):
     def next_state(self) -> None:
-        self.generic_task.habitica_task_id = self.context.habitica.create_task(
-            self.generic_task.content, self.generic_task.difficulty
-        )["id"]
-        self._set_state(StateHabiticaCreated)
+        """Tasks in this state are created in bulk by `next_states`."""
+
+    @classmethod
+    def next_states(cls, context: TasksSync, generic_tasks: list[GenericTask]) -> None:
+        """Create Habitica tasks for all given tasks in as few requests as possible."""
+
+        def create_batch(batch: list[GenericTask]) -> None:
+            habitica_tasks = context.habitica.create_tasks(
+                [(generic_task.content, generic_task.difficulty) for generic_task in batch]
+            )
+            for generic_task, habitica_task in zip(batch, habitica_tasks, strict=True):
+                generic_task.habitica_task_id = habitica_task["id"]
+            context.set_states(StateHabiticaCreated, batch)
+
+        context.run_concurrently(
+            create_batch,
+            [
+                generic_tasks[start : start + _MAX_TASKS_PER_CREATE_REQUEST]
+                for start in range(0, len(generic_tasks), _MAX_TASKS_PER_CREATE_REQUEST)
+            ],
+        )
 
 
 class StateHabiticaCreated(FSMState):
     def next_state(self) -> None:
         try:
             self.context.habitica.score_task(self.generic_task.get_habitica_task_id())
-            next_state: type[FSMState] = StateHabiticaFinished
+            next_state: type[FSMState] = (
+                StateHabiticaAwaitingDeletion if self.context.habitica_bulk_cleanup else StateHabiticaFinished
+            )
         except HTTPError as ex:
             if ex.response is not None and ex.response.status_code == HTTPStatus.NOT_FOUND:
                 next_state = StateHabiticaNew
@@ -83,9 +157,94 @@ class StateHabiticaFinished(FSMState):
         self.context.delete_state(self.generic_task)
 
 
+class StateHabiticaAwaitingDeletion(FSMState):
+    def next_state(self) -> None:
+        """Tasks in this state are deleted in bulk by `next_states`."""
+
+    @classmethod
+    def next_states(cls, context: TasksSync, generic_tasks: list[GenericTask]) -> None:
+        """Delete all given tasks by clearing completed To Do's, if no other completed To Do's would be lost.
+
+        Habitica can only clear all completed To Do's, so a To Do completed by the user between the check and the
+        clear is lost. This is why `HABITICA_BULK_CLEANUP` is disabled by default.
+        """
+        if not generic_tasks:
+            return
+
+        own_task_ids = {generic_task.get_habitica_task_id() for generic_task in generic_tasks}
+        completed_task_ids = {habitica_task["id"] for habitica_task in context.habitica.get_completed_todos()}
+
+        if foreign_task_ids := completed_task_ids - own_task_ids:
+            _LOGGER.warning(
+                f"Found {len(foreign_task_ids)} completed To Do's in Habitica not created by the sync. "
+                "Deleting finished tasks one by one instead."
+            )
+            StateHabiticaFinished.next_states(context, generic_tasks)
+            return
+
+        context.habitica.clear_completed_todos()
+        context.delete_states(generic_tasks)
+
+
+class StateHabiticaHabit(FSMState):
+    def next_state(self) -> None:
+        habit_id = self.context.habitica_habit_id(self.generic_task.difficulty)
+        try:
+            self.context.habitica.score_task(habit_id)
+        except HTTPError as ex:
+            if ex.response is not None and ex.response.status_code == HTTPStatus.NOT_FOUND:
+                _LOGGER.warning(f"Habitica habit for '{self.generic_task.difficulty.name}' not found. Re-creating it.")
+                self.context.forget_habitica_habit(self.generic_task.difficulty)
+                return
+            raise ex
+
+        self.context.delete_state(self.generic_task)
+
+
+class StateDeadLetter(FSMState):
+    """Tasks that failed too many times. They are not processed anymore, but kept for inspection."""
+
+    def next_state(self) -> None:
+        pass
+
+
+# Tasks move through the states in one sync, as long as states are registered in the order of the transitions
 FSMState.register(StateHabiticaNew)
 FSMState.register(StateHabiticaCreated)
 FSMState.register(StateHabiticaFinished)
+FSMState.register(StateHabiticaAwaitingDeletion)
+FSMState.register(StateHabiticaHabit)
+
+
+def _start_metrics_server(
+    settings: Settings, collect_tasks_metrics: Callable[[], Iterable[str]]
+) -> MetricsServer | None:
+    if settings.metrics_port is None:
+        return None
+
+    from metrics_server import MetricsServer  # pylint: disable=import-outside-toplevel
+
+    metrics_server = MetricsServer(settings.metrics_port)
+    REGISTRY.register_collector(collect_tasks_metrics)
+    metrics_server.start()
+    return metrics_server
+
+
+def _render_tasks_metrics(tasks_stats: dict[str, tuple[int, float]]) -> Iterable[str]:
+    now = time.time()
+    pending_created_at = [
+        oldest_created_at for state, (_, oldest_created_at) in tasks_stats.items() if state != StateDeadLetter.name()
+    ]
+    yield from render_gauge(
+        "sync_tasks",
+        "Number of tasks in each sync state.",
+        (({"state": state}, count) for state, (count, _) in tasks_stats.items()),
+    )
+    yield from render_gauge(
+        "sync_backlog_age_seconds",
+        "Age of the oldest task waiting to be synced to Habitica.",
+        [({}, now - min(pending_created_at) if pending_created_at else 0)],
+    )
 
 
 class TasksSync:  # pylint: disable=too-few-public-methods
@@ -95,84 +254,577 @@ class TasksSync:  # pylint: disable=too-few-public-methods
     Habitica API: https://habitica.com/apidoc
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        account: Account | None = None,
+        executor: ThreadPoolExecutor | None = None,
+        traffic: Traffic | None = None,
+        database_file: Path | None = None,
+    ):
+        """Constructor.
+
+        Args:
+            account: Account to sync. The main account from settings if not set.
+            executor: Threads to sync tasks concurrently on, shared with other accounts. If not set, the sync creates
+                its own threads when `SYNC_CONCURRENCY` is higher than one.
+            traffic: Records or replays all API requests. If not set, requests are recorded to
+                `TRAFFIC_RECORD_FILE` when it is set.
+            database_file: Sync cache to use instead of the one of the account.
+        """
         settings = get_settings()
-
-        self.habitica = HabiticaAPI(
-            HabiticaAPIHeaders(user_id=settings.habitica_user_id, api_key=settings.habitica_api_key)
-        )
+        account = settings.all_accounts[0] if account is None else account
 
         self._log = logging.getLogger(self.__class__.__name__)
 
-        self._task_cache = TasksCache()
-        self._todoist = TodoistAPI(settings.todoist_api_key, self._task_cache.last_sync_datetime_utc)
-        self._todoist_user_id = settings.todoist_user_id
+        self._traffic_recorder: TrafficRecorder | None = None
+        if traffic is None and settings.traffic_record_file is not None:
+            from traffic import TrafficRecorder  # pylint: disable=import-outside-toplevel
 
+            traffic = self._traffic_recorder = TrafficRecorder(settings.traffic_record_file)
+
+        self._task_cache = TasksCache(
+            settings.account_database_file(account) if database_file is None else database_file
+        )
+        self.habitica = HabiticaAPI(
+            HabiticaAPIHeaders(user_id=account.habitica_user_id, api_key=account.habitica_api_key),
+            rate_limiter=shared_rate_limiter(self._task_cache, account.habitica_user_id),
+            timeout=(settings.habitica_connect_timeout_seconds, settings.habitica_read_timeout_seconds),
+            max_connections=settings.sync_concurrency,
+            traffic=traffic,
+        )
+        self._todoist_task_filter = settings.todoist_task_filter(account)
+        self._todoist = TodoistAPI(
+            account.todoist_api_key,
+            task_filter=self._todoist_task_filter,
+            timeout=(settings.todoist_connect_timeout_seconds, settings.todoist_read_timeout_seconds),
+            traffic=traffic,
+        )
+        self._todoist_sync_method = settings.todoist_sync_method
+        self._habitica_bulk_cleanup = settings.habitica_bulk_cleanup
+        self._difficulty_rules = DifficultyRules.from_settings(
+            settings.difficulty_rules, settings.label_to_difficulty, settings.priority_to_difficulty
+        )
+        self._max_task_attempts = settings.max_task_attempts
+        self._completions_retention_seconds = settings.completions_retention_days * _SECONDS_PER_DAY
+        self._initial_state: type[FSMState] = (
+            StateHabiticaHabit if settings.sync_mode is SyncMode.HABIT else StateHabiticaNew
+        )
+
+        # Each state is processed for all tasks before the next one, which keeps the order of transitions per task
+        self._executor = executor
+        self._owns_executor = executor is None and settings.sync_concurrency > 1
+        if self._owns_executor:
+            from concurrent.futures import ThreadPoolExecutor  # pylint: disable=import-outside-toplevel
+
+            self._executor = ThreadPoolExecutor(settings.sync_concurrency, thread_name_prefix="sync")
+        self._habits_lock = threading.Lock()
+        self._deadline = math.inf
+
+        # Tasks are leased to this worker while processed, so other processes sharing the cache skip them
+        self._worker_id = uuid.uuid4().hex
+        self._max_claimed_tasks = settings.sync_concurrency * _MAX_TASKS_PER_CREATE_REQUEST
+
+        self._wake_up = threading.Event()
+        self._sync_delay = AdaptiveSyncDelay(
+            settings.sync_delay_seconds,
+            settings.max_sync_delay_seconds or settings.sync_delay_seconds,
+            settings.quiet_hours,
+        )
         self._sync_sleep: Final[DelayTimer] = DelayTimer(
-            settings.sync_delay_seconds, "Next check in {delay:.0f} seconds."
+            settings.sync_delay_seconds, "Next check in {delay:.0f} seconds.", self._wake_up
         )
+        self._todoist_sync_due_at = -math.inf
 
     def run_forever(self) -> None:
+        # pylint: disable=import-outside-toplevel
+        settings = get_settings()
+
+        metrics_server = _start_metrics_server(settings, self._collect_tasks_metrics)
+
+        webhook_server = None
+        if settings.webhook_port is not None and settings.todoist_client_secret is not None:
+            from todoist_webhook import TodoistWebhookServer
+
+            webhook_server = TodoistWebhookServer(
+                settings.webhook_port,
+                settings.todoist_client_secret,
+                self._on_webhook_completed,
+                task_filter=self._todoist_task_filter,
+            )
+            webhook_server.start()
+
+        woken_up = False
         while True:
+            if not woken_up:  # Tasks received by a webhook are queued already and only need processing
+                self._sync_sleep.max_delay = self._sync_delay(self._queue_todoist_completed_tasks() or 0)
+
             try:
-                self._task_cache.last_sync_datetime_utc = self._todoist.sync()
                 self._next_tasks_state()
             except OSError as ex:
                 self._log.error(f"Unexpected network error: {ex}")
+            except sqlite3.OperationalError as ex:
+                self._log.error(f"Unexpected database error: {ex}")
 
             try:
-                self._sync_sleep()
+                woken_up = not self._sync_sleep()
             except KeyboardInterrupt:
                 break
 
+        if webhook_server is not None:
+            webhook_server.stop()
+        if metrics_server is not None:
+            metrics_server.stop()
+        self.close()
+
+    def run_once(self, time_budget: float | None = None) -> ExitCode:
+        """Sync once and process queued tasks until none is due.
+
+        Args:
+            time_budget: Seconds after which no more tasks are processed. Tasks already being processed finish.
+        """
+        exit_code = self._sync_once(time_budget)
+        self.close()
+        return exit_code
+
+    @classmethod
+    def replay(cls, traffic_file: Path, speedup: float) -> ExitCode:
+        """Sync against traffic recorded with `TRAFFIC_RECORD_FILE`, instead of the APIs.
+
+        Recorded Todoist syncs are replayed one after another, each followed by processing the queued tasks. The sync
+        starts with an empty cache in a temporary directory, so the real one is not touched.
+
+        Args:
+            traffic_file: Recorded traffic.
+            speedup: How many times faster than recorded the APIs respond. Infinite to respond immediately.
+
+        Returns:
+            The exit code of the last replayed sync.
+        """
+        from traffic import TrafficReplay  # pylint: disable=import-outside-toplevel
+
+        traffic = TrafficReplay(traffic_file, speedup)
+        exit_code = ExitCode.SUCCESS
+        start = time.perf_counter()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            tasks_sync = cls(traffic=traffic, database_file=Path(temp_dir) / "sync_cache.sqlite")
+            while pending := traffic.pending(TodoistAPI.TRAFFIC_SERVICE):
+                exit_code = tasks_sync._sync_once()
+                if traffic.pending(TodoistAPI.TRAFFIC_SERVICE) == pending:  # Recorded with another sync method
+                    break
+            tasks_sync.close()
+
+        _LOGGER.info(
+            f"Replayed {traffic.total - traffic.pending()} of {traffic.total} recorded requests "
+            f"in {time.perf_counter() - start:.2f}s."
+        )
+        return exit_code
+
+    def _sync_once(self, time_budget: float | None = None) -> ExitCode:
+        if time_budget is not None:
+            self._deadline = time.monotonic() + time_budget
+
+        todoist_synced = self._queue_todoist_completed_tasks() is not None
+        registered_states = [state_cls.name() for state_cls in FSMState.states()]
+        while time.monotonic() < self._deadline:
+            try:
+                self._next_tasks_state()
+            except OSError as ex:
+                self._log.error(f"Unexpected network error: {ex}")
+            except sqlite3.OperationalError as ex:
+                self._log.error(f"Unexpected database error: {ex}")
+            if not self._task_cache.count_tasks(registered_states, due_at=time.time()):
+                break
+
+        pending_tasks = self._task_cache.count_tasks(registered_states)
+
+        if not todoist_synced:
+            return ExitCode.TODOIST_SYNC_FAILED
+        if pending_tasks:
+            self._log.warning(f"{pending_tasks} tasks are still waiting to be synced to Habitica.")
+            return ExitCode.TASKS_PENDING
+        return ExitCode.SUCCESS
+
+    def sync_cycle(self, time_slice: float) -> float:
+        """Sync Todoist if due and process due tasks, for at most given time. Used to share threads between accounts.
+
+        Returns:
+            Seconds until the next cycle is due. Zero if due tasks are left because the time slice ran out.
+        """
+        self._deadline = time.monotonic() + time_slice
+        if time.monotonic() >= self._todoist_sync_due_at:
+            sync_delay = self._sync_delay(self._queue_todoist_completed_tasks() or 0)
+            self._todoist_sync_due_at = time.monotonic() + sync_delay
+
+        try:
+            self._next_tasks_state()
+        except OSError as ex:
+            self._log.error(f"Unexpected network error: {ex}")
+        except sqlite3.OperationalError as ex:
+            self._log.error(f"Unexpected database error: {ex}")
+
+        if self._task_cache.count_tasks([_.name() for _ in FSMState.states()], due_at=time.time()):
+            return 0
+        return max(0.0, self._todoist_sync_due_at - time.monotonic())
+
+    def close(self) -> None:
+        if self._owns_executor and self._executor is not None:
+            self._executor.shutdown()
+        self.habitica.close()
+        self._todoist.close()
+        self._task_cache.close()
+        if self._traffic_recorder is not None:
+            self._traffic_recorder.close()
+
+    def _queue_todoist_completed_tasks(self) -> int | None:
+        """Queue tasks completed in Todoist since the last sync.
+
+        Returns:
+            Number of newly queued tasks, or `None` if the sync failed. Tasks synced before the failure are queued.
+        """
+        completed_tasks = 0
+        try:
+            # Each page is committed with its cursor before the next one is fetched, outside of any transaction
+            for completed_tasks_page in self._sync_todoist():
+                completed_tasks += self._queue_completed_tasks(completed_tasks_page.items, completed_tasks_page.cursor)
+            if forgotten := self._task_cache.forget_completions(time.time() - self._completions_retention_seconds):
+                self._log.debug(f"Forgot {forgotten} completions older than the retention period.")
+        except OSError as ex:
+            self._log.error(f"Unexpected network error: {ex}")
+            return None
+        except sqlite3.OperationalError as ex:  # E.g. locked by another process for too long, retried next time
+            self._log.error(f"Unexpected database error: {ex}")
+            return None
+        return completed_tasks
+
+    def tasks_stats(self) -> dict[str, tuple[int, float]]:
+        return self._task_cache.tasks_stats()
+
+    def _collect_tasks_metrics(self) -> Iterable[str]:
+        return _render_tasks_metrics(self.tasks_stats())
+
+    def _on_webhook_completed(self, completed_task: CompletedTask) -> None:
+        self._queue_completed_tasks([completed_task])
+        self._wake_up.set()
+
+    def _sync_todoist(self) -> Iterator[CompletedTasksPage]:
+        if self._todoist_sync_method is TodoistSyncMethod.INCREMENTAL:
+            return self._todoist.sync_incremental(
+                self._task_cache.todoist_sync_token, self._task_cache.get_todoist_item_snapshots
+            )
+        return self._todoist.sync(self._task_cache.completed_sync_cursor)
+
+    def run_concurrently(self, func: Callable[[_T], None], items: list[_T]) -> None:
+        """Call `func` for each item, concurrently if enabled. Returns once all calls finished.
+
+        Items not started before the deadline of `run_once` are skipped.
+
+        Raises:
+            Exception: The first exception raised by any of the calls, once all of them finished.
+        """
+
+        def call_before_deadline(item: _T) -> None:
+            if time.monotonic() < self._deadline:
+                func(item)
+
+        if self._executor is None or len(items) < 2:  # noqa: PLR2004
+            for item in items:
+                call_before_deadline(item)
+            return
+
+        futures = [self._executor.submit(call_before_deadline, item) for item in items]
+        for future in futures:
+            future.exception()  # Wait for all calls, so that none is still running when an error is raised
+        for future in futures:
+            future.result()
+
     def set_state(self, state: FSMState) -> None:
         if state.generic_task.state != (new_state := state.name()):
             self._log.info(f"'{state.generic_task.content}' {state.generic_task.state} -> {new_state}")
+            STATE_TRANSITIONS.inc(from_state=state.generic_task.state, to_state=new_state)
             state.generic_task.state = new_state
+            state.generic_task.attempts = 0
+            state.generic_task.next_attempt_at = 0
             self._task_cache.save_task(state.generic_task)
 
+    def set_states(self, state_cls: type[FSMState], generic_tasks: list[GenericTask]) -> None:
+        new_state = state_cls.name()
+        for generic_task in generic_tasks:
+            self._log.info(f"'{generic_task.content}' {generic_task.state} -> {new_state}")
+            STATE_TRANSITIONS.inc(from_state=generic_task.state, to_state=new_state)
+            generic_task.state = new_state
+            generic_task.attempts = 0
+            generic_task.next_attempt_at = 0
+        self._task_cache.save_tasks(generic_tasks)
+
+    def retry_later(self, generic_tasks: list[GenericTask]) -> None:
+        """Schedule another attempt for tasks that failed to move to the next state, or give up on them."""
+        for generic_task in generic_tasks:
+            generic_task.attempts += 1
+            if generic_task.attempts >= self._max_task_attempts:
+                self._log.error(
+                    f"'{generic_task.content}' failed {generic_task.attempts} times in {generic_task.state}. "
+                    f"Giving up. {generic_task.state} -> {StateDeadLetter.name()}"
+                )
+                STATE_TRANSITIONS.inc(from_state=generic_task.state, to_state=StateDeadLetter.name())
+                generic_task.state = StateDeadLetter.name()
+                continue
+
+            delay = exponential_backoff(generic_task.attempts, _RETRY_BASE_DELAY_SECONDS, _RETRY_MAX_DELAY_SECONDS)
+            generic_task.next_attempt_at = time.time() + delay
+            self._log.info(f"'{generic_task.content}' will be retried in {delay:.0f} seconds.")
+        self._task_cache.save_tasks(generic_tasks)
+
     def delete_state(self, generic_task: GenericTask) -> None:
         self._log.info(f"'{generic_task.content}' done.")
+        STATE_TRANSITIONS.inc(from_state=generic_task.state, to_state=_DONE_STATE)
         self._task_cache.delete_task(generic_task)
 
-    @staticmethod
-    def _get_task_difficulty(settings: Settings, labels: list[str], priority: TodoistPriority) -> HabiticaDifficulty:
-        label_difficulties = [
-            settings.label_to_difficulty[label_lower]
-            for label in labels
-            if (label_lower := label.lower()) in settings.label_to_difficulty
-        ]
-        if label_difficulties:
-            return max(label_difficulties)
-        return settings.priority_to_difficulty[priority]
+    def delete_states(self, generic_tasks: list[GenericTask]) -> None:
+        for generic_task in generic_tasks:
+            self._log.info(f"'{generic_task.content}' done.")
+            STATE_TRANSITIONS.inc(from_state=generic_task.state, to_state=_DONE_STATE)
+        self._task_cache.delete_tasks(generic_tasks)
 
-    @property
-    def todoist_user_id(self) -> str | None:
-        return self._todoist_user_id
+    def habitica_habit_id(self, difficulty: HabiticaDifficulty) -> str:
+        """Get ID of the habit scored for tasks of given difficulty, creating all missing habits first."""
+        if (habit_id := self._task_cache.get_habitica_habit_id(difficulty)) is not None:
+            return habit_id
 
-    def _next_tasks_state(self) -> None:
-        for todoist_completed_task in self._todoist.iter_pop_newly_completed_tasks():  # pylint: disable=no-member
-            generic_task = GenericTask(
-                content=todoist_completed_task.item_object.content,
-                difficulty=self._get_task_difficulty(
-                    get_settings(),
-                    todoist_completed_task.item_object.labels,
-                    TodoistPriority(todoist_completed_task.item_object.priority),
-                ),
-                state=StateHabiticaNew.name(),
+        with self._habits_lock:  # Concurrently processed tasks must not create the habits twice
+            missing = [_ for _ in HabiticaDifficulty if self._task_cache.get_habitica_habit_id(_) is None]
+            if missing:
+                habits = self.habitica.create_tasks(
+                    [(f"Todoist task ({_.name.lower()})", _) for _ in missing], task_type="habit"
+                )
+                for missing_difficulty, habit in zip(missing, habits, strict=True):
+                    self._log.info(f"Created Habitica habit for '{missing_difficulty.name}' tasks.")
+                    self._task_cache.set_habitica_habit_id(missing_difficulty, habit["id"])
+
+        return self._task_cache.get_habitica_habit_id(difficulty)  # type: ignore[return-value]
+
+    def forget_habitica_habit(self, difficulty: HabiticaDifficulty) -> None:
+        self._task_cache.set_habitica_habit_id(difficulty, None)
+
+    @property
+    def habitica_bulk_cleanup(self) -> bool:
+        return self._habitica_bulk_cleanup
+
+    def _queue_completed_tasks(
+        self,
+        completed_tasks: list[CompletedTask],
+        sync_cursor: CompletedSyncCursor | IncrementalSyncCursor | None = None,
+    ) -> int:
+        """Queue tasks for completions not seen before.
+
+        Returns:
+            Number of newly queued tasks.
+        """
+        completed_tasks = completed_tasks[::-1]  # oldest first
+        generic_tasks = {
+            (completed_task.task_id, completed_task.completed_at): GenericTask(
+                content=completed_task.content, difficulty=difficulty, state=self._initial_state.name()
             )
-            self._task_cache.save_task(generic_task)
+            for completed_task, difficulty in zip(
+                completed_tasks, self._difficulty_rules.classify(completed_tasks), strict=True
+            )
+        }
+        new_tasks = self._task_cache.save_new_tasks(generic_tasks, sync_cursor=sync_cursor)
+        for generic_task in new_tasks:
             self._log.info(f"'{generic_task.content}' -> {generic_task.state}")
+            STATE_TRANSITIONS.inc(from_state=_TODOIST_STATE, to_state=generic_task.state)
+        return len(new_tasks)
+
+    @contextmanager
+    def _leased(self) -> Iterator[None]:
+        """Renew leases of the tasks claimed by this worker while they are processed, and release them afterwards."""
+        stop = threading.Event()
+
+        def renew() -> None:
+            while not stop.wait(_LEASE_RENEWAL_SECONDS):
+                try:
+                    self._task_cache.renew_leases(self._worker_id, _LEASE_SECONDS)
+                except sqlite3.OperationalError as ex:  # Renewed again well before the leases expire
+                    self._log.warning(f"Failed to renew leases, retrying in {_LEASE_RENEWAL_SECONDS} seconds: {ex}")
+
+        heartbeat = threading.Thread(target=renew, name="lease-heartbeat", daemon=True)
+        heartbeat.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            heartbeat.join()
+            self._task_cache.release_tasks(self._worker_id)
+
+    def _next_tasks_state(self) -> None:
+        due_at = time.time()  # Tasks scheduled for a retry while processing wait for the next sync
+        for state_cls in FSMState.states():
+            while time.monotonic() < self._deadline:
+                generic_tasks = self._task_cache.claim_tasks(
+                    state_cls.name(), self._worker_id, _LEASE_SECONDS, due_at, self._max_claimed_tasks
+                )
+                if not generic_tasks:
+                    break
+                with self._leased():
+                    try:
+                        state_cls.next_states(self, generic_tasks)
+                    except OSError as ex:
+                        self._log.error(
+                            f"Unexpected network error when processing '{state_cls.name()}' tasks: {str(ex)}"
+                        )
+                        # Batches processed before the error have moved on already
+                        self.retry_later([_ for _ in generic_tasks if _.state == state_cls.name()])
+                if len(generic_tasks) < self._max_claimed_tasks:  # All due tasks were claimed
+                    break
+
+
+class AccountsSync:
+    """Syncs multiple accounts in one process.
+
+    Accounts take turns on a shared pool of threads, in the order their next sync is due. Each turn is limited to
+    a time slice, so an account with a large backlog does not hold back the others.
+    """
+
+    def __init__(self, accounts: list[Account]):
+        from concurrent.futures import ThreadPoolExecutor  # pylint: disable=import-outside-toplevel
+
+        settings = get_settings()
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._sync_delay_seconds = settings.sync_delay_seconds
+        self._tasks_executor: ThreadPoolExecutor | None = None
+        if settings.sync_concurrency > 1:
+            self._tasks_executor = ThreadPoolExecutor(settings.sync_concurrency, thread_name_prefix="sync")
+        self._traffic_recorder: TrafficRecorder | None = None
+        if settings.traffic_record_file is not None:
+            from traffic import TrafficRecorder  # pylint: disable=import-outside-toplevel
+
+            self._traffic_recorder = TrafficRecorder(settings.traffic_record_file)
+        self._tasks_syncs = [TasksSync(account, self._tasks_executor, self._traffic_recorder) for account in accounts]
+        self._accounts_executor = ThreadPoolExecutor(
+            min(len(accounts), _MAX_ACCOUNT_WORKERS), thread_name_prefix="account"
+        )
+
+    def run_forever(self) -> None:
+        metrics_server = _start_metrics_server(get_settings(), self._collect_tasks_metrics)
+        try:
+            self._schedule_turns()
+        except KeyboardInterrupt:
+            pass
+        if metrics_server is not None:
+            metrics_server.stop()
+        self.close()
+
+    def run_once(self, time_budget: float | None = None) -> ExitCode:
+        """Run `TasksSync.run_once` for all accounts concurrently.
+
+        Returns:
+            `TODOIST_SYNC_FAILED` if the Todoist sync of any account failed, the highest exit code of all accounts
+            otherwise.
+        """
+        exit_codes = list(
+            self._accounts_executor.map(lambda tasks_sync: tasks_sync.run_once(time_budget), self._tasks_syncs)
+        )
+        self.close()
+        if ExitCode.TODOIST_SYNC_FAILED in exit_codes:  # Not hidden by tasks pending in another account
+            return ExitCode.TODOIST_SYNC_FAILED
+        return max(exit_codes)
+
+    def close(self) -> None:
+        self._accounts_executor.shutdown()
+        for tasks_sync in self._tasks_syncs:
+            tasks_sync.close()
+        if self._tasks_executor is not None:
+            self._tasks_executor.shutdown()
+        if self._traffic_recorder is not None:
+            self._traffic_recorder.close()
+
+    def _schedule_turns(self) -> None:
+        due_at = [(time.monotonic(), index) for index in range(len(self._tasks_syncs))]
+        finished: queue.SimpleQueue[tuple[int, float]] = queue.SimpleQueue()
+
+        while True:
+            # Turns wait for a free thread in the order they were due, so accounts going again are queued last
+            while due_at and due_at[0][0] <= time.monotonic():
+                _, index = heapq.heappop(due_at)
+                self._accounts_executor.submit(self._turn, index, finished)
 
-        for generic_task in self._task_cache.in_progress_tasks():
             try:
-                state = FSMState.factory(self, generic_task)
-                state.next_state()
-            except OSError as ex:
-                self._log.error(f"Unexpected network error when processing task '{generic_task.content}': {str(ex)}")
+                index, delay = finished.get(timeout=max(0.0, due_at[0][0] - time.monotonic()) if due_at else None)
+            except queue.Empty:
+                continue
+            heapq.heappush(due_at, (time.monotonic() + delay, index))
 
+    def _turn(self, index: int, finished: queue.SimpleQueue[tuple[int, float]]) -> None:
+        delay: float = self._sync_delay_seconds
+        try:
+            delay = self._tasks_syncs[index].sync_cycle(_ACCOUNT_TIME_SLICE_SECONDS)
+        except Exception:  # pylint: disable=broad-exception-caught
+            self._log.exception(f"Sync of account {index} failed, retrying in {delay} seconds.")
+        finally:
+            finished.put((index, delay))
+
+    def _collect_tasks_metrics(self) -> Iterable[str]:
+        tasks_stats: dict[str, tuple[int, float]] = {}
+        for tasks_sync in self._tasks_syncs:
+            for state, (count, oldest_created_at) in tasks_sync.tasks_stats().items():
+                total_count, total_oldest_created_at = tasks_stats.get(state, (0, math.inf))
+                tasks_stats[state] = (total_count + count, min(oldest_created_at, total_oldest_created_at))
+        return _render_tasks_metrics(tasks_stats)
+
+
+def _speedup(value: str) -> float:
+    if value == "max":
+        return math.inf
+    if (speedup := float(value)) <= 0:
+        raise argparse.ArgumentTypeError("must be positive")
+    return speedup
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="One way synchronisation from Todoist to Habitica.")
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help=(
+            f"Sync once, process all queued tasks and exit. Exits with {ExitCode.TODOIST_SYNC_FAILED.value} "
+            f"if Todoist could not be synced and {ExitCode.TASKS_PENDING.value} if some tasks are left to sync."
+        ),
+    )
+    parser.add_argument(
+        "--time-budget",
+        type=float,
+        metavar="SECONDS",
+        help="With --once, stop processing tasks after this many seconds.",
+    )
+    parser.add_argument(
+        "--replay",
+        type=Path,
+        metavar="FILE",
+        help=(
+            "Sync against traffic recorded with TRAFFIC_RECORD_FILE instead of the APIs, with an empty temporary "
+            "sync cache, and exit."
+        ),
+    )
+    parser.add_argument(
+        "--replay-speedup",
+        type=_speedup,
+        default=1.0,
+        metavar="FACTOR",
+        help="With --replay, how many times faster than recorded the APIs respond, or 'max' to respond immediately.",
+    )
+    args = parser.parse_args(argv)
 
-if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, format="%(asctime)s (%(name)s) [%(levelname)s]: %(message)s")
 
-    TasksSync().run_forever()
+    if args.replay is not None:
+        return TasksSync.replay(args.replay, args.replay_speedup)
+
+    settings = get_settings()
+    tasks_sync = AccountsSync(settings.all_accounts) if settings.accounts else TasksSync()
+    if args.once:
+        return tasks_sync.run_once(args.time_budget)
+    tasks_sync.run_forever()
+    return ExitCode.SUCCESS
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+"""Metrics in the Prometheus text exposition format.
+
+All metrics are disabled by default. Until `REGISTRY.enable()` is called, recording a value costs a single attribute
+check and nothing is stored.
+
+See https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+
+import functools
+import threading
+import time
+from collections.abc import Callable, Iterable
+from typing import Any, Final, TypeVar
+
+_DEFAULT_BUCKETS: Final[tuple[float, ...]] = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_FuncT = TypeVar("_FuncT", bound=Callable[..., Any])
+Sample = tuple[str, dict[str, str], float]
+"""Name suffix, labels and value of a single sample."""
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = {
+        name: value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for name, value in labels.items()
+    }
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Registry:
+    """Holds all metrics and renders them. Collectors are called at scrape time for values read on demand."""
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self._metrics: list[_Metric] = []
+        self._collectors: list[Callable[[], Iterable[str]]] = []
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def register(self, metric: "_Metric") -> None:
+        self._metrics.append(metric)
+
+    def register_collector(self, collector: Callable[[], Iterable[str]]) -> None:
+        """Register a function returning already rendered lines, called on every scrape."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY: Final[Registry] = Registry()
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = (), registry: Registry = REGISTRY):
+        self.name = name
+        self._documentation = documentation
+        self._label_names = label_names
+        self._registry = registry
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    @property
+    def enabled(self) -> bool:
+        return self._registry.enabled
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        return tuple(labels[name] for name in self._label_names)
+
+    def _samples(self) -> Iterable[Sample]:
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self._documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            samples = list(self._samples())
+        lines.extend(
+            f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}" for suffix, labels, value in samples
+        )
+        return lines
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = (), registry: Registry = REGISTRY):
+        super().__init__(name, documentation, label_names, registry)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        if not self._registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> Iterable[Sample]:
+        for key, value in self._values.items():
+            yield "", dict(zip(self._label_names, key, strict=True)), value
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = _DEFAULT_BUCKETS,
+        registry: Registry = REGISTRY,
+    ):
+        super().__init__(name, documentation, label_names, registry)
+        self._buckets = buckets
+        self._values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        if not self._registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            bucket_counts, total = self._values.setdefault(key, ([0] * (len(self._buckets) + 1), [0.0]))
+            for index, upper_bound in enumerate(self._buckets):
+                if value <= upper_bound:
+                    bucket_counts[index] += 1
+                    break
+            else:
+                bucket_counts[-1] += 1
+            total[0] += value
+
+    def timed(self, **labels: str) -> Callable[[_FuncT], _FuncT]:
+        """Decorator observing the duration of each call. Calls are not timed while metrics are disabled."""
+
+        def decorator(func: _FuncT) -> _FuncT:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self._registry.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - start, **labels)
+
+            return wrapper  # type: ignore[return-value]
+
+        return decorator
+
+    def _samples(self) -> Iterable[Sample]:
+        for key, (bucket_counts, total) in self._values.items():
+            labels = dict(zip(self._label_names, key, strict=True))
+            cumulative = 0
+            for upper_bound, count in zip((*self._buckets, float("inf")), bucket_counts, strict=True):
+                cumulative += count
+                yield "_bucket", {**labels, "le": _format_value(upper_bound)}, cumulative
+            yield "_sum", labels, total[0]
+            yield "_count", labels, cumulative
+
+
+def render_gauge(name: str, documentation: str, samples: Iterable[tuple[dict[str, str], float]]) -> list[str]:
+    """Render a gauge read at scrape time, for use in collectors."""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} gauge"]
+    lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for labels, value in samples)
+    return lines
+
+
+TODOIST_SYNC_SECONDS: Final[Histogram] = Histogram(
+    "todoist_sync_request_duration_seconds", "Duration of requests fetching completed tasks from Todoist.", ("method",)
+)
+HABITICA_API_SECONDS: Final[Histogram] = Histogram(
+    "habitica_api_call_duration_seconds",
+    "Duration of Habitica API calls, including time waiting for the rate limit.",
+    ("method",),
+)
+HABITICA_RATE_LIMIT_WAIT_SECONDS: Final[Counter] = Counter(
+    "habitica_rate_limit_wait_seconds_total", "Time spent blocked waiting for the Habitica rate limit."
+)
+STATE_TRANSITIONS: Final[Counter] = Counter(
+    "sync_state_transitions_total", "Number of task transitions between sync states.", ("from_state", "to_state")
+)
@@ -0,0 +1,62 @@
+import logging
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Final
+
+from metrics import REGISTRY, Registry
+
+_CONTENT_TYPE: Final[str] = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricsServer:
+    """Serves metrics of a registry on `/metrics`."""
+
+    def __init__(self, port: int, registry: Registry = REGISTRY, host: str = "0.0.0.0"):  # noqa: S104
+        """Constructor.
+
+        Args:
+            port: Port to listen on. Use 0 to pick a free port.
+            registry: Registry to serve. It is enabled by the constructor.
+            host: Interface to listen on.
+        """
+        registry.enable()
+        self._registry = registry
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self) -> None:
+        self._thread.start()
+        self._log.info(f"Serving metrics on port {self.port}.")
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler_class(self) -> type[BaseHTTPRequestHandler]:
+        metrics_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:  # noqa: N802
+                if self.path.split("?", maxsplit=1)[0] != "/metrics":
+                    self.send_response(HTTPStatus.NOT_FOUND)
+                    self.send_header("content-length", "0")
+                    self.end_headers()
+                    return
+
+                body = metrics_server._registry.render().encode()
+                self.send_response(HTTPStatus.OK)
+                self.send_header("content-type", _CONTENT_TYPE)
+                self.send_header("content-length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args) -> None:  # pylint: disable=redefined-builtin
+                metrics_server._log.debug(format % args)
+
+        return Handler
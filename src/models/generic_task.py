@@ -1,16 +1,21 @@
+import time
+from dataclasses import dataclass, field
 from uuid import UUID, uuid4
 
-from pydantic import BaseModel, Field
-
 from models.habitica import HabiticaDifficulty
 
 
-class GenericTask(BaseModel):
+@dataclass(slots=True)
+class GenericTask:
     content: str
     difficulty: HabiticaDifficulty
     state: str
     habitica_task_id: str | None = None
-    id: UUID = Field(default_factory=uuid4)
+    id: UUID = field(default_factory=uuid4)
+    created_at: float = field(default_factory=time.time)
+    attempts: int = 0
+    """Number of failed attempts to move the task to the next state."""
+    next_attempt_at: float = 0
 
     def get_habitica_task_id(self) -> str:
         if self.habitica_task_id is None:
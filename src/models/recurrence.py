@@ -0,0 +1,80 @@
+"""Recurrence of Todoist due dates, to tell a completed recurring task from a postponed one.
+
+Only the common English due strings are understood, e.g. `every day`, `every 2 weeks`, `every other month`,
+`every monday, friday` or `every weekday`. See https://todoist.com/help/articles/introduction-to-recurring-dates.
+"""
+
+import calendar
+import re
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+_WEEKDAYS = {
+    name: index
+    for index, day_name in enumerate(["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"])
+    for name in (day_name, day_name[:3])
+}
+_WEEKDAY_NAME = "|".join(sorted(_WEEKDAYS, key=len, reverse=True))
+_WEEKDAY = rf"(?:{_WEEKDAY_NAME})s?"
+_UNIT_ALIASES = {"daily": "day", "weekly": "week", "monthly": "month", "yearly": "year", "annually": "year"}
+_SUFFIX = re.compile(r"\s+(?:at|@|starting|from|until|for)\s.*$")
+_INTERVAL = re.compile(r"every(?P<strict>!)?\s+(?:(?P<count>\d+|other)\s+)?(?P<unit>day|week|month|year)s?")
+_PERIOD_OF_DAY = re.compile(r"every(?P<strict>!)?\s+(?:morning|afternoon|evening|night)")
+_WORKDAY = re.compile(r"every(?P<strict>!)?\s+(?:weekday|workday)s?")
+_WEEKDAY_LIST = re.compile(rf"every(?P<strict>!)?\s+(?P<days>{_WEEKDAY}(?:\s*(?:,|and|,\s*and)\s*{_WEEKDAY})*)")
+
+
+def _add_months(day: date, months: int) -> date:
+    year, month = divmod(day.month - 1 + months, 12)
+    year += day.year
+    return day.replace(year=year, month=month + 1, day=min(day.day, calendar.monthrange(year, month + 1)[1]))
+
+
+@dataclass(frozen=True, slots=True)
+class Recurrence:
+    unit: str
+    """`day`, `week`, `month`, `year` or `weekdays`."""
+    count: int = 1
+    weekdays: frozenset[int] = frozenset()
+    """Days of the week the task recurs on, Monday being 0. Only used with the `weekdays` unit."""
+    strict: bool = False
+    """Whether the next occurrence follows the previous due date (`every!`), rather than the completion date."""
+
+    @classmethod
+    def parse(cls, due_string: str) -> "Recurrence | None":
+        """Recurrence of an English due string, or None if it is not understood."""
+        text = _SUFFIX.sub("", due_string.strip().lower())
+        text = f"every {_UNIT_ALIASES[text]}" if text in _UNIT_ALIASES else text
+        if match := _INTERVAL.fullmatch(text):
+            count = match["count"]
+            return cls(
+                unit=match["unit"],
+                count=2 if count == "other" else int(count or 1),
+                strict=bool(match["strict"]),
+            )
+        if match := _PERIOD_OF_DAY.fullmatch(text):
+            return cls(unit="day", strict=bool(match["strict"]))
+        if match := _WORKDAY.fullmatch(text):
+            return cls(unit="weekdays", weekdays=frozenset(range(5)), strict=bool(match["strict"]))
+        if match := _WEEKDAY_LIST.fullmatch(text):
+            weekdays = frozenset(_WEEKDAYS[name] for name in re.findall(_WEEKDAY_NAME, match["days"]))
+            return cls(unit="weekdays", weekdays=weekdays, strict=bool(match["strict"]))
+        return None
+
+    def advance(self, day: date) -> date:
+        """Next occurrence after given day."""
+        match self.unit:
+            case "day":
+                return day + timedelta(days=self.count)
+            case "week":
+                return day + timedelta(weeks=self.count)
+            case "month":
+                return _add_months(day, self.count)
+            case "year":
+                return _add_months(day, 12 * self.count)
+            case _:
+                return next(
+                    day + timedelta(days=offset)
+                    for offset in range(1, 8)
+                    if (day + timedelta(days=offset)).weekday() in self.weekdays
+                )
@@ -3,11 +3,17 @@
 See Also: https://developer.todoist.com/sync/v9/#read-resources
 """
 
+from dataclasses import dataclass
+from datetime import datetime
 from enum import Enum
 from typing import TypeAlias
 
-from dateutil.parser import parse
-from pydantic import BaseModel, ConfigDict, Field, field_validator
+from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
+
+
+def _utc_timestamp(value: str) -> int:
+    """UNIX timestamp of an ISO 8601 date or date time. Values without a time zone are in local time."""
+    return int(datetime.fromisoformat(value).timestamp())
 
 
 class TodoistPriority(Enum):
@@ -26,10 +32,14 @@ class TodoistDue(BaseModel):
 
 
 class TodoistTask(BaseModel):
+    """Item with only the fields used by the sync. Other fields are dropped when parsing."""
+
     checked: bool
     content: str
     due: TodoistDue | None = None
     id: str
+    user_id: str | None = None
+    project_id: str | None = None
     is_deleted: bool
     priority: int
     responsible_uid: str | None = None
@@ -37,25 +47,30 @@ class TodoistTask(BaseModel):
     labels: list[str] = Field(default_factory=list)
 
     # custom fields with default value
-    due_date_utc_timestamp: int | None = None
     completed_at_utc_timestamp: int | None = None
 
-    @property
-    def latest_completion(self) -> int:
-        return max(self.due_date_utc_timestamp or 0, self.completed_at_utc_timestamp or 0)
-
     @property
     def is_recurring(self) -> bool:
         return self.due is not None and self.due.is_recurring
 
-    def __init__(self, **data):
-        super().__init__(**data)
-        if (due := data.get("due", None)) is not None:
-            self.due_date_utc_timestamp = int(parse(due["date"]).timestamp())
-        if (completed_at := data.get("completed_at", None)) is not None:
-            self.completed_at_utc_timestamp = int(parse(completed_at).timestamp())
+    @property
+    def completion_key(self) -> str:
+        """Identifies the last completion of the item, together with its ID, to not score it twice.
+
+        Completing a recurring item leaves no completion time on it, but moves it to its next due date, which every
+        source reporting the completion sees the same.
+        """
+        if self.completed_at is not None:
+            return self.completed_at
+        return "" if self.due is None else f"due:{self.due.date}"
 
-    model_config = ConfigDict(extra="allow")
+    @model_validator(mode="after")
+    def set_utc_timestamps(self) -> "TodoistTask":
+        if self.completed_at is not None:
+            self.completed_at_utc_timestamp = _utc_timestamp(self.completed_at)
+        return self
+
+    model_config = ConfigDict(extra="ignore")
 
 
 class CompletedTodoistTask(BaseModel):
@@ -65,6 +80,112 @@ class CompletedTodoistTask(BaseModel):
     item_object: TodoistTask
 
 
+@dataclass(frozen=True, slots=True)
+class CompletedTask:
+    """Completion of a Todoist task, with only the fields used by the sync.
+
+    API responses are converted to it as soon as they are parsed, so that the full items are not kept in memory.
+    """
+
+    task_id: str
+    completed_at: str
+    """Time of the completion, or another key identifying it. See `TodoistTask.completion_key`."""
+    content: str
+    priority: TodoistPriority
+    labels: tuple[str, ...] = ()
+    project_id: str | None = None
+    has_due: bool = False
+    is_recurring: bool = False
+
+    @classmethod
+    def from_item(cls, item: TodoistTask, completed_at: str) -> "CompletedTask":
+        return cls(
+            task_id=item.id,
+            completed_at=completed_at,
+            content=item.content,
+            priority=TodoistPriority(item.priority),
+            labels=tuple(item.labels),
+            project_id=item.project_id,
+            has_due=item.due is not None,
+            is_recurring=item.is_recurring,
+        )
+
+
+class TodoistTaskFilter(BaseModel):
+    """Which Todoist tasks are synced. Empty include rules match all tasks, exclude rules take precedence."""
+
+    include_project_ids: frozenset[str] = frozenset()
+    exclude_project_ids: frozenset[str] = frozenset()
+    include_labels: frozenset[str] = frozenset()
+    """Lower case label names."""
+    exclude_labels: frozenset[str] = frozenset()
+    """Lower case label names."""
+    user_id: str | None = None
+    """If set, only tasks assigned to this user, or completed by this user if not assigned, are synced."""
+
+    @property
+    def query_project_id(self) -> str | None:
+        """Project to request tasks of, if the filter matches a single project only."""
+        return next(iter(self.include_project_ids)) if len(self.include_project_ids) == 1 else None
+
+    def matches(self, item: TodoistTask, user_id: str | None) -> bool:
+        """Whether the item is synced.
+
+        Args:
+            item: Completed item.
+            user_id: User who completed the item, if known.
+        """
+        if self.include_project_ids and item.project_id not in self.include_project_ids:
+            return False
+        if item.project_id in self.exclude_project_ids:
+            return False
+        if self.include_labels or self.exclude_labels:
+            labels = {label.lower() for label in item.labels}
+            if self.include_labels and labels.isdisjoint(self.include_labels):
+                return False
+            if not labels.isdisjoint(self.exclude_labels):
+                return False
+        if self.user_id is not None and (owner := item.responsible_uid or user_id) is not None:
+            return owner == self.user_id
+        return True
+
+
+class CompletedTodoistTasks(BaseModel):
+    """Response of `completed/get_all`, without the annotated projects and sections."""
+
+    items: list[CompletedTodoistTask]
+
+
+class CompletedSyncCursor(BaseModel):
+    """Position in the archive of completed tasks, which is returned newest first.
+
+    All tasks completed up to `since` have been synced. If `until` is set, a sync has been interrupted and all tasks
+    completed between `until` and `next_since` have been synced too. The remaining window is fetched before `since`
+    moves to `next_since`.
+    """
+
+    since: str | None
+    until: str | None = None
+    next_since: str | None = None
+
+
+class TodoistItemSnapshot(BaseModel):
+    """Last known state of an item, used to detect completions between incremental syncs."""
+
+    checked: bool
+    completed_at: int = 0
+    """UTC timestamp of the last completion, 0 if unknown."""
+    due_date: str | None = None
+
+
+class IncrementalSyncCursor(BaseModel):
+    """Position in the incremental sync, together with item changes it has seen."""
+
+    sync_token: str
+    items: dict[str, TodoistItemSnapshot] = Field(default_factory=dict)
+    deleted_item_ids: list[str] = Field(default_factory=list)
+
+
 TodoistTasks: TypeAlias = dict[str, TodoistTask]
 
 
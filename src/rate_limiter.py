@@ -0,0 +1,181 @@
+import logging
+import math
+import threading
+import time
+from collections.abc import Callable, Mapping
+from datetime import datetime, timezone
+from typing import NamedTuple, Protocol
+
+_HEADER_REMAINING = "x-ratelimit-remaining"
+_HEADER_RESET = "x-ratelimit-reset"
+_HEADER_RETRY_AFTER = "retry-after"
+
+
+def seconds_until(value: str, now_utc: datetime) -> float | None:
+    """Convert a reset/retry header value into a number of seconds from now.
+
+    Accepts a delay in seconds (``Retry-After: 12``), a UNIX timestamp or a date string. Habitica sends
+    the JavaScript ``Date.toString()`` format, e.g. ``Thu Apr 11 2024 10:35:42 GMT+0000 (Coordinated Universal Time)``.
+    """
+    try:
+        number = float(value)
+    except ValueError:
+        from dateutil.parser import ParserError, parse  # pylint: disable=import-outside-toplevel
+
+        # The trailing time zone name is not parseable and dateutil inverts the sign of "GMT+HHMM" offsets
+        cleaned = value.split("(", maxsplit=1)[0].replace("GMT", "").strip()
+        try:
+            reset_at = parse(cleaned)
+        except (ParserError, OverflowError):
+            return None
+        if reset_at.tzinfo is None:
+            reset_at = reset_at.replace(tzinfo=timezone.utc)
+        return max(0.0, (reset_at - now_utc).total_seconds())
+
+    if number > now_utc.timestamp() / 2:  # Too large to be a delay, must be a UNIX timestamp
+        return max(0.0, number - now_utc.timestamp())
+    return max(0.0, number)
+
+
+class TokenBucketState(NamedTuple):
+    tokens: float
+    """Tokens left until ``reset_at``. Negative when calls have reserved tokens of the following windows."""
+    reset_at: float | None
+    """Time at which the window ends, or None if no window has started."""
+
+
+class TokenBucketStore(Protocol):  # pylint: disable=too-few-public-methods
+    """Storage of token bucket states, possibly shared with other processes."""
+
+    def update_token_bucket(
+        self, name: str, update: Callable[[TokenBucketState | None], TokenBucketState]
+    ) -> TokenBucketState:
+        """Atomically replace the state of a bucket with the result of ``update``, called with the current state."""
+
+
+class MemoryTokenBucketStore:  # pylint: disable=too-few-public-methods
+    """Token bucket states kept in memory, shared by threads of this process only."""
+
+    def __init__(self) -> None:
+        self._states: dict[str, TokenBucketState] = {}
+        self._lock = threading.Lock()
+
+    def update_token_bucket(
+        self, name: str, update: Callable[[TokenBucketState | None], TokenBucketState]
+    ) -> TokenBucketState:
+        with self._lock:
+            self._states[name] = update(self._states.get(name))
+            return self._states[name]
+
+
+class TokenBucket:
+    """Rate limiter driven by rate limit headers returned by the server.
+
+    The bucket holds ``capacity`` tokens, which are all refilled at the end of each ``period``. Each call consumes
+    one token and blocks only if the bucket is empty. The local estimate is corrected after every response from
+    ``X-RateLimit-Remaining``/``X-RateLimit-Reset`` and, when the limit has been exceeded anyway, ``Retry-After``.
+
+    A call finding the bucket empty reserves a token of the next window before sleeping, so the state is never
+    locked while waiting. When the state is kept in a shared store, all processes using it honor the same budget,
+    also across restarts.
+    """
+
+    def __init__(  # noqa: PLR0913 # pylint: disable=too-many-arguments
+        self,
+        capacity: int,
+        period: float,
+        msg: str | None = None,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep,
+        on_wait: Callable[[float], None] | None = None,
+        store: TokenBucketStore | None = None,
+        name: str = "default",
+    ):
+        """Constructor.
+
+        Args:
+            capacity: Maximum number of calls per period.
+            period: Length of the rate limiting window in seconds.
+            msg: A message to log before sleep. If not set, none will be printed. Accepts one
+                keyword ``str.format`` argument ``delay`` with the number of second it will
+                sleep for.
+            clock: Wall clock, injectable for testing. Times are stored, so they must be comparable across processes.
+            sleep: Sleep function, injectable for testing.
+            on_wait: Called with the number of seconds it will sleep for, e.g. to record metrics.
+            store: Where the state is kept. If not set, it is kept in memory by this bucket only.
+            name: Key of the state in the store.
+        """
+        self._capacity = capacity
+        self._period = period
+        self._msg = msg
+        self._clock = clock
+        self._sleep = sleep
+        self._on_wait = on_wait
+        self._store: TokenBucketStore = MemoryTokenBucketStore() if store is None else store
+        self._name = name
+        self._log = logging.getLogger(self.__class__.__name__)
+
+    def _refill(self, state: TokenBucketState | None, now: float) -> TokenBucketState:
+        if state is None:
+            return TokenBucketState(self._capacity, None)
+        tokens, reset_at = state
+        while reset_at is not None and now >= reset_at:
+            tokens = min(tokens + self._capacity, self._capacity)
+            reset_at = reset_at + self._period if tokens < self._capacity else None
+        return TokenBucketState(tokens, reset_at)
+
+    def __call__(self) -> None:
+        """Take one token, sleeping until the window it belongs to starts if there is none left."""
+        now = self._clock()
+
+        def take(state: TokenBucketState | None) -> TokenBucketState:
+            tokens, reset_at = self._refill(state, now)
+            return TokenBucketState(tokens - 1, now + self._period if reset_at is None else reset_at)
+
+        tokens, reset_at = self._store.update_token_bucket(self._name, take)
+        if tokens >= 0 or reset_at is None:
+            return
+
+        windows_ahead = math.ceil(-tokens / self._capacity)
+        delay = reset_at + (windows_ahead - 1) * self._period - now
+        if self._msg is not None:
+            self._log.info(self._msg.format(delay=delay))
+        if self._on_wait is not None:
+            self._on_wait(delay)
+        self._sleep(delay)
+
+    def update(self, headers: Mapping[str, str], too_many_requests: bool = False) -> None:
+        """Synchronise the bucket with the rate limit information returned by the server.
+
+        Args:
+            headers: Response headers. Keys must be case-insensitive, as in ``requests.Response.headers``.
+            too_many_requests: The request was rejected because of the rate limit.
+        """
+        now = self._clock()
+        now_utc = datetime.now(timezone.utc)
+        remaining = headers.get(_HEADER_REMAINING)
+        reset = headers.get(_HEADER_RESET)
+        retry_after = headers.get(_HEADER_RETRY_AFTER) if too_many_requests else None
+
+        def synchronise(state: TokenBucketState | None) -> TokenBucketState:
+            tokens, reset_at = self._refill(state, now)
+
+            if remaining is not None:
+                try:
+                    tokens = min(float(remaining), self._capacity)
+                except ValueError:
+                    self._log.debug(f"Ignoring invalid {_HEADER_REMAINING} header '{remaining}'.")
+
+            if reset is not None and (seconds := seconds_until(reset, now_utc)) is not None:
+                reset_at = now + seconds
+
+            if too_many_requests:
+                tokens = min(tokens, 0)
+                if retry_after is not None and (seconds := seconds_until(retry_after, now_utc)) is not None:
+                    reset_at = now + seconds
+                elif reset_at is None:
+                    reset_at = now + self._period
+
+            return TokenBucketState(tokens, reset_at)
+
+        self._store.update_token_bucket(self._name, synchronise)
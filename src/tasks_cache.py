@@ -1,59 +1,254 @@
-import json
 import logging
 import sqlite3
-from collections.abc import Iterator
+import threading
+import time
+from collections.abc import Callable
 from collections.abc import Iterator as TypingIterator
 from contextlib import contextmanager
 from datetime import datetime, timezone
+from pathlib import Path
+from uuid import UUID
 
 from config import get_settings
 from models.generic_task import GenericTask
+from models.habitica import HabiticaDifficulty
+from models.todoist import CompletedSyncCursor, IncrementalSyncCursor, TodoistItemSnapshot
+from rate_limiter import TokenBucketState
 
-_DATABASE_SCHEMAS = [
-    """
+_DATABASE_MIGRATIONS: list[list[str]] = [
+    # 1: Tasks stored as JSON
+    [
+        """
 CREATE TABLE IF NOT EXISTS tasks_cache (
     id TEXT PRIMARY KEY NOT NULL,
     task_data TEXT
 )
 """,
-    """
+        """
 CREATE TABLE IF NOT EXISTS metadata (
     key TEXT PRIMARY KEY NOT NULL,
     value TEXT
 )
 """,
+        """
+CREATE TABLE IF NOT EXISTS todoist_items (
+    id TEXT PRIMARY KEY NOT NULL,
+    checked INTEGER NOT NULL,
+    latest_completion INTEGER NOT NULL
+)
+""",
+    ],
+    # 2: Task fields as indexed columns
+    [
+        "ALTER TABLE tasks_cache RENAME TO tasks_cache_v1",
+        """
+CREATE TABLE tasks_cache (
+    id TEXT PRIMARY KEY NOT NULL,
+    content TEXT NOT NULL,
+    difficulty TEXT NOT NULL,
+    state TEXT NOT NULL,
+    habitica_task_id TEXT,
+    created_at REAL NOT NULL,
+    next_attempt_at REAL NOT NULL DEFAULT 0
+)
+""",
+        """
+INSERT INTO tasks_cache (id, content, difficulty, state, habitica_task_id, created_at)
+SELECT
+    id,
+    json_extract(task_data, '$.content'),
+    json_extract(task_data, '$.difficulty'),
+    json_extract(task_data, '$.state'),
+    json_extract(task_data, '$.habitica_task_id'),
+    (julianday('now') - 2440587.5) * 86400.0
+FROM tasks_cache_v1
+""",
+        "DROP TABLE tasks_cache_v1",
+        "CREATE INDEX tasks_cache_state ON tasks_cache (state, next_attempt_at, created_at)",
+        "CREATE INDEX tasks_cache_created_at ON tasks_cache (created_at)",
+    ],
+    # 3: Retry scheduling
+    [
+        "ALTER TABLE tasks_cache ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0",
+    ],
+    # 4: Completions already queued, to not score them again when reported by both webhook and sync
+    [
+        """
+CREATE TABLE todoist_completions (
+    task_id TEXT NOT NULL,
+    completed_at TEXT NOT NULL,
+    queued_at REAL NOT NULL,
+    PRIMARY KEY (task_id, completed_at)
+)
+""",
+    ],
+    # 5: Retention of queued completions
+    [
+        "CREATE INDEX todoist_completions_queued_at ON todoist_completions (queued_at)",
+    ],
+    # 6: Rate limits shared by all processes
+    [
+        """
+CREATE TABLE token_buckets (
+    name TEXT PRIMARY KEY NOT NULL,
+    tokens REAL NOT NULL,
+    reset_at REAL
+)
+""",
+    ],
+    # 7: Tasks claimed by workers
+    [
+        "ALTER TABLE tasks_cache ADD COLUMN lease_owner TEXT",
+        "ALTER TABLE tasks_cache ADD COLUMN lease_expires_at REAL NOT NULL DEFAULT 0",
+        "CREATE INDEX tasks_cache_lease_owner ON tasks_cache (lease_owner)",
+    ],
+    # 8: Due dates of Todoist items, to tell a completed recurring item from a postponed one
+    [
+        "ALTER TABLE todoist_items ADD COLUMN completed_at INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE todoist_items ADD COLUMN due_date TEXT",
+        "ALTER TABLE todoist_items DROP COLUMN latest_completion",
+    ],
 ]
+"""Each migration is applied once, in a single transaction. Never change released migrations, add new ones."""
+
+_TASK_COLUMNS = "id, content, difficulty, state, habitica_task_id, created_at, attempts, next_attempt_at"
+_SAVE_TASK = f"INSERT OR REPLACE INTO tasks_cache ({_TASK_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+_MAX_QUERY_PARAMETERS = 500
+_BUSY_TIMEOUT_SECONDS = 30
+"""How long to wait for a write lock held by another process sharing the cache, before failing as locked."""
 
 
 class TasksCache:
-    """Tasks cache on disk using SQLite."""
+    """Tasks cache on disk using SQLite.
+
+    Also stores rate limiter states, as a `rate_limiter.TokenBucketStore` shared by all processes using the database.
+    """
 
-    def __init__(self):
-        db_file = get_settings().database_file  # pylint: disable=no-member
+    def __init__(self, database_file: Path | None = None):
+        """Constructor.
+
+        Args:
+            database_file: Path to the database. `database_file` from settings if not set.
+        """
+        db_file = get_settings().database_file if database_file is None else database_file
         db_file.parent.mkdir(parents=True, exist_ok=True)  # pylint: disable=no-member
         self._db_path = str(db_file.resolve())  # pylint: disable=no-member
         self._log = logging.getLogger(self.__class__.__name__)
         self._log.info(f"Tasks cache in {db_file.absolute()}")  # pylint: disable=no-member
 
+        self._lock = threading.RLock()
+        self._transaction_depth = 0
+        self._connection = sqlite3.connect(self._db_path, timeout=_BUSY_TIMEOUT_SECONDS, check_same_thread=False)
+        self._enable_wal()
+        synchronous = f"PRAGMA synchronous={get_settings().database_synchronous.value}"
+        self._connection.execute(synchronous)
+
         self._initialize_database()
 
+        # Rate limits are updated in their own short transactions, never within a transaction of the tasks
+        self._token_buckets_lock = threading.Lock()
+        self._token_buckets_connection = sqlite3.connect(
+            self._db_path, timeout=_BUSY_TIMEOUT_SECONDS, check_same_thread=False, isolation_level=None
+        )
+        self._token_buckets_connection.execute(synchronous)
+
+    def close(self) -> None:
+        with self._token_buckets_lock:
+            self._token_buckets_connection.close()
+        with self._lock:
+            self._connection.close()
+
+    @contextmanager
+    def transaction(self) -> TypingIterator[None]:
+        """Commit all changes made within the block in a single transaction.
+
+        Transactions can be nested. Only the outermost one commits, or rolls back on an exception.
+        """
+        with self._lock:
+            self._transaction_depth += 1
+            try:
+                yield
+            except BaseException:
+                if self._transaction_depth == 1:
+                    self._connection.rollback()
+                raise
+            else:
+                if self._transaction_depth == 1:
+                    self._connection.commit()
+            finally:
+                self._transaction_depth -= 1
+
     @contextmanager
     def _cursor(self, row_factory=None) -> TypingIterator[sqlite3.Cursor]:
         """Context manager for database cursor operations."""
-        conn = sqlite3.connect(self._db_path)
-        if row_factory:
-            conn.row_factory = row_factory
-        cursor = conn.cursor()
-        try:
-            yield cursor
-            conn.commit()
-        finally:
-            conn.close()
+        with self.transaction():
+            cursor = self._connection.cursor()
+            if row_factory:
+                cursor.row_factory = row_factory
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    def _enable_wal(self) -> None:
+        """Switch the database to WAL mode, which persists in the file.
+
+        The switch fails as locked without waiting for the busy timeout when another worker is starting at the same
+        time, so it is retried until the timeout.
+        """
+        deadline = time.monotonic() + _BUSY_TIMEOUT_SECONDS
+        while True:
+            try:
+                self._connection.execute("PRAGMA journal_mode=WAL")
+                return
+            except sqlite3.OperationalError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.01)
 
     def _initialize_database(self) -> None:
         with self._cursor() as cursor:
-            for database_schema in _DATABASE_SCHEMAS:
-                cursor.execute(database_schema)
+            cursor.execute("PRAGMA user_version")
+            current_version = cursor.fetchone()[0]
+
+        for version, migration in enumerate(_DATABASE_MIGRATIONS[current_version:], start=current_version + 1):
+            with self._cursor() as cursor:
+                # DDL statements don't open a transaction implicitly. The write lock is taken before reading the
+                # version, so that workers starting at the same time apply each migration only once.
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute("PRAGMA user_version")
+                if cursor.fetchone()[0] >= version:
+                    continue
+                for statement in migration:
+                    cursor.execute(statement)
+                cursor.execute(f"PRAGMA user_version = {version}")
+            self._log.info(f"Tasks cache migrated to version {version}.")
+
+    @staticmethod
+    def _task_to_row(generic_task: GenericTask) -> tuple:
+        return (
+            str(generic_task.id),
+            generic_task.content,
+            generic_task.difficulty.value,
+            generic_task.state,
+            generic_task.habitica_task_id,
+            generic_task.created_at,
+            generic_task.attempts,
+            generic_task.next_attempt_at,
+        )
+
+    @staticmethod
+    def _row_to_task(row: sqlite3.Row) -> GenericTask:
+        return GenericTask(
+            id=UUID(row["id"]),
+            content=row["content"],
+            difficulty=HabiticaDifficulty(row["difficulty"]),
+            state=row["state"],
+            habitica_task_id=row["habitica_task_id"],
+            created_at=row["created_at"],
+            attempts=row["attempts"],
+            next_attempt_at=row["next_attempt_at"],
+        )
 
     def _read_metadata(self, key: str, default: str | None = None) -> str | None:
         with self._cursor() as cursor:
@@ -67,34 +262,224 @@ class TasksCache:
                 (key, value),
             )
 
+    def _delete_metadata(self, key: str) -> None:
+        with self._cursor() as cursor:
+            cursor.execute("DELETE FROM metadata WHERE key = ?", (key,))
+
+    def get_habitica_habit_id(self, difficulty: HabiticaDifficulty) -> str | None:
+        return self._read_metadata(f"habitica_habit_id_{difficulty.name}")
+
+    def set_habitica_habit_id(self, difficulty: HabiticaDifficulty, habit_id: str | None) -> None:
+        if habit_id is None:
+            self._delete_metadata(f"habitica_habit_id_{difficulty.name}")
+        else:
+            self._write_metadata(f"habitica_habit_id_{difficulty.name}", habit_id)
+
     @property
-    def last_sync_datetime_utc(self) -> str | None:
-        return self._read_metadata(
-            "last_sync_datetime_utc",
-            datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+    def completed_sync_cursor(self) -> CompletedSyncCursor:
+        if (value := self._read_metadata("completed_sync_cursor")) is not None:
+            return CompletedSyncCursor.model_validate_json(value)
+
+        # Caches created before paginated sync only stored the time of the last sync
+        return CompletedSyncCursor(
+            since=self._read_metadata(
+                "last_sync_datetime_utc",
+                datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+            )
         )
 
-    @last_sync_datetime_utc.setter
-    def last_sync_datetime_utc(self, value: str) -> None:
-        self._write_metadata("last_sync_datetime_utc", value)
+    @completed_sync_cursor.setter
+    def completed_sync_cursor(self, value: CompletedSyncCursor) -> None:
+        self._write_metadata("completed_sync_cursor", value.model_dump_json())
 
-    def save_task(self, generic_task: GenericTask) -> None:
+    @property
+    def todoist_sync_token(self) -> str | None:
+        return self._read_metadata("todoist_sync_token")
+
+    def get_todoist_item_snapshots(self, item_ids: list[str]) -> dict[str, TodoistItemSnapshot]:
+        snapshots: dict[str, TodoistItemSnapshot] = {}
         with self._cursor() as cursor:
+            for start in range(0, len(item_ids), _MAX_QUERY_PARAMETERS):
+                batch = item_ids[start : start + _MAX_QUERY_PARAMETERS]
+                placeholders = ",".join("?" * len(batch))
+                cursor.execute(
+                    f"SELECT id, checked, completed_at, due_date FROM todoist_items WHERE id IN ({placeholders})", batch
+                )
+                for item_id, checked, completed_at, due_date in cursor.fetchall():
+                    snapshots[item_id] = TodoistItemSnapshot(
+                        checked=checked, completed_at=completed_at, due_date=due_date
+                    )
+        return snapshots
+
+    @staticmethod
+    def _write_sync_cursor(cursor: sqlite3.Cursor, sync_cursor: CompletedSyncCursor | IncrementalSyncCursor) -> None:
+        if isinstance(sync_cursor, CompletedSyncCursor):
             cursor.execute(
-                "INSERT OR REPLACE INTO tasks_cache (id, task_data) VALUES (?, ?)",
-                (str(generic_task.id), generic_task.model_dump_json()),
+                "INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)",
+                ("completed_sync_cursor", sync_cursor.model_dump_json()),
             )
+            return
+
+        cursor.executemany(
+            "INSERT OR REPLACE INTO todoist_items (id, checked, completed_at, due_date) VALUES (?, ?, ?, ?)",
+            [(item_id, item.checked, item.completed_at, item.due_date) for item_id, item in sync_cursor.items.items()],
+        )
+        cursor.executemany(
+            "DELETE FROM todoist_items WHERE id = ?", [(item_id,) for item_id in sync_cursor.deleted_item_ids]
+        )
+        cursor.execute(
+            "INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)", ("todoist_sync_token", sync_cursor.sync_token)
+        )
+
+    def save_task(self, generic_task: GenericTask) -> None:
+        """Save a task, which also releases its lease."""
+        with self._cursor() as cursor:
+            cursor.execute(_SAVE_TASK, self._task_to_row(generic_task))
+
+    def save_tasks(
+        self,
+        generic_tasks: list[GenericTask],
+        sync_cursor: CompletedSyncCursor | IncrementalSyncCursor | None = None,
+    ) -> None:
+        """Save tasks and release their leases, optionally moving the Todoist sync cursor in the same transaction."""
+        with self._cursor() as cursor:
+            cursor.executemany(_SAVE_TASK, [self._task_to_row(generic_task) for generic_task in generic_tasks])
+            if sync_cursor is not None:
+                self._write_sync_cursor(cursor, sync_cursor)
+
+    def save_new_tasks(
+        self,
+        generic_tasks: dict[tuple[str, str], GenericTask],
+        sync_cursor: CompletedSyncCursor | IncrementalSyncCursor | None = None,
+    ) -> list[GenericTask]:
+        """Save tasks for Todoist completions not seen before, optionally moving the sync cursor.
+
+        Args:
+            generic_tasks: Tasks by Todoist task ID and completion time.
+            sync_cursor: Cursor to store in the same transaction.
+
+        Returns:
+            Tasks that were saved.
+        """
+        queued_at = time.time()
+        new_tasks: list[GenericTask] = []
+        with self._cursor() as cursor:
+            for (task_id, completed_at), generic_task in generic_tasks.items():
+                cursor.execute(
+                    "INSERT OR IGNORE INTO todoist_completions (task_id, completed_at, queued_at) VALUES (?, ?, ?)",
+                    (task_id, completed_at, queued_at),
+                )
+                if cursor.rowcount:
+                    new_tasks.append(generic_task)
+            self.save_tasks(new_tasks, sync_cursor)
+        return new_tasks
+
+    def forget_completions(self, queued_before: float) -> int:
+        """Forget completions queued before given time, so they are not recognised as duplicates anymore.
+
+        Returns:
+            Number of forgotten completions.
+        """
+        with self._cursor() as cursor:
+            cursor.execute("DELETE FROM todoist_completions WHERE queued_at < ?", (queued_before,))
+            return cursor.rowcount
+
+    def update_token_bucket(
+        self, name: str, update: Callable[[TokenBucketState | None], TokenBucketState]
+    ) -> TokenBucketState:
+        """Atomically replace the state of a rate limiter, also across processes."""
+        with self._token_buckets_lock:
+            connection = self._token_buckets_connection
+            connection.execute("BEGIN IMMEDIATE")  # Lock the database for writing before reading the state
+            try:
+                row = connection.execute(
+                    "SELECT tokens, reset_at FROM token_buckets WHERE name = ?", (name,)
+                ).fetchone()
+                state = update(None if row is None else TokenBucketState(*row))
+                connection.execute(
+                    "INSERT OR REPLACE INTO token_buckets (name, tokens, reset_at) VALUES (?, ?, ?)", (name, *state)
+                )
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+            return state
 
     def delete_task(self, generic_task: GenericTask) -> None:
         with self._cursor() as cursor:
             cursor.execute("DELETE FROM tasks_cache WHERE id = ?", (str(generic_task.id),))
 
-    def in_progress_tasks(self) -> Iterator[GenericTask]:
-        while True:
-            with self._cursor(row_factory=sqlite3.Row) as cursor:
-                cursor.execute("SELECT task_data FROM tasks_cache LIMIT 1")
+    def delete_tasks(self, generic_tasks: list[GenericTask]) -> None:
+        with self._cursor() as cursor:
+            cursor.executemany(
+                "DELETE FROM tasks_cache WHERE id = ?", [(str(generic_task.id),) for generic_task in generic_tasks]
+            )
 
-                if not (row := cursor.fetchone()):
-                    break
+    def claim_tasks(self, state: str, owner: str, lease_seconds: float, due_at: float, limit: int) -> list[GenericTask]:
+        """Lease tasks in given state to a worker, oldest first.
 
-                yield GenericTask(**json.loads(row["task_data"]))
+        Tasks leased to another worker are skipped until the lease expires, e.g. because the worker crashed. Claims are
+        atomic, so multiple processes using the same database never claim the same task.
+
+        Args:
+            state: Name of the state.
+            owner: ID of the worker.
+            lease_seconds: Duration of the lease. Leases are released when the task is saved or deleted, or with
+                `release_tasks`, and extended with `renew_leases`.
+            due_at: Only tasks that are due to be attempted at this time are claimed.
+            limit: Maximum number of tasks to claim.
+        """
+        now = time.time()
+        with self._cursor(row_factory=sqlite3.Row) as cursor:
+            cursor.execute(
+                f"""
+UPDATE tasks_cache SET lease_owner = ?, lease_expires_at = ?
+WHERE id IN (
+    SELECT id FROM tasks_cache
+    WHERE state = ? AND next_attempt_at <= ? AND lease_expires_at <= ?
+    ORDER BY created_at
+    LIMIT ?
+)
+RETURNING {_TASK_COLUMNS}
+""",
+                (owner, now + lease_seconds, state, due_at, now, limit),
+            )
+            generic_tasks = [self._row_to_task(row) for row in cursor.fetchall()]
+        return sorted(generic_tasks, key=lambda generic_task: generic_task.created_at)
+
+    def renew_leases(self, owner: str, lease_seconds: float) -> None:
+        """Extend all leases of a worker, which proves that it is still alive."""
+        with self._cursor() as cursor:
+            cursor.execute(
+                "UPDATE tasks_cache SET lease_expires_at = ? WHERE lease_owner = ?",
+                (time.time() + lease_seconds, owner),
+            )
+
+    def release_tasks(self, owner: str) -> None:
+        """Release all leases of a worker, so other workers can claim the tasks immediately."""
+        with self._cursor() as cursor:
+            cursor.execute(
+                "UPDATE tasks_cache SET lease_owner = NULL, lease_expires_at = 0 WHERE lease_owner = ?", (owner,)
+            )
+
+    def count_tasks(self, states: list[str], due_at: float | None = None) -> int:
+        """Number of tasks in any of given states.
+
+        Args:
+            states: Names of the states.
+            due_at: If set, only tasks that are due to be attempted at this time and not leased to any worker are
+                counted.
+        """
+        with self._cursor() as cursor:
+            cursor.execute(
+                f"SELECT COUNT(*) FROM tasks_cache WHERE state IN ({', '.join('?' * len(states))}) "
+                "AND next_attempt_at <= ? AND lease_expires_at <= ?",
+                (*states, *((float("inf"), float("inf")) if due_at is None else (due_at, time.time()))),
+            )
+            return cursor.fetchone()[0]
+
+    def tasks_stats(self) -> dict[str, tuple[int, float]]:
+        """Number of tasks and creation time of the oldest task, by state."""
+        with self._cursor() as cursor:
+            cursor.execute("SELECT state, COUNT(*), MIN(created_at) FROM tasks_cache GROUP BY state")
+            return {state: (count, oldest_created_at) for state, count, oldest_created_at in cursor.fetchall()}
@@ -1,11 +1,34 @@
+import json
 import logging
-from collections.abc import Iterator
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
 from http import HTTPStatus
+from typing import TYPE_CHECKING, Final
 
 import requests
 from pydantic import BaseModel
+from requests.adapters import HTTPAdapter
 
-from models.todoist import CompletedTodoistTask
+from metrics import TODOIST_SYNC_SECONDS
+from models.recurrence import Recurrence
+from models.todoist import (
+    CompletedSyncCursor,
+    CompletedTask,
+    CompletedTodoistTask,
+    CompletedTodoistTasks,
+    IncrementalSyncCursor,
+    TodoistItemSnapshot,
+    TodoistState,
+    TodoistTask,
+    TodoistTaskFilter,
+)
+
+if TYPE_CHECKING:  # Only imported when traffic is recorded or replayed
+    from traffic import Traffic
+
+_DEFAULT_CONNECT_TIMEOUT_SECONDS: Final[float] = 5
+_DEFAULT_READ_TIMEOUT_SECONDS: Final[float] = 30
 
 
 class QueryParamsCompletedGetAll(BaseModel):
@@ -13,37 +36,58 @@ class QueryParamsCompletedGetAll(BaseModel):
 
     limit: int = 200
     since: str | None
+    until: str | None = None
+    project_id: str | None = None
     annotate_items: bool = True
 
 
+@dataclass(frozen=True, slots=True)
+class CompletedTasksPage:
+    items: list[CompletedTask]
+    cursor: CompletedSyncCursor | IncrementalSyncCursor
+    """Cursor to persist once the items are stored."""
+
+
 class TodoistAPI:
     _SYNC_VERSION = "v9"
     _BASE_URL = f"https://api.todoist.com/sync/{_SYNC_VERSION}"
-    _ENDPOINT_COMPLETED_GET_ALL = f"{_BASE_URL}/completed/get_all"
+    TRAFFIC_SERVICE: Final[str] = "todoist"
+
+    def __init__(
+        self,
+        token: str,
+        api_uri_base: str = _BASE_URL,
+        task_filter: TodoistTaskFilter | None = None,
+        timeout: tuple[float, float] = (_DEFAULT_CONNECT_TIMEOUT_SECONDS, _DEFAULT_READ_TIMEOUT_SECONDS),
+        traffic: "Traffic | None" = None,
+    ) -> None:
+        """Constructor.
 
-    def __init__(self, token: str, last_sync_datetime_utc: str | None = None) -> None:
+        Args:
+            token: API token.
+            api_uri_base: Base URL of the API.
+            task_filter: Which completed tasks to return. Filters are sent with the request where the API supports
+                them, the rest is applied when parsing the response.
+            timeout: Connect and read timeouts of each request in seconds.
+            traffic: Records or replays all requests, if set.
+        """
+        self._task_filter = TodoistTaskFilter() if task_filter is None else task_filter
+        self._endpoint_completed_get_all = f"{api_uri_base}/completed/get_all"
+        self._endpoint_sync = f"{api_uri_base}/sync"
+        self._timeout = timeout
         self._session = requests.Session()
+        if traffic is not None:
+            adapter = traffic.adapter(self.TRAFFIC_SERVICE, HTTPAdapter())
+            self._session.mount("https://", adapter)
+            self._session.mount("http://", adapter)
         self._headers = {"Authorization": f"Bearer {token}"}
-        self._last_sync_datetime_utc: str | None = last_sync_datetime_utc
-        self._completed_tasks: list[CompletedTodoistTask] = []
         self._log = logging.getLogger(self.__class__.__name__)
 
-    def iter_pop_newly_completed_tasks(self) -> Iterator[CompletedTodoistTask]:
-        """Pop tasks from last sync."""
-        while self._completed_tasks:
-            yield self._completed_tasks.pop()
-
-    def sync(self) -> str | None:
-        """Sync recently completed tasks.
-
-        Returns: Last sync datetime to persist.
-        """
-        response = self._session.get(
-            self._ENDPOINT_COMPLETED_GET_ALL,
-            headers=self._headers,
-            params=QueryParamsCompletedGetAll(since=self._last_sync_datetime_utc).model_dump(exclude_none=True),
-        )
+    def close(self) -> None:
+        self._session.close()
 
+    @staticmethod
+    def _raise_for_status(response: requests.Response) -> None:
         if response.status_code == HTTPStatus.FORBIDDEN:
             raise RuntimeError(
                 "Invalid API token for Todoist. Please check that is matches the one "
@@ -52,11 +96,133 @@ class TodoistAPI:
 
         response.raise_for_status()
 
-        if newly_completed_tasks := [CompletedTodoistTask(**data) for data in response.json()["items"]]:
-            self._log.info(f"Synced {len(newly_completed_tasks)} new completed tasks.")
-            self._last_sync_datetime_utc = newly_completed_tasks[0].completed_at
-            self._completed_tasks.extend(newly_completed_tasks)
+    @TODOIST_SYNC_SECONDS.timed(method="completed")
+    def _get_completed_tasks(self, params: QueryParamsCompletedGetAll) -> list[CompletedTodoistTask]:
+        response = self._session.get(
+            self._endpoint_completed_get_all,
+            headers=self._headers,
+            params=params.model_dump(exclude_none=True),
+            timeout=self._timeout,
+        )
+        self._raise_for_status(response)
+
+        # Validating the raw bytes skips building intermediate Python objects for the whole response
+        return CompletedTodoistTasks.model_validate_json(response.content).items
+
+    @TODOIST_SYNC_SECONDS.timed(method="incremental")
+    def _get_items_state(self, sync_token: str) -> TodoistState:
+        response = self._session.post(
+            self._endpoint_sync,
+            headers=self._headers,
+            data={"sync_token": sync_token, "resource_types": json.dumps(["items"])},
+            timeout=self._timeout,
+        )
+        self._raise_for_status(response)
+
+        return TodoistState.model_validate_json(response.content)
+
+    def sync(self, cursor: CompletedSyncCursor) -> Iterator[CompletedTasksPage]:
+        """Sync recently completed tasks one page at a time, newest first.
+
+        The caller must store each page together with its cursor before iterating further. An interrupted sync
+        resumes where the last stored page ended.
+        """
+        # Tasks completed exactly at `until` may be returned again on the next page
+        seen_at_until: set[tuple[str, str]] = set()
+
+        while True:
+            params = QueryParamsCompletedGetAll(
+                since=cursor.since, until=cursor.until, project_id=self._task_filter.query_project_id
+            )
+            if not (completed_tasks := self._get_completed_tasks(params)):
+                if cursor.until is None:
+                    self._log.debug("No new completed tasks.")
+                else:
+                    yield CompletedTasksPage(items=[], cursor=CompletedSyncCursor(since=cursor.next_since))
+                return
+
+            # Only matching tasks are kept as records, but the cursor moves past all of them
+            new_tasks = [
+                CompletedTask.from_item(_.item_object, _.completed_at)
+                for _ in completed_tasks
+                if (_.task_id, _.completed_at) not in seen_at_until
+                and self._task_filter.matches(_.item_object, _.user_id)
+            ]
+            cursor = CompletedSyncCursor(
+                since=cursor.since,
+                until=completed_tasks[-1].completed_at,
+                next_since=cursor.next_since or completed_tasks[0].completed_at,
+            )
+            seen_at_until = {(_.task_id, _.completed_at) for _ in completed_tasks if _.completed_at == cursor.until}
+
+            if is_last_page := len(completed_tasks) < params.limit:
+                cursor = CompletedSyncCursor(since=cursor.next_since)
+
+            self._log.info(f"Synced {len(new_tasks)} new completed tasks.")
+            yield CompletedTasksPage(items=new_tasks, cursor=cursor)
+
+            if is_last_page:
+                return
+
+    def _is_completion(self, item: TodoistTask, previous: TodoistItemSnapshot | None, today: date) -> bool:
+        if item.checked:
+            return previous is None or not previous.checked
+        if item.due is None or not item.due.is_recurring or previous is None:
+            return False
+        if item.completed_at_utc_timestamp is not None and item.completed_at_utc_timestamp > previous.completed_at:
+            return True
+        if previous.due_date is None or item.due.date == previous.due_date:
+            return False
+        # Completing a recurring item only moves its due date by one occurrence, postponing moves it anywhere
+        if item.due.lang != "en" or (recurrence := Recurrence.parse(item.due.string)) is None:
+            self._log.debug(f"Unknown recurrence '{item.due.string}' of item {item.id}, ignoring its due date change.")
+            return False
+
+        previous_due = date.fromisoformat(previous.due_date[:10])
+        starts = [previous_due]
+        if not recurrence.strict:  # Occurrences follow the completion date, today in the time zone of the user
+            starts += [today - timedelta(days=1), today, today + timedelta(days=1)]
+        return date.fromisoformat(item.due.date[:10]) in {recurrence.advance(start) for start in starts}
+
+    def sync_incremental(
+        self,
+        sync_token: str | None,
+        get_snapshots: Callable[[list[str]], dict[str, TodoistItemSnapshot]],
+    ) -> Iterator[CompletedTasksPage]:
+        """Sync items changed since the last sync and detect completions from their changes.
+
+        The first sync is a full sync, which only records the current state of all items.
+
+        Args:
+            sync_token: Token returned by the last sync. Full sync is performed if not set.
+            get_snapshots: Returns last known state of items with given IDs.
+        """
+        state = self._get_items_state(sync_token or "*")
+        previous = {} if state.full_sync else get_snapshots(list(state.items))
+        cursor = IncrementalSyncCursor(sync_token=state.sync_token)
+        completed_tasks: list[CompletedTask] = []
+        today = datetime.now(timezone.utc).date()
+
+        for item_id, item in state.items.items():
+            if item.is_deleted:
+                cursor.deleted_item_ids.append(item_id)
+                continue
+
+            cursor.items[item_id] = TodoistItemSnapshot(
+                checked=item.checked,
+                completed_at=item.completed_at_utc_timestamp or 0,
+                due_date=None if item.due is None else item.due.date,
+            )
+            if (
+                not state.full_sync
+                and self._is_completion(item, previous.get(item_id), today)
+                and self._task_filter.matches(item, item.user_id)
+            ):
+                completed_tasks.append(CompletedTask.from_item(item, item.completion_key))
+
+        if completed_tasks:
+            self._log.info(f"Synced {len(completed_tasks)} new completed tasks.")
         else:
             self._log.debug("No new completed tasks.")
 
-        return self._last_sync_datetime_utc
+        yield CompletedTasksPage(items=completed_tasks, cursor=cursor)
@@ -0,0 +1,99 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import threading
+from collections.abc import Callable
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from models.todoist import CompletedTask, TodoistTask, TodoistTaskFilter
+
+_SIGNATURE_HEADER = "X-Todoist-Hmac-SHA256"
+
+
+def sign(body: bytes, client_secret: str) -> str:
+    """Signature of a webhook request body, as sent by Todoist."""
+    return base64.b64encode(hmac.new(client_secret.encode(), body, hashlib.sha256).digest()).decode()
+
+
+class TodoistWebhookServer:
+    """Receives `item:completed` events from Todoist webhooks.
+
+    See https://developer.todoist.com/sync/v9/#webhooks
+    """
+
+    def __init__(
+        self,
+        port: int,
+        client_secret: str,
+        on_completed: Callable[[CompletedTask], None],
+        host: str = "0.0.0.0",  # noqa: S104
+        task_filter: TodoistTaskFilter | None = None,
+    ):
+        """Constructor.
+
+        Args:
+            port: Port to listen on. Use 0 to pick a free port.
+            client_secret: Client secret of the Todoist app the webhooks are configured for.
+            on_completed: Called from the server thread for each completed task matching the filter.
+            host: Interface to listen on.
+            task_filter: Which completed tasks are passed on. All if not set.
+        """
+        self._client_secret = client_secret
+        self._on_completed = on_completed
+        self._task_filter = TodoistTaskFilter() if task_filter is None else task_filter
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread = threading.Thread(target=self._server.serve_forever, name="todoist-webhook", daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self) -> None:
+        self._thread.start()
+        self._log.info(f"Listening for Todoist webhooks on port {self.port}.")
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handle(self, body: bytes, signature: str | None) -> HTTPStatus:
+        if signature is None or not hmac.compare_digest(sign(body, self._client_secret), signature):
+            self._log.warning("Rejected webhook request with invalid signature.")
+            return HTTPStatus.UNAUTHORIZED
+
+        try:
+            event = json.loads(body)
+            if event.get("event_name") != "item:completed":
+                return HTTPStatus.OK
+            item = TodoistTask(**event["event_data"])
+            completed_by = (event.get("initiator") or {}).get("id", item.user_id)
+        except (ValueError, KeyError, TypeError, AttributeError) as ex:
+            self._log.warning(f"Rejected malformed webhook request: {ex}")
+            return HTTPStatus.BAD_REQUEST
+
+        if not self._task_filter.matches(item, completed_by):
+            self._log.debug(f"Skipped completion of item {item.id} not matching the task filter.")
+            return HTTPStatus.OK
+
+        self._on_completed(CompletedTask.from_item(item, item.completion_key))
+        return HTTPStatus.OK
+
+    def _handler_class(self) -> type[BaseHTTPRequestHandler]:
+        webhook_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:  # noqa: N802
+                body = self.rfile.read(int(self.headers.get("content-length", 0)))
+                status = webhook_server._handle(body, self.headers.get(_SIGNATURE_HEADER))
+                self.send_response(status)
+                self.send_header("content-length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args) -> None:  # pylint: disable=redefined-builtin
+                webhook_server._log.debug(format % args)
+
+        return Handler
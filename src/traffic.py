@@ -0,0 +1,253 @@
+"""Recording of API traffic and its replay without network access, to reproduce production workloads offline.
+
+Traffic is appended to a file as one compact JSON object per request, as soon as the response is received. Request
+headers, which carry the credentials, and request bodies are never recorded.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from collections.abc import Callable, Mapping
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from http.client import responses
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Final, Protocol
+from urllib.parse import urlsplit
+
+from requests import ConnectionError as RequestsConnectionError
+from requests import PreparedRequest, Response
+from requests.adapters import BaseAdapter, HTTPAdapter
+from urllib3 import HTTPResponse
+
+from rate_limiter import seconds_until
+
+_RECORDED_HEADERS: Final[frozenset[str]] = frozenset(
+    ["content-type", "x-ratelimit-limit", "x-ratelimit-remaining", "x-ratelimit-reset", "retry-after"]
+)
+_RELATIVE_HEADERS: Final[frozenset[str]] = frozenset(["x-ratelimit-reset", "retry-after"])
+"""Headers with a point in time, recorded as seconds from the response, so that they apply again when replayed."""
+_NO_RESPONSE: Final[int] = 0
+"""Status of requests which failed without a response, e.g. on a timeout."""
+
+
+@dataclass(frozen=True, slots=True)
+class Exchange:
+    """Request and its response."""
+
+    service: str
+    method: str
+    path: str
+    """URL path, which identifies the endpoint together with the method."""
+    query: str
+    request_bytes: int
+    status: int
+    headers: dict[str, str]
+    body: str
+    """Response body, or the error if the request failed without a response."""
+    elapsed: float
+    """Seconds until the response was received."""
+    recorded_at: float
+
+    @property
+    def endpoint(self) -> tuple[str, str, str]:
+        return self.service, self.method, self.path
+
+
+class Traffic(Protocol):  # pylint: disable=too-few-public-methods
+    """Transport of API requests, replacing the network."""
+
+    def adapter(self, service: str, default: BaseAdapter) -> BaseAdapter:
+        """Transport of all requests to given service.
+
+        Args:
+            service: Name of the API.
+            default: Transport sending requests over the network.
+        """
+
+
+class TrafficRecorder:
+    """Records all requests to a file, in the order their responses were received. Shared by all APIs and threads."""
+
+    def __init__(self, traffic_file: Path):
+        traffic_file.parent.mkdir(parents=True, exist_ok=True)
+        self._file = traffic_file.open("a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def adapter(self, service: str, default: BaseAdapter) -> BaseAdapter:
+        return _RecordingAdapter(self, service, default)
+
+    def record(self, exchange: Exchange) -> None:
+        line = json.dumps(asdict(exchange), separators=(",", ":")) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()  # Flushed line by line, so that a crash loses at most the request in progress
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+def _recorded_headers(headers: Mapping[str, str]) -> dict[str, str]:
+    now_utc = datetime.now(timezone.utc)
+    recorded = {}
+    for name, value in headers.items():
+        if (name := name.lower()) not in _RECORDED_HEADERS:
+            continue
+        seconds = seconds_until(value, now_utc) if name in _RELATIVE_HEADERS else None
+        recorded[name] = value if seconds is None else f"{seconds:.3f}"
+    return recorded
+
+
+class _RecordingAdapter(BaseAdapter):
+    def __init__(self, recorder: TrafficRecorder, service: str, adapter: BaseAdapter):
+        super().__init__()
+        self._recorder = recorder
+        self._service = service
+        self._adapter = adapter
+
+    def send(  # noqa: PLR0913 # pylint: disable=too-many-arguments
+        self,
+        request: PreparedRequest,
+        stream: bool = False,
+        timeout: Any = None,
+        verify: Any = True,
+        cert: Any = None,
+        proxies: Mapping[str, str] | None = None,
+    ) -> Response:
+        start = time.perf_counter()
+        try:
+            response = self._adapter.send(request, stream, timeout, verify, cert, proxies)
+        except OSError as ex:
+            self._record(request, _NO_RESPONSE, {}, str(ex), time.perf_counter() - start)
+            raise
+        self._record(
+            request,
+            response.status_code,
+            _recorded_headers(response.headers),
+            response.text,
+            response.elapsed.total_seconds(),
+        )
+        return response
+
+    def _record(
+        self, request: PreparedRequest, status: int, headers: dict[str, str], body: str, elapsed: float
+    ) -> None:
+        url = urlsplit(request.url or "")
+        request_body = request.body or b""
+        self._recorder.record(
+            Exchange(
+                service=self._service,
+                method=request.method or "",
+                path=url.path,
+                query=url.query,
+                request_bytes=len(request_body.encode() if isinstance(request_body, str) else request_body),
+                status=status,
+                headers=headers,
+                body=body,
+                elapsed=elapsed,
+                recorded_at=time.time(),
+            )
+        )
+
+    def close(self) -> None:
+        self._adapter.close()
+
+
+class TrafficReplay:
+    """Answers requests with recorded responses, without network access.
+
+    Responses are returned in the recorded order for each endpoint, regardless of the query and body of the request.
+    A replayed sync starting from an empty cache sends different cursors than the recorded one, but gets the same
+    responses. Each response is delayed by its recorded response time divided by the speedup, and so are the rate
+    limit resets it announces.
+    """
+
+    def __init__(self, traffic_file: Path, speedup: float = 1, sleep: Callable[[float], None] = time.sleep):
+        """Constructor.
+
+        Args:
+            traffic_file: File recorded by `TrafficRecorder`.
+            speedup: How many times faster than recorded to respond. Infinite to respond immediately.
+            sleep: Sleep function, injectable for testing.
+        """
+        self._speedup = speedup
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._exchanges: defaultdict[tuple[str, str, str], deque[Exchange]] = defaultdict(deque)
+        self._log = logging.getLogger(self.__class__.__name__)
+
+        with traffic_file.open(encoding="utf-8") as lines:
+            for line_number, line in enumerate(lines, start=1):
+                try:
+                    exchange = Exchange(**json.loads(line))
+                except (ValueError, TypeError):  # E.g. the last line of a recording interrupted by a crash
+                    self._log.warning(f"Skipping invalid line {line_number} of {traffic_file}.")
+                    continue
+                self._exchanges[exchange.endpoint].append(exchange)
+
+        self.total: Final[int] = self.pending()
+
+    def pending(self, service: str | None = None) -> int:
+        """Number of recorded requests not replayed yet, of given service or all."""
+        with self._lock:
+            return sum(len(_) for endpoint, _ in self._exchanges.items() if service in (None, endpoint[0]))
+
+    def adapter(self, service: str, default: BaseAdapter) -> BaseAdapter:
+        return _ReplayAdapter(self, service)
+
+    def take(self, endpoint: tuple[str, str, str]) -> Exchange:
+        """Next recorded exchange with given endpoint, once its response would have been received.
+
+        Raises:
+            requests.ConnectionError: No exchange with the endpoint is left.
+        """
+        with self._lock:
+            if not (exchanges := self._exchanges.get(endpoint)):
+                raise RequestsConnectionError(f"No recorded response left for {endpoint[1]} {endpoint[2]}.")
+            exchange = exchanges.popleft()
+        if delay := exchange.elapsed / self._speedup:
+            self._sleep(delay)
+        return exchange
+
+    def headers(self, exchange: Exchange) -> dict[str, str]:
+        """Response headers, with points in time moved closer by the speedup."""
+        return {
+            name: f"{float(value) / self._speedup:.3f}" if name in _RELATIVE_HEADERS else value
+            for name, value in exchange.headers.items()
+        }
+
+
+class _ReplayAdapter(HTTPAdapter):
+    def __init__(self, replay: TrafficReplay, service: str):
+        super().__init__(pool_connections=1, pool_maxsize=1)
+        self._replay = replay
+        self._service = service
+
+    def send(  # noqa: PLR0913 # pylint: disable=too-many-arguments
+        self,
+        request: PreparedRequest,
+        stream: bool = False,
+        timeout: Any = None,
+        verify: Any = True,
+        cert: Any = None,
+        proxies: Mapping[str, str] | None = None,
+    ) -> Response:
+        exchange = self._replay.take((self._service, request.method or "", urlsplit(request.url or "").path))
+        if exchange.status == _NO_RESPONSE:
+            raise RequestsConnectionError(exchange.body, request=request)
+
+        raw = HTTPResponse(
+            body=BytesIO(exchange.body.encode()),
+            headers=self._replay.headers(exchange),
+            status=exchange.status,
+            reason=responses.get(exchange.status, ""),
+            preload_content=False,
+        )
+        response = self.build_response(request, raw)
+        if not stream:
+            _ = response.content
+        return response
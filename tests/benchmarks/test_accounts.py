@@ -0,0 +1,66 @@
+"""Benchmark of memory used by each account synced in one process.
+
+Not part of the default test run. Run with ``pytest tests/benchmarks/test_accounts.py -s``.
+"""
+
+import gc
+import json
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from config import Account, get_settings
+from main import AccountsSync
+
+_ACCOUNTS = 50
+_MAX_KIB_PER_ACCOUNT = 1024
+
+
+def _rss_kib() -> int:
+    match = re.search(r"VmRSS:\s+(\d+) kB", Path("/proc/self/status").read_text())
+    assert match is not None
+    return int(match[1])
+
+
+def _single_account_process_kib(project_root: Path) -> int:
+    """Memory used by a separate process syncing one account, as when running one container per account."""
+    script = (
+        "import re\nfrom pathlib import Path\nfrom main import TasksSync\nTasksSync()\n"
+        r"print(re.search(r'VmRSS:\s+(\d+) kB', Path('/proc/self/status').read_text())[1])"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script], cwd=project_root / "src", capture_output=True, text=True, check=True
+    )
+    return int(result.stdout)
+
+
+@pytest.mark.usefixtures("database_file")
+class TestAccountsMemoryBenchmark:
+    @staticmethod
+    def should_report_memory_per_account(project_root, monkeypatch):
+        accounts = [
+            Account(todoist_api_key="token", habitica_user_id=f"user-{index}", habitica_api_key="key")
+            for index in range(_ACCOUNTS)
+        ]
+        monkeypatch.setenv("ACCOUNTS", json.dumps([account.model_dump() for account in accounts]))
+        get_settings.cache_clear()
+
+        AccountsSync(get_settings().all_accounts[:1]).close()  # Load everything shared by all accounts
+        gc.collect()
+        rss_before = _rss_kib()
+        accounts_sync = AccountsSync(get_settings().all_accounts)
+        gc.collect()
+        kib_per_account = (_rss_kib() - rss_before) / (_ACCOUNTS + 1)
+        accounts_sync.close()
+
+        result = {
+            "accounts": _ACCOUNTS + 1,
+            "kib_per_account": round(kib_per_account, 1),
+            "kib_per_single_account_process": _single_account_process_kib(project_root),
+        }
+        print(f"\n{json.dumps(result)}")
+
+        assert kib_per_account < _MAX_KIB_PER_ACCOUNT
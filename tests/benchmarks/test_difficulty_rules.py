@@ -0,0 +1,95 @@
+"""Benchmark of classifying completed tasks with a growing number of difficulty rules.
+
+Not part of the default test run. Run with ``pytest tests/benchmarks/test_difficulty_rules.py -s``.
+"""
+
+import random
+import time
+
+from config import Settings
+from difficulty_rules import DifficultyRule, DifficultyRules
+from models.habitica import HabiticaDifficulty
+from models.todoist import CompletedTask, TodoistPriority
+
+_TASKS = 100_000
+_RULE_COUNTS = (1, 10, 100, 1000)
+_MAX_SLOWDOWN = 3
+
+
+def _completed_tasks() -> list[CompletedTask]:
+    rng = random.Random(0)
+    return [
+        CompletedTask(
+            task_id=str(index),
+            completed_at="2025-01-01T10:00:00.000000Z",
+            content=f"Task {index} {rng.choice(['call', 'write', 'review', 'plan'])}",
+            priority=rng.choice(list(TodoistPriority)),
+            labels=tuple(f"label-{rng.randrange(2000)}" for _ in range(rng.randrange(3))),
+            project_id=f"project-{rng.randrange(2000)}",
+            has_due=rng.random() < 0.5,  # noqa: PLR2004
+        )
+        for index in range(_TASKS)
+    ]
+
+
+def _lookup_rules(count: int) -> list[DifficultyRule]:
+    """Rules on labels and projects, alone or combined with other conditions."""
+    difficulties = list(HabiticaDifficulty)
+    rules = []
+    for index in range(count):
+        difficulty = difficulties[index % len(difficulties)]
+        match index % 4:
+            case 0:
+                rules.append(DifficultyRule(difficulty=difficulty, labels=[f"label-{index}"]))
+            case 1:
+                rules.append(DifficultyRule(difficulty=difficulty, project_ids=[f"project-{index}"]))
+            case 2:
+                rules.append(DifficultyRule(difficulty=difficulty, labels=[f"label-{index}"], has_due=True))
+            case _:
+                rules.append(
+                    DifficultyRule(difficulty=difficulty, project_ids=[f"project-{index}"], content_regex="review")
+                )
+    return rules
+
+
+def _content_rules(count: int) -> list[DifficultyRule]:
+    return [
+        DifficultyRule(difficulty=HabiticaDifficulty.HARD, content_regex=f"\\bword{index}\\b") for index in range(count)
+    ]
+
+
+def _classify(rules: list[DifficultyRule], completed_tasks: list[CompletedTask]) -> float:
+    difficulty_rules = DifficultyRules(rules, Settings().priority_to_difficulty)
+    start = time.perf_counter()
+    difficulty_rules.classify(completed_tasks)
+    return time.perf_counter() - start
+
+
+def _scan(rules: list[DifficultyRule], completed_tasks: list[CompletedTask]) -> float:
+    """Checking every rule against every task, as without compiled rules."""
+    priority_to_difficulty = Settings().priority_to_difficulty
+    start = time.perf_counter()
+    for completed_task in completed_tasks:
+        labels = frozenset(label.lower() for label in completed_task.labels)
+        matching = [rule.difficulty for rule in rules if rule.matches(completed_task, labels)]
+        max(matching, default=priority_to_difficulty[completed_task.priority])
+    return time.perf_counter() - start
+
+
+class TestDifficultyRulesBenchmark:
+    @staticmethod
+    def should_classify_in_about_the_same_time_regardless_of_rule_count():
+        completed_tasks = _completed_tasks()
+        lookup = {count: _classify(_lookup_rules(count), completed_tasks) for count in _RULE_COUNTS}
+        content = {count: _classify(_content_rules(count), completed_tasks) for count in _RULE_COUNTS}
+        scan = {count: _scan(_lookup_rules(count), completed_tasks[: _TASKS // 100]) * 100 for count in _RULE_COUNTS}
+
+        print(f"\n{_TASKS} tasks, tasks/s:")
+        print(f"  {'rules':>6} {'lookup rules':>14} {'content rules':>14} {'scan all rules':>15}")
+        for count in _RULE_COUNTS:
+            print(
+                f"  {count:>6} {_TASKS / lookup[count]:>14.0f} {_TASKS / content[count]:>14.0f}"
+                f" {_TASKS / scan[count]:>15.0f}"
+            )
+
+        assert lookup[max(_RULE_COUNTS)] < lookup[min(_RULE_COUNTS)] * _MAX_SLOWDOWN
@@ -0,0 +1,98 @@
+"""Benchmark of replaying recorded traffic of a large batch of tasks completed after a vacation.
+
+Not part of the default test run. Run with ``pytest tests/benchmarks/test_replay.py -s``.
+"""
+
+import json
+import math
+import time
+from pathlib import Path
+
+import pytest
+
+from main import ExitCode, TasksSync
+
+_TASKS = 1000
+_PAGE_SIZE = 200
+_CREATE_BATCH_SIZE = 100
+_NOT_FOUND_EVERY = 5
+"""Every n-th task was deleted in Habitica meanwhile, so deleting it fails with 404."""
+_RESPONSE_SECONDS = 0.02
+_SPEEDUPS = (10.0, math.inf)
+
+
+def _exchange(service: str, method: str, path: str, data: object, status: int = 200) -> str:
+    return json.dumps(
+        {
+            "service": service,
+            "method": method,
+            "path": path,
+            "query": "",
+            "request_bytes": 0,
+            "status": status,
+            "headers": {"content-type": "application/json", "x-ratelimit-remaining": "29"},
+            "body": json.dumps(data),
+            "elapsed": _RESPONSE_SECONDS,
+            "recorded_at": 0,
+        },
+        separators=(",", ":"),
+    )
+
+
+def _completion(index: int) -> dict[str, object]:
+    completed_at = f"2025-01-{1 + index // 3600 % 28:02d}T{index // 60 % 24:02d}:{index % 60:02d}:00.000000Z"
+    return {
+        "task_id": str(index),
+        "user_id": "1",
+        "completed_at": completed_at,
+        "item_object": {
+            "id": str(index),
+            "checked": True,
+            "content": f"Task {index}",
+            "is_deleted": False,
+            "priority": 1,
+        },
+    }
+
+
+def _write_traffic(traffic_file: Path) -> None:
+    lines = [
+        _exchange(
+            "todoist",
+            "GET",
+            "/sync/v9/completed/get_all",
+            {"items": [_completion(index) for index in range(start, start + _PAGE_SIZE)]},
+        )
+        for start in range(0, _TASKS, _PAGE_SIZE)
+    ]
+    lines.append(_exchange("todoist", "GET", "/sync/v9/completed/get_all", {"items": []}))
+    for start in range(0, _TASKS, _CREATE_BATCH_SIZE):
+        created = [{"id": f"habitica-{index}"} for index in range(start, start + _CREATE_BATCH_SIZE)]
+        lines.append(_exchange("habitica", "POST", "/api/v3/tasks/user", {"data": created}))
+    for index in range(_TASKS):
+        lines.append(_exchange("habitica", "POST", f"/api/v3/tasks/habitica-{index}/score/up", {"data": {}}))
+        if index % _NOT_FOUND_EVERY:
+            lines.append(_exchange("habitica", "DELETE", f"/api/v3/tasks/habitica-{index}", {"data": {}}))
+        else:
+            error = {"error": "NotFound", "message": "Task not found."}
+            lines.append(_exchange("habitica", "DELETE", f"/api/v3/tasks/habitica-{index}", error, status=404))
+    traffic_file.write_text("\n".join(lines) + "\n")
+
+
+@pytest.mark.usefixtures("database_file")
+class TestReplayBenchmark:
+    @staticmethod
+    def should_report_tasks_per_second(tmp_path):
+        traffic_file = tmp_path / "traffic.jsonl"
+        _write_traffic(traffic_file)
+        results = {}
+        for speedup in _SPEEDUPS:
+            start = time.perf_counter()
+            assert TasksSync.replay(traffic_file, speedup) is ExitCode.SUCCESS
+            results[speedup] = time.perf_counter() - start
+
+        print(f"\n{_TASKS} tasks, {_RESPONSE_SECONDS * 1000:.0f} ms recorded response time:")
+        for speedup, elapsed in results.items():
+            print(f"  {'max' if speedup == math.inf else f'{speedup:.0f}x':>5} {_TASKS / elapsed:>10.0f} tasks/s")
+
+        assert results[math.inf] < results[10.0]
@@ -0,0 +1,155 @@
+"""End-to-end benchmark of `TasksSync` against local Todoist and Habitica stub servers.
+
+Not part of the default test run. Run with ``pytest tests/benchmarks/test_sync.py -s``. Results are written
+as JSON to ``BENCHMARK_RESULTS_FILE`` (``benchmark-results.json`` by default) to compare them across versions.
+
+The stub servers are configured with environment variables:
+
+- ``BENCHMARK_SIZES``: comma separated numbers of completed tasks in the backlog.
+- ``BENCHMARK_LATENCY_MS``: latency of each API call.
+- ``BENCHMARK_ERROR_RATE``: probability of each API call failing.
+- ``BENCHMARK_HABITICA_RATE_LIMIT``: Habitica calls allowed per second.
+- ``BENCHMARK_WORKERS``: number of workers sharing the sync cache, each with its own database connection.
+
+The sync itself is configured as usual, e.g. ``SYNC_CONCURRENCY``.
+"""
+
+import json
+import os
+import resource
+import statistics
+import threading
+import time
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+from integration.habitica_stub import HabiticaStubServer
+from integration.todoist_stub import TodoistStubServer
+
+import main
+from habitica_api import HabiticaAPI, HabiticaAPIHeaders
+from main import TasksSync
+from models.generic_task import GenericTask
+from models.todoist import CompletedSyncCursor
+from rate_limiter import TokenBucket
+from todoist_api import TodoistAPI
+
+_SIZES = [int(size) for size in os.environ.get("BENCHMARK_SIZES", "10,1000,10000").split(",")]
+_LATENCY_SECONDS = float(os.environ.get("BENCHMARK_LATENCY_MS", "0")) / 1000
+_ERROR_RATE = float(os.environ.get("BENCHMARK_ERROR_RATE", "0"))
+_HABITICA_RATE_LIMIT = int(os.environ.get("BENCHMARK_HABITICA_RATE_LIMIT", "100000"))
+_WORKERS = int(os.environ.get("BENCHMARK_WORKERS", "1"))
+_RESULTS_FILE = Path(os.environ.get("BENCHMARK_RESULTS_FILE", "benchmark-results.json"))
+_MAX_SYNC_CYCLES = 1000
+_SINCE = "2000-01-01T00:00:00.000000Z"
+
+
+@pytest.fixture(scope="module")
+def results(poetry) -> Iterator[list[dict]]:
+    results: list[dict] = []
+    yield results
+    _RESULTS_FILE.write_text(
+        json.dumps(
+            {
+                "version": poetry.version,
+                "scenario": {
+                    "latency_seconds": _LATENCY_SECONDS,
+                    "error_rate": _ERROR_RATE,
+                    "habitica_rate_limit_per_second": _HABITICA_RATE_LIMIT,
+                    "workers": _WORKERS,
+                },
+                "results": results,
+            },
+            indent=2,
+        )
+    )
+    print(f"\nResults written to {_RESULTS_FILE.absolute()}")
+
+
+def _percentile(values: list[float], percentile: int) -> float:
+    return statistics.quantiles(values, n=100, method="inclusive")[percentile - 1] if len(values) > 1 else values[0]
+
+
+def _worker(
+    todoist_stub: TodoistStubServer,
+    habitica_stub: HabiticaStubServer,
+    rate_limiter: TokenBucket,
+    finished_at: list[float],
+) -> TasksSync:
+    tasks_sync = TasksSync()
+    tasks_sync._max_task_attempts = _MAX_SYNC_CYCLES
+    tasks_sync._todoist = TodoistAPI("token", api_uri_base=todoist_stub.api_uri_base)
+    tasks_sync.habitica = HabiticaAPI(
+        HabiticaAPIHeaders(user_id="user", api_key="key"),
+        api_uri_base=habitica_stub.api_uri_base,
+        rate_limiter=rate_limiter,
+    )
+    delete_states = tasks_sync.delete_states
+
+    def record_finished(generic_tasks: list[GenericTask]) -> None:
+        finished_at.extend(time.perf_counter() for _ in generic_tasks)
+        delete_states(generic_tasks)
+
+    tasks_sync.delete_states = record_finished  # type: ignore[method-assign]
+    tasks_sync.delete_state = lambda generic_task: record_finished([generic_task])  # type: ignore[method-assign]
+    return tasks_sync
+
+
+def _run_sync_cycles(tasks_sync: TasksSync, finished_at: list[float], completed_tasks: int) -> None:
+    for _ in range(_MAX_SYNC_CYCLES):
+        tasks_sync._queue_todoist_completed_tasks()
+        tasks_sync._next_tasks_state()
+        if len(finished_at) >= completed_tasks:
+            break
+
+
+@pytest.mark.usefixtures("database_file")
+class TestSyncBenchmark:
+    @staticmethod
+    @pytest.mark.parametrize("completed_tasks", _SIZES)
+    def should_report_sync_throughput(completed_tasks: int, results: list[dict], monkeypatch):
+        monkeypatch.setattr(main, "_RETRY_BASE_DELAY_SECONDS", 0)  # Retry failed calls in the next sync cycle
+        todoist_stub = TodoistStubServer(completed_tasks, latency=_LATENCY_SECONDS, error_rate=_ERROR_RATE)
+        habitica_stub = HabiticaStubServer(
+            limit=_HABITICA_RATE_LIMIT, window=1, latency=_LATENCY_SECONDS, error_rate=_ERROR_RATE
+        )
+
+        with todoist_stub, habitica_stub:
+            rate_limiter = TokenBucket(_HABITICA_RATE_LIMIT, 1)
+            finished_at: list[float] = []
+            workers = [_worker(todoist_stub, habitica_stub, rate_limiter, finished_at) for _ in range(_WORKERS)]
+            workers[0]._task_cache.completed_sync_cursor = CompletedSyncCursor(since=_SINCE)
+
+            start = time.perf_counter()
+            workers[0]._queue_todoist_completed_tasks()
+            threads = [
+                threading.Thread(target=_run_sync_cycles, args=(worker, finished_at, completed_tasks))
+                for worker in workers
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            for worker in workers:
+                worker._task_cache.close()
+
+        api_calls = todoist_stub.requests + len(habitica_stub.requests) + habitica_stub.rejected + habitica_stub.failed
+        latencies = [finished - start for finished in finished_at]
+        result = {
+            "completed_tasks": completed_tasks,
+            "synced_tasks": len(finished_at),
+            "elapsed_seconds": round(elapsed, 3),
+            "tasks_per_second": round(len(finished_at) / elapsed, 1),
+            "api_calls_per_task": round(api_calls / completed_tasks, 3),
+            # Latency from the start of the sync to the task being deleted from the cache
+            "latency_p50_seconds": round(_percentile(latencies, 50), 3),
+            "latency_p99_seconds": round(_percentile(latencies, 99), 3),
+            # Peak of the whole test process, so it never decreases across sizes
+            "peak_rss_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+        results.append(result)
+        print(f"\n{json.dumps(result)}")
+
+        assert len(finished_at) == completed_tasks
@@ -0,0 +1,84 @@
+"""Micro-benchmark of FSM state transitions persisted in the tasks cache.
+
+Not part of the default test run. Run with ``pytest tests/benchmarks/test_tasks_cache.py -s``.
+"""
+
+import dataclasses
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+import pytest
+
+from models.generic_task import GenericTask
+from models.habitica import HabiticaDifficulty
+from tasks_cache import TasksCache
+
+_TASKS = 200
+_STATES = ["HabiticaNew", "HabiticaCreated", "HabiticaFinished"]
+
+
+def _generic_tasks() -> list[GenericTask]:
+    return [
+        GenericTask(content=f"Task {i}", difficulty=HabiticaDifficulty.EASY, state=_STATES[0]) for i in range(_TASKS)
+    ]
+
+
+def _connection_per_transition(db_path: Path) -> float:
+    """Baseline: a new connection and a rollback journal transaction for each transition."""
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE tasks_cache (id TEXT PRIMARY KEY NOT NULL, task_data TEXT)")
+
+    start = time.perf_counter()
+    for generic_task in _generic_tasks():
+        for state in _STATES:
+            generic_task.state = state
+            conn = sqlite3.connect(db_path)
+            conn.execute(
+                "INSERT OR REPLACE INTO tasks_cache (id, task_data) VALUES (?, ?)",
+                (str(generic_task.id), json.dumps(dataclasses.asdict(generic_task), default=str)),
+            )
+            conn.commit()
+            conn.close()
+    return time.perf_counter() - start
+
+
+def _persistent_connection(tasks_cache: TasksCache) -> float:
+    start = time.perf_counter()
+    for generic_task in _generic_tasks():
+        for state in _STATES:
+            generic_task.state = state
+            tasks_cache.save_task(generic_task)
+    return time.perf_counter() - start
+
+
+def _unit_of_work(tasks_cache: TasksCache) -> float:
+    start = time.perf_counter()
+    generic_tasks = _generic_tasks()
+    for state in _STATES:
+        with tasks_cache.transaction():
+            for generic_task in generic_tasks:
+                generic_task.state = state
+                tasks_cache.save_task(generic_task)
+    return time.perf_counter() - start
+
+
+@pytest.mark.usefixtures("database_file")
+class TestTasksCacheBenchmark:
+    @staticmethod
+    def should_report_transitions_per_second(tmp_path):
+        transitions = _TASKS * len(_STATES)
+        tasks_cache = TasksCache()
+        results = {
+            "connection per transition": _connection_per_transition(tmp_path / "baseline.sqlite"),
+            "persistent WAL connection": _persistent_connection(tasks_cache),
+            "unit of work per sync cycle": _unit_of_work(tasks_cache),
+        }
+        tasks_cache.close()
+
+        print(f"\n{transitions} transitions:")
+        for name, elapsed in results.items():
+            print(f"  {name:<30} {transitions / elapsed:>10.0f} transitions/s")
+
+        assert results["persistent WAL connection"] < results["connection per transition"]
@@ -0,0 +1,122 @@
+"""Micro-benchmark of decoding a `completed/get_all` response.
+
+Not part of the default test run. Run with ``pytest tests/benchmarks/test_todoist_decoding.py -s``.
+"""
+
+import json
+import time
+
+from dateutil.parser import parse
+from pydantic import BaseModel, ConfigDict
+
+from models.todoist import CompletedTodoistTasks, TodoistDue
+
+_ITEMS = 10_000
+
+
+class _LegacyTodoistTask(BaseModel):
+    """Item model keeping all fields and parsing dates with dateutil, as used before."""
+
+    checked: bool
+    content: str
+    due: TodoistDue | None = None
+    id: str
+    is_deleted: bool
+    priority: int
+    completed_at: str | None = None
+    due_date_utc_timestamp: int | None = None
+    completed_at_utc_timestamp: int | None = None
+
+    def __init__(self, **data):
+        super().__init__(**data)
+        if (due := data.get("due", None)) is not None:
+            self.due_date_utc_timestamp = int(parse(due["date"]).timestamp())
+        if (completed_at := data.get("completed_at", None)) is not None:
+            self.completed_at_utc_timestamp = int(parse(completed_at).timestamp())
+
+    model_config = ConfigDict(extra="allow")
+
+
+class _LegacyCompletedTodoistTask(BaseModel):
+    task_id: str
+    user_id: str
+    completed_at: str
+    item_object: _LegacyTodoistTask
+
+
+def _payload() -> bytes:
+    items: list[dict[str, object]] = []
+    for index in range(_ITEMS):
+        completed_at = f"2025-01-01T{index // 3600 % 24:02d}:{index // 60 % 60:02d}:{index % 60:02d}.000000Z"
+        items.append(
+            {
+                "task_id": str(index),
+                "user_id": "1",
+                "completed_at": completed_at,
+                "id": str(index),
+                "project_id": "2",
+                "section_id": None,
+                "content": f"Task {index}",
+                "meta_data": None,
+                "note_count": 0,
+                "notes": [],
+                "item_object": {
+                    "id": str(index),
+                    "user_id": "1",
+                    "project_id": "2",
+                    "section_id": None,
+                    "parent_id": None,
+                    "content": f"Task {index}",
+                    "description": "",
+                    "checked": True,
+                    "is_deleted": False,
+                    "priority": 1 + index % 4,
+                    "labels": ["work"],
+                    "child_order": index,
+                    "collapsed": False,
+                    "added_at": "2024-12-31T10:00:00.000000Z",
+                    "added_by_uid": "1",
+                    "assigned_by_uid": None,
+                    "responsible_uid": None,
+                    "completed_at": completed_at,
+                    "sync_id": None,
+                    "duration": None,
+                    "due": {
+                        "date": "2025-01-01",
+                        "timezone": None,
+                        "string": "every day",
+                        "lang": "en",
+                        "is_recurring": True,
+                    },
+                },
+            }
+        )
+    return json.dumps({"items": items, "projects": {}, "sections": {}}).encode()
+
+
+def _legacy(payload: bytes) -> float:
+    start = time.perf_counter()
+    [_LegacyCompletedTodoistTask(**data) for data in json.loads(payload)["items"]]
+    return time.perf_counter() - start
+
+
+def _validate_json(payload: bytes) -> float:
+    start = time.perf_counter()
+    CompletedTodoistTasks.model_validate_json(payload)
+    return time.perf_counter() - start
+
+
+class TestTodoistDecodingBenchmark:
+    @staticmethod
+    def should_report_items_per_second():
+        payload = _payload()
+        results = {
+            "json.loads + dateutil": _legacy(payload),
+            "validate JSON + fromisoformat": _validate_json(payload),
+        }
+
+        print(f"\n{_ITEMS} items, {len(payload) / 1024 / 1024:.1f} MiB:")
+        for name, elapsed in results.items():
+            print(f"  {name:<30} {_ITEMS / elapsed:>10.0f} items/s")
+
+        assert results["validate JSON + fromisoformat"] < results["json.loads + dateutil"]
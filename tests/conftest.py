@@ -5,6 +5,8 @@ import toml
 from delfino.constants import PYPROJECT_TOML_FILENAME
 from delfino.models import PyprojectToml
 
+from config import get_settings
+
 
 @pytest.fixture(scope="session")
 def project_root():
@@ -20,3 +22,13 @@ def pyproject_toml(project_root):
 def poetry(pyproject_toml):
     assert pyproject_toml.tool.poetry
     return pyproject_toml.tool.poetry
+
+
+@pytest.fixture
+def database_file(tmp_path, monkeypatch):
+    """Point the sync cache to a temporary database."""
+    database_file = tmp_path / "sync_cache.sqlite"
+    monkeypatch.setenv("DATABASE_FILE", str(database_file))
+    get_settings.cache_clear()
+    yield database_file
+    get_settings.cache_clear()
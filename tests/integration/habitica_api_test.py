@@ -0,0 +1,103 @@
+import time
+
+import pytest
+
+from habitica_api import HabiticaAPI, HabiticaAPIHeaders
+from models.habitica import HabiticaDifficulty
+from rate_limiter import TokenBucket
+
+from .habitica_stub import HabiticaStubServer
+
+_FIXED_DELAY_SECONDS = 30
+"""Delay between calls used before the rate limiter was driven by response headers."""
+_MIN_SPEEDUP = 100
+_MAX_ELAPSED_SECONDS = 5
+
+
+def _habitica(stub: HabiticaStubServer, rate_limiter: TokenBucket) -> HabiticaAPI:
+    return HabiticaAPI(
+        HabiticaAPIHeaders(user_id="user", api_key="key"),
+        api_uri_base=stub.api_uri_base,
+        rate_limiter=rate_limiter,
+    )
+
+
+@pytest.mark.slow
+class TestHabiticaAPIRateLimiting:
+    @staticmethod
+    def should_send_calls_as_fast_as_the_server_allows():
+        calls = 25
+        with HabiticaStubServer(limit=10, window=1) as stub:
+            habitica = _habitica(stub, TokenBucket(10, 1))
+
+            start = time.monotonic()
+            for _ in range(calls):
+                habitica.create_tasks([("Task", HabiticaDifficulty.EASY)])
+            elapsed = time.monotonic() - start
+
+        throughput = calls / elapsed
+        print(
+            f"\n{calls} calls in {elapsed:.2f}s: {throughput:.1f} calls/s, "
+            f"{throughput * _FIXED_DELAY_SECONDS:.0f}x faster than a fixed {_FIXED_DELAY_SECONDS}s delay"
+        )
+        assert len(stub.requests) == calls
+        assert elapsed < _MAX_ELAPSED_SECONDS
+        assert throughput * _FIXED_DELAY_SECONDS > _MIN_SPEEDUP
+
+    @staticmethod
+    def should_recover_from_too_many_requests():
+        calls = 8
+        with HabiticaStubServer(limit=5, window=1) as stub:
+            # The local estimate is too optimistic, so the server has to push back
+            habitica = _habitica(stub, TokenBucket(1000, 1))
+
+            for _ in range(calls):
+                habitica.score_task("task-id")
+
+        assert len(stub.requests) == calls
+
+
+class TestHabiticaAPITransport:
+    @staticmethod
+    def should_call_task_endpoints():
+        with HabiticaStubServer(limit=100) as stub:
+            habitica = _habitica(stub, TokenBucket(100, 60))
+            habitica.create_tasks([("Task", HabiticaDifficulty.EASY)])
+            habitica.score_task("task-id")
+            habitica.delete_task("task-id")
+            habitica.get_completed_todos()
+            habitica.clear_completed_todos()
+            habitica.close()
+
+        assert stub.requests == [
+            ("POST", "/api/v3/tasks/user"),
+            ("POST", "/api/v3/tasks/task-id/score/up"),
+            ("DELETE", "/api/v3/tasks/task-id"),
+            ("GET", "/api/v3/tasks/user?type=_allCompletedTodos"),
+            ("POST", "/api/v3/tasks/clearCompletedTodos"),
+        ]
+
+    @staticmethod
+    def should_reuse_connection():
+        calls = 5
+        with HabiticaStubServer(limit=100) as stub:
+            habitica = _habitica(stub, TokenBucket(100, 60))
+            for _ in range(calls):
+                habitica.score_task("task-id")
+            habitica.close()
+
+        assert len(stub.requests) == calls
+        assert stub.connections == 1
+
+    @staticmethod
+    def should_time_out_on_slow_response():
+        with HabiticaStubServer(limit=100, latency=1) as stub:
+            habitica = HabiticaAPI(
+                HabiticaAPIHeaders(user_id="user", api_key="key"),
+                api_uri_base=stub.api_uri_base,
+                rate_limiter=TokenBucket(100, 60),
+                timeout=(1, 0.1),
+            )
+            with pytest.raises(OSError, match="timed out"):
+                habitica.score_task("task-id")
+            habitica.close()
@@ -0,0 +1,134 @@
+"""Local HTTP server imitating the Habitica task endpoints and their rate limiting."""
+
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_JS_DATE_FORMAT = "%a %b %d %Y %H:%M:%S GMT+0000 (Coordinated Universal Time)"
+
+
+class HabiticaStubServer:
+    """Habitica stub with a fixed window rate limiter aligned to whole seconds.
+
+    Sends the same ``X-RateLimit-*`` and ``Retry-After`` headers as the real server.
+    """
+
+    def __init__(self, limit: int = 30, window: int = 60, latency: float = 0, error_rate: float = 0, seed: int = 0):
+        """Constructor.
+
+        Args:
+            limit: Maximum number of calls per window.
+            window: Length of the rate limiting window in seconds.
+            latency: Seconds to wait before responding to each call.
+            error_rate: Probability of a call failing with an internal server error.
+            seed: Seed of the random errors, for repeatable runs.
+        """
+        self.limit = limit
+        self.window = window
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests: list[tuple[str, str]] = []
+        self.rejected = 0
+        self.failed = 0
+        self.connections = 0
+        self._random = random.Random(seed)
+        self._window_start = 0
+        self._window_calls = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def api_uri_base(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/api/v3"
+
+    def __enter__(self) -> "HabiticaStubServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _take(self) -> tuple[bool, int, float]:
+        """Count one call. Returns whether it is allowed, remaining calls and reset time."""
+        with self._lock:
+            now = time.time()
+            window_start = math.floor(now / self.window) * self.window
+            if window_start != self._window_start:
+                self._window_start = window_start
+                self._window_calls = 0
+            self._window_calls += 1
+            return self._window_calls <= self.limit, max(0, self.limit - self._window_calls), window_start + self.window
+
+    def _fails(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    @staticmethod
+    def _data(method: str, path: str, request_body: bytes) -> object:
+        if method == "GET" and "_allCompletedTodos" in path:
+            return []
+        if isinstance(request := json.loads(request_body or b"null"), list):  # Tasks created in bulk
+            return [{"id": str(uuid.uuid4())} for _ in request]
+        return {"id": str(uuid.uuid4())}
+
+    def _handler_class(self) -> type[BaseHTTPRequestHandler]:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive
+            disable_nagle_algorithm = True  # Headers and body are written separately
+
+            def setup(self) -> None:
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+
+            def _respond(self) -> None:
+                request_body = self.rfile.read(int(self.headers.get("content-length", 0)))
+                if stub.latency:
+                    time.sleep(stub.latency)
+
+                allowed, remaining, reset_at = stub._take()
+                reset = datetime.fromtimestamp(reset_at, timezone.utc)
+
+                if allowed and stub._fails():
+                    stub.failed += 1
+                    status = HTTPStatus.INTERNAL_SERVER_ERROR
+                    body: dict = {"success": False, "error": "InternalServerError"}
+                elif allowed:
+                    stub.requests.append((self.command, self.path))
+                    status = HTTPStatus.CREATED if self.command == "POST" else HTTPStatus.OK
+                    body = {"success": True, "data": stub._data(self.command, self.path, request_body)}
+                else:
+                    stub.rejected += 1
+                    status = HTTPStatus.TOO_MANY_REQUESTS
+                    body = {"success": False, "error": "TooManyRequests"}
+
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(payload)))
+                self.send_header("x-ratelimit-limit", str(stub.limit))
+                self.send_header("x-ratelimit-remaining", str(remaining))
+                self.send_header(
+                    "x-ratelimit-reset", reset.strftime("%a %b %d %Y %H:%M:%S GMT+0000 (Coordinated Universal Time)")
+                )
+                if not allowed:
+                    self.send_header("retry-after", str(math.ceil(reset_at - time.time())))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _respond  # noqa: N815
+
+            def log_message(self, *_) -> None:  # silence request logging
+                pass
+
+        return Handler
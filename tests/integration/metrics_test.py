@@ -0,0 +1,37 @@
+from collections.abc import Iterator
+from http import HTTPStatus
+
+import pytest
+import requests
+
+from metrics import Counter, Registry
+from metrics_server import MetricsServer
+
+
+@pytest.fixture
+def registry() -> Registry:
+    return Registry()
+
+
+@pytest.fixture
+def metrics_url(registry) -> Iterator[str]:
+    server = MetricsServer(0, registry, host="127.0.0.1")
+    server.start()
+    yield f"http://127.0.0.1:{server.port}"
+    server.stop()
+
+
+class TestMetricsServer:
+    @staticmethod
+    def should_serve_metrics(registry: Registry, metrics_url: str):
+        Counter("calls_total", "Calls.", registry=registry).inc()
+
+        response = requests.get(f"{metrics_url}/metrics", timeout=5)
+
+        assert response.status_code == HTTPStatus.OK
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        assert "calls_total 1" in response.text.splitlines()
+
+    @staticmethod
+    def should_return_not_found_for_other_paths(metrics_url: str):
+        assert requests.get(f"{metrics_url}/other", timeout=5).status_code == HTTPStatus.NOT_FOUND
@@ -0,0 +1,37 @@
+import pytest
+
+from habitica_api import HabiticaAPI, HabiticaAPIHeaders
+from main import TasksSync
+from models.todoist import CompletedSyncCursor
+from rate_limiter import TokenBucket
+from todoist_api import TodoistAPI
+
+from .habitica_stub import HabiticaStubServer
+from .todoist_stub import TodoistStubServer
+
+_COMPLETED_TASKS = 5
+_SINCE = "2000-01-01T00:00:00.000000Z"
+
+
+@pytest.mark.usefixtures("database_file")
+class TestSyncAgainstStubServers:
+    @staticmethod
+    def should_create_score_and_delete_each_completed_task():
+        with TodoistStubServer(_COMPLETED_TASKS) as todoist_stub, HabiticaStubServer(limit=100) as habitica_stub:
+            tasks_sync = TasksSync()
+            tasks_sync._todoist = TodoistAPI("token", api_uri_base=todoist_stub.api_uri_base)
+            tasks_sync.habitica = HabiticaAPI(
+                HabiticaAPIHeaders(user_id="user", api_key="key"),
+                api_uri_base=habitica_stub.api_uri_base,
+                rate_limiter=TokenBucket(100, 60),
+            )
+            tasks_sync._task_cache.completed_sync_cursor = CompletedSyncCursor(since=_SINCE)
+
+            tasks_sync._queue_todoist_completed_tasks()
+            tasks_sync._next_tasks_state()
+
+            assert tasks_sync._task_cache.tasks_stats() == {}
+            tasks_sync._task_cache.close()
+
+        methods = [method for method, _ in habitica_stub.requests]
+        assert methods == ["POST"] + ["POST"] * _COMPLETED_TASKS + ["DELETE"] * _COMPLETED_TASKS
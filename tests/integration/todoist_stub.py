@@ -0,0 +1,113 @@
+"""Local HTTP server imitating the Todoist archive of completed tasks."""
+
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+_COMPLETED_GET_ALL_PATH = "/sync/v9/completed/get_all"
+
+
+def completed_task(index: int, completed_at: datetime) -> dict:
+    """A completed task as returned by `completed/get_all` with `annotate_items`."""
+    completed_at_str = completed_at.isoformat(timespec="microseconds").replace("+00:00", "Z")
+    return {
+        "task_id": str(index),
+        "user_id": "1",
+        "completed_at": completed_at_str,
+        "item_object": {
+            "checked": True,
+            "content": f"Task {index}",
+            "id": str(index),
+            "user_id": "1",
+            "is_deleted": False,
+            "priority": 1 + index % 4,
+            "labels": [],
+            "completed_at": completed_at_str,
+        },
+    }
+
+
+class TodoistStubServer:
+    """Todoist stub serving a fixed backlog of completed tasks, newest first, with an inclusive `until`."""
+
+    def __init__(self, completed_tasks: int, latency: float = 0, error_rate: float = 0, seed: int = 0):
+        """Constructor.
+
+        Args:
+            completed_tasks: Number of tasks in the archive, all completed in the last hour.
+            latency: Seconds to wait before responding to each call.
+            error_rate: Probability of a call failing with an internal server error.
+            seed: Seed of the random errors, for repeatable runs.
+        """
+        now = datetime.now(timezone.utc)
+        self.items = [
+            completed_task(index, now - timedelta(hours=1) + timedelta(microseconds=index))
+            for index in reversed(range(completed_tasks))
+        ]
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self.failed = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def api_uri_base(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/sync/v9"
+
+    def __enter__(self) -> "TodoistStubServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _page(self, query: dict[str, list[str]]) -> list[dict]:
+        since, until = query.get("since", [None])[0], query.get("until", [None])[0]
+        return [
+            item
+            for item in self.items
+            if (since is None or item["completed_at"] > since) and (until is None or item["completed_at"] <= until)
+        ][: int(query.get("limit", ["30"])[0])]
+
+    def _handler_class(self) -> type[BaseHTTPRequestHandler]:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:  # noqa: N802
+                if stub.latency:
+                    time.sleep(stub.latency)
+
+                url = urlparse(self.path)
+                with stub._lock:
+                    stub.requests += 1
+                    fails = stub._random.random() < stub.error_rate
+                    stub.failed += fails
+
+                body: dict[str, object]
+                if url.path != _COMPLETED_GET_ALL_PATH:
+                    status, body = HTTPStatus.NOT_FOUND, {}
+                elif fails:
+                    status, body = HTTPStatus.INTERNAL_SERVER_ERROR, {}
+                else:
+                    status, body = HTTPStatus.OK, {"items": stub._page(parse_qs(url.query))}
+
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *_) -> None:  # silence request logging
+                pass
+
+        return Handler
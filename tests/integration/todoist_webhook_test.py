@@ -0,0 +1,93 @@
+import json
+from collections.abc import Iterator
+from http import HTTPStatus
+
+import pytest
+import requests
+
+from models.todoist import CompletedTask, TodoistTaskFilter
+from todoist_webhook import TodoistWebhookServer, sign
+
+_CLIENT_SECRET = "client-secret"
+_EXCLUDED_PROJECT_ID = "excluded-project"
+
+
+@pytest.fixture
+def completed_tasks() -> list[CompletedTask]:
+    return []
+
+
+@pytest.fixture
+def webhook_url(completed_tasks) -> Iterator[str]:
+    server = TodoistWebhookServer(
+        0,
+        _CLIENT_SECRET,
+        completed_tasks.append,
+        host="127.0.0.1",
+        task_filter=TodoistTaskFilter(exclude_project_ids=frozenset({_EXCLUDED_PROJECT_ID})),
+    )
+    server.start()
+    yield f"http://127.0.0.1:{server.port}/"
+    server.stop()
+
+
+def _post(url: str, event: dict, client_secret: str = _CLIENT_SECRET) -> requests.Response:
+    body = json.dumps(event).encode()
+    return requests.post(url, data=body, headers={"X-Todoist-Hmac-SHA256": sign(body, client_secret)}, timeout=5)
+
+
+def _event(event_name: str = "item:completed", **item_fields: object) -> dict:
+    return {
+        "event_name": event_name,
+        "user_id": "2671355",
+        "event_data": {
+            "id": "6X7rM8997g3RQmvh",
+            "user_id": "2671355",
+            "content": "Buy milk",
+            "checked": True,
+            "is_deleted": False,
+            "priority": 4,
+            "labels": ["shopping"],
+            "completed_at": "2025-01-01T10:00:00.000000Z",
+            **item_fields,
+        },
+    }
+
+
+class TestTodoistWebhookServer:
+    @staticmethod
+    def should_accept_signed_completion(webhook_url, completed_tasks):
+        response = _post(webhook_url, _event())
+
+        assert response.status_code == HTTPStatus.OK
+        assert [(_.task_id, _.completed_at, _.content) for _ in completed_tasks] == [
+            ("6X7rM8997g3RQmvh", "2025-01-01T10:00:00.000000Z", "Buy milk")
+        ]
+
+    @staticmethod
+    def should_skip_completion_not_matching_task_filter(webhook_url, completed_tasks):
+        response = _post(webhook_url, _event(project_id=_EXCLUDED_PROJECT_ID))
+
+        assert response.status_code == HTTPStatus.OK
+        assert not completed_tasks
+
+    @staticmethod
+    def should_reject_invalid_signature(webhook_url, completed_tasks):
+        response = _post(webhook_url, _event(), client_secret="wrong-secret")
+
+        assert response.status_code == HTTPStatus.UNAUTHORIZED
+        assert not completed_tasks
+
+    @staticmethod
+    def should_ignore_other_events(webhook_url, completed_tasks):
+        response = _post(webhook_url, _event("item:updated"))
+
+        assert response.status_code == HTTPStatus.OK
+        assert not completed_tasks
+
+    @staticmethod
+    def should_reject_malformed_events(webhook_url, completed_tasks):
+        response = _post(webhook_url, {"event_name": "item:completed"})
+
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+        assert not completed_tasks
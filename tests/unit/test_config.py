@@ -1,3 +1,7 @@
+import json
+from datetime import time
+from pathlib import Path
+
 import pytest
 
 from config import _DEFAULT_PRIORITY_TO_DIFFICULTY, Settings, get_settings
@@ -95,3 +99,79 @@ class TestGetSettings:
     @staticmethod
     def should_cache_settings():
         assert get_settings() is get_settings()
+
+
+class TestConfigWebhook:
+    @staticmethod
+    def should_require_client_secret():
+        with pytest.raises(ValueError, match="todoist_client_secret must be set"):
+            Settings(webhook_port=8080)
+
+    @staticmethod
+    def should_accept_port_with_client_secret():
+        assert Settings(webhook_port=8080, todoist_client_secret="secret").webhook_port == 8080  # noqa: PLR2004
+
+
+class TestConfigSyncDelay:
+    @staticmethod
+    def should_parse_quiet_hours():
+        assert Settings(quiet_hours="23:00-07:30").quiet_hours == (time(23), time(7, 30))
+
+    @staticmethod
+    def should_refuse_invalid_quiet_hours():
+        with pytest.raises(ValueError, match="HH:MM-HH:MM"):
+            Settings(quiet_hours="23:00")
+
+    @staticmethod
+    def should_refuse_max_sync_delay_lower_than_sync_delay(monkeypatch):
+        monkeypatch.setenv("SYNC_DELAY_MINUTES", "10")
+        monkeypatch.setenv("MAX_SYNC_DELAY_MINUTES", "5")
+        with pytest.raises(ValueError, match="must not be lower"):
+            Settings()
+
+
+def _account(habitica_user_id: str) -> dict[str, str]:
+    return {"todoist_api_key": "token", "habitica_user_id": habitica_user_id, "habitica_api_key": "key"}
+
+
+class TestConfigAccounts:
+    @staticmethod
+    def should_parse_accounts_from_json(monkeypatch):
+        monkeypatch.setenv("ACCOUNTS", json.dumps([_account("second") | {"todoist_user_id": 2}]))
+
+        assert [account.todoist_user_id for account in Settings().all_accounts] == [None, 2]
+
+    @staticmethod
+    def should_keep_a_database_file_per_account():
+        settings = Settings(database_file="cache/sync_cache.sqlite", accounts=[_account("second")])
+
+        assert [settings.account_database_file(account) for account in settings.all_accounts] == [
+            Path("cache/sync_cache.sqlite"),
+            Path("cache/sync_cache_second.sqlite"),
+        ]
+
+    @staticmethod
+    def should_refuse_the_same_habitica_user_twice():
+        with pytest.raises(ValueError, match="different habitica_user_id"):
+            Settings(habitica_user_id="first", accounts=[_account("first")])
+
+    @staticmethod
+    def should_refuse_webhooks():
+        with pytest.raises(ValueError, match="webhook_port must not be set"):
+            Settings(webhook_port=8080, todoist_client_secret="secret", accounts=[_account("second")])
+
+
+class TestConfigTodoistTaskFilter:
+    @staticmethod
+    def should_split_comma_separated_values(monkeypatch):
+        monkeypatch.setenv("TODOIST_INCLUDE_LABELS", "Work, Home")
+
+        assert Settings().todoist_include_labels == ["Work", "Home"]
+
+    @staticmethod
+    def should_build_filter_of_account():
+        settings = Settings(todoist_user_id=9, todoist_exclude_labels=["Later"])
+
+        task_filter = settings.todoist_task_filter(settings.all_accounts[0])
+
+        assert (task_filter.exclude_labels, task_filter.user_id) == (frozenset({"later"}), "9")
@@ -0,0 +1,45 @@
+from datetime import datetime, time
+
+import pytest
+
+from delay import AdaptiveSyncDelay
+
+_MIN_DELAY = 60
+_MAX_DELAY = 600
+
+
+def _clock(hour: int, minute: int = 0):
+    return lambda: datetime(2025, 1, 1, hour, minute)
+
+
+class TestAdaptiveSyncDelay:
+    @staticmethod
+    def should_back_off_when_no_tasks_are_found():
+        sync_delay = AdaptiveSyncDelay(_MIN_DELAY, _MAX_DELAY, clock=_clock(12))
+        assert [sync_delay(0) for _ in range(5)] == [120, 240, 480, 600, 600]
+
+    @staticmethod
+    def should_return_to_min_delay_when_tasks_are_found():
+        sync_delay = AdaptiveSyncDelay(_MIN_DELAY, _MAX_DELAY, clock=_clock(12))
+        sync_delay(0)
+        sync_delay(0)
+        assert sync_delay(3) == _MIN_DELAY
+
+    @staticmethod
+    def should_keep_fixed_delay_without_max_delay():
+        sync_delay = AdaptiveSyncDelay(_MIN_DELAY, _MIN_DELAY, clock=_clock(12))
+        assert [sync_delay(0), sync_delay(1)] == [_MIN_DELAY, _MIN_DELAY]
+
+    @staticmethod
+    @pytest.mark.parametrize(
+        "quiet_hours, hour, is_quiet",
+        [
+            pytest.param((time(1), time(5)), 3, True, id="inside quiet hours"),
+            pytest.param((time(1), time(5)), 5, False, id="at the end of quiet hours"),
+            pytest.param((time(23), time(7)), 0, True, id="inside quiet hours spanning midnight"),
+            pytest.param((time(23), time(7)), 12, False, id="outside quiet hours spanning midnight"),
+        ],
+    )
+    def should_use_max_delay_during_quiet_hours(quiet_hours: tuple[time, time], hour: int, is_quiet: bool):
+        sync_delay = AdaptiveSyncDelay(_MIN_DELAY, _MAX_DELAY, quiet_hours=quiet_hours, clock=_clock(hour))
+        assert sync_delay(1) == (_MAX_DELAY if is_quiet else _MIN_DELAY)
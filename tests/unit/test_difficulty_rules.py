@@ -0,0 +1,170 @@
+import re
+
+import pytest
+
+from config import Settings
+from difficulty_rules import DifficultyRule, DifficultyRules
+from models.habitica import HabiticaDifficulty
+from models.todoist import CompletedTask, TodoistPriority
+
+
+def _completed_task(  # noqa: PLR0913 # pylint: disable=too-many-arguments
+    content: str = "Task",
+    priority: TodoistPriority = TodoistPriority.P4,
+    labels: tuple[str, ...] = (),
+    project_id: str | None = None,
+    has_due: bool = False,
+    is_recurring: bool = False,
+) -> CompletedTask:
+    return CompletedTask(
+        task_id="1",
+        completed_at="2025-01-01T10:00:00.000000Z",
+        content=content,
+        priority=priority,
+        labels=labels,
+        project_id=project_id,
+        has_due=has_due,
+        is_recurring=is_recurring,
+    )
+
+
+def _difficulty(rules: list[DifficultyRule], completed_task: CompletedTask) -> HabiticaDifficulty:
+    return DifficultyRules(rules, Settings().priority_to_difficulty).difficulty(completed_task)
+
+
+class TestDifficultyRulesFromSettings:
+    @staticmethod
+    @pytest.mark.parametrize(
+        "labels",
+        [
+            pytest.param((), id="labels are not defined"),
+            pytest.param(("Urgent",), id="there is no matching label"),
+        ],
+    )
+    def should_use_task_priority_if(labels: tuple[str, ...]):
+        settings = Settings(label_to_difficulty={})
+        difficulty_rules = DifficultyRules.from_settings(
+            settings.difficulty_rules, settings.label_to_difficulty, settings.priority_to_difficulty
+        )
+        completed_task = _completed_task(priority=TodoistPriority.P1, labels=labels)
+
+        assert difficulty_rules.difficulty(completed_task) == HabiticaDifficulty.HARD
+
+    @staticmethod
+    @pytest.mark.parametrize(
+        "labels",
+        [
+            pytest.param(("Urgent",), id="there is a matching label"),
+            pytest.param(("Urgent", "Important"), id="there are multiple labels"),
+        ],
+    )
+    def should_use_label_difficulty_if(labels: tuple[str, ...]):
+        settings = Settings(label_to_difficulty={"urgent": HabiticaDifficulty.MEDIUM})
+        difficulty_rules = DifficultyRules.from_settings(
+            settings.difficulty_rules, settings.label_to_difficulty, settings.priority_to_difficulty
+        )
+        completed_task = _completed_task(priority=TodoistPriority.P4, labels=labels)
+
+        assert difficulty_rules.difficulty(completed_task) == HabiticaDifficulty.MEDIUM
+
+    @staticmethod
+    def should_use_highest_difficulty_of_all_matching_rules():
+        settings = Settings(
+            label_to_difficulty={"urgent": HabiticaDifficulty.HARD, "important": HabiticaDifficulty.MEDIUM},
+            difficulty_rules=[{"difficulty": "easy", "content_regex": "Task"}],
+        )
+        difficulty_rules = DifficultyRules.from_settings(
+            settings.difficulty_rules, settings.label_to_difficulty, settings.priority_to_difficulty
+        )
+        completed_task = _completed_task(labels=("Urgent", "Important"))
+
+        assert difficulty_rules.difficulty(completed_task) == HabiticaDifficulty.HARD
+
+
+class TestDifficultyRules:
+    @staticmethod
+    def should_match_content_regex():
+        rules = [DifficultyRule(difficulty=HabiticaDifficulty.HARD, content_regex=r"\bdeploy\b")]
+
+        assert _difficulty(rules, _completed_task(content="Fix deploy script")) == HabiticaDifficulty.HARD
+        assert _difficulty(rules, _completed_task(content="Fix redeployment")) == HabiticaDifficulty.TRIVIAL
+
+    @staticmethod
+    def should_check_content_regexes_which_cannot_be_combined():
+        rules = [
+            DifficultyRule(difficulty=HabiticaDifficulty.EASY, content_regex=r"(?i)review"),
+            DifficultyRule(difficulty=HabiticaDifficulty.MEDIUM, content_regex=r"(x)y"),
+            DifficultyRule(difficulty=HabiticaDifficulty.HARD, content_regex=r"(\w)\1"),
+            DifficultyRule(difficulty=HabiticaDifficulty.TRIVIAL, content_regex=r"plan"),
+        ]
+
+        assert _difficulty(rules, _completed_task(content="REVIEW plan")) == HabiticaDifficulty.EASY
+        assert _difficulty(rules, _completed_task(content="Call Anna")) == HabiticaDifficulty.HARD
+
+    @staticmethod
+    def should_match_project():
+        rules = [DifficultyRule(difficulty=HabiticaDifficulty.MEDIUM, project_ids=["work"])]
+
+        assert _difficulty(rules, _completed_task(project_id="work")) == HabiticaDifficulty.MEDIUM
+        assert _difficulty(rules, _completed_task(project_id="home")) == HabiticaDifficulty.TRIVIAL
+
+    @staticmethod
+    def should_match_due_and_recurring_flags():
+        rules = [DifficultyRule(difficulty=HabiticaDifficulty.EASY, has_due=True, is_recurring=False)]
+
+        assert _difficulty(rules, _completed_task(has_due=True)) == HabiticaDifficulty.EASY
+        assert _difficulty(rules, _completed_task(has_due=True, is_recurring=True)) == HabiticaDifficulty.TRIVIAL
+
+    @staticmethod
+    def should_match_only_if_all_conditions_match():
+        rules = [
+            DifficultyRule(
+                difficulty=HabiticaDifficulty.HARD, labels=["Urgent"], project_ids=["work"], content_regex="report"
+            )
+        ]
+
+        matching = _completed_task(content="Send report", labels=("urgent",), project_id="work")
+        assert _difficulty(rules, matching) == HabiticaDifficulty.HARD
+        for completed_task in (
+            _completed_task(content="Send report", labels=("urgent",), project_id="home"),
+            _completed_task(content="Send report", project_id="work"),
+            _completed_task(content="Send invoice", labels=("urgent",), project_id="work"),
+        ):
+            assert _difficulty(rules, completed_task) == HabiticaDifficulty.TRIVIAL
+
+    @staticmethod
+    def should_use_highest_difficulty_of_all_matching_rules():
+        rules = [
+            DifficultyRule(difficulty=HabiticaDifficulty.EASY, priorities=[TodoistPriority.P4]),
+            DifficultyRule(difficulty=HabiticaDifficulty.HARD, project_ids=["work"], priorities=[TodoistPriority.P4]),
+            DifficultyRule(difficulty=HabiticaDifficulty.MEDIUM, content_regex="Task"),
+        ]
+
+        assert _difficulty(rules, _completed_task(project_id="work")) == HabiticaDifficulty.HARD
+        assert _difficulty(rules, _completed_task(project_id="home")) == HabiticaDifficulty.MEDIUM
+
+    @staticmethod
+    def should_classify_tasks_in_order():
+        difficulty_rules = DifficultyRules(
+            [DifficultyRule(difficulty=HabiticaDifficulty.HARD, labels=["urgent"])], Settings().priority_to_difficulty
+        )
+
+        difficulties = difficulty_rules.classify([_completed_task(labels=("urgent",)), _completed_task()])
+
+        assert difficulties == [HabiticaDifficulty.HARD, HabiticaDifficulty.TRIVIAL]
+
+
+class TestDifficultyRule:
+    @staticmethod
+    def should_parse_difficulty_and_priority_names():
+        rule = DifficultyRule.model_validate({"difficulty": "hard", "priorities": ["p1", "P2"], "labels": ["Urgent"]})
+
+        assert rule.difficulty == HabiticaDifficulty.HARD
+        assert rule.priorities == {TodoistPriority.P1, TodoistPriority.P2}
+        assert rule.labels == {"urgent"}
+
+    @staticmethod
+    def should_compile_content_regex():
+        rule = DifficultyRule.model_validate({"difficulty": "easy", "content_regex": "^Call"})
+
+        assert rule.content_regex == re.compile("^Call")
@@ -1,43 +1,614 @@
+import json
+import math
+import queue
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from collections.abc import Iterator
+from http import HTTPStatus
+from types import SimpleNamespace
+from typing import cast
+from unittest.mock import MagicMock
+
 import pytest
+from requests import HTTPError, Response
 
-from config import Settings
-from main import TasksSync
+import main
+from config import get_settings
+from habitica_api import HabiticaAPI, HabiticaAPIHeaders
+from main import (
+    AccountsSync,
+    ExitCode,
+    FSMState,
+    StateDeadLetter,
+    StateHabiticaAwaitingDeletion,
+    StateHabiticaCreated,
+    StateHabiticaHabit,
+    StateHabiticaNew,
+    TasksSync,
+)
+from models.generic_task import GenericTask
 from models.habitica import HabiticaDifficulty
-from models.todoist import TodoistPriority
+from models.todoist import (
+    CompletedSyncCursor,
+    CompletedTask,
+    IncrementalSyncCursor,
+    TodoistItemSnapshot,
+    TodoistPriority,
+)
+from tasks_cache import TasksCache
+from todoist_api import CompletedTasksPage, TodoistAPI
 
 
-class TestGetTaskDifficulty:
-    @staticmethod
-    @pytest.mark.parametrize(
-        "labels",
-        [
-            pytest.param([], id="labels are not defined"),
-            pytest.param(["Urgent"], id="there is no matching label"),
-        ],
+def _habitica(tasks_sync: TasksSync) -> MagicMock:
+    """Habitica API of a sync, mocked by the fixtures."""
+    return cast(MagicMock, tasks_sync.habitica)
+
+
+def _todoist(tasks_sync: TasksSync) -> MagicMock:
+    """Todoist API of a sync, mocked by the fixtures."""
+    return cast(MagicMock, tasks_sync._todoist)
+
+
+def _tasks_in_state(tasks_sync: TasksSync, state_cls: type[FSMState]) -> list[GenericTask]:
+    """All tasks in given state, oldest first, claimed without keeping a lease on them."""
+    return tasks_sync._task_cache.claim_tasks(
+        state_cls.name(), tasks_sync._worker_id, lease_seconds=0, due_at=math.inf, limit=sys.maxsize
     )
-    def should_use_task_priority_if(labels: list[str]):
-        settings = Settings(label_to_difficulty={})
-        assert TasksSync._get_task_difficulty(settings, labels, TodoistPriority.P1) == HabiticaDifficulty.HARD
 
+
+@pytest.fixture
+def tasks_sync(database_file) -> TasksSync:  # pylint: disable=unused-argument
+    tasks_sync = TasksSync()
+    tasks_sync.habitica = MagicMock(spec=HabiticaAPI)
+    return tasks_sync
+
+
+class TestBatchTaskCreation:
     @staticmethod
-    @pytest.mark.parametrize(
-        "labels",
-        [
-            pytest.param(["Urgent"], id="there is a matching label"),
-            pytest.param(["Urgent", "Important"], id="there are multiple labels"),
-        ],
-    )
-    def should_use_label_priority_if(labels: list[str]):
-        settings = Settings(label_to_difficulty={"urgent": HabiticaDifficulty.HARD})
-        assert TasksSync._get_task_difficulty(settings, labels, TodoistPriority.P1) == HabiticaDifficulty.HARD
+    def should_create_all_new_tasks_in_one_request(tasks_sync: TasksSync):
+        generic_tasks = [
+            GenericTask(content=f"Task {i}", difficulty=HabiticaDifficulty.EASY, state=StateHabiticaNew.name())
+            for i in range(50)
+        ]
+        tasks_sync._task_cache.save_tasks(generic_tasks)
+        _habitica(tasks_sync).create_tasks.side_effect = lambda tasks: [{"id": f"id-{text}"} for text, _ in tasks]
+
+        StateHabiticaNew.next_states(tasks_sync, _tasks_in_state(tasks_sync, StateHabiticaNew))
+
+        _habitica(tasks_sync).create_tasks.assert_called_once()
+        created = _tasks_in_state(tasks_sync, StateHabiticaCreated)
+        assert {task.habitica_task_id for task in created} == {f"id-Task {i}" for i in range(50)}
+        assert not _tasks_in_state(tasks_sync, StateHabiticaNew)
 
     @staticmethod
-    def should_use_highest_label_priority():
-        settings = Settings(
-            label_to_difficulty={
-                "urgent": HabiticaDifficulty.HARD,
-                "important": HabiticaDifficulty.MEDIUM,
-            }
+    def should_retry_tasks_if_habitica_created_different_number_of_tasks(tasks_sync: TasksSync, monkeypatch):
+        tasks_sync._task_cache.save_tasks(
+            [
+                GenericTask(content=f"Task {i}", difficulty=HabiticaDifficulty.EASY, state=StateHabiticaNew.name())
+                for i in range(2)
+            ]
+        )
+        tasks_sync.habitica = HabiticaAPI(HabiticaAPIHeaders(user_id="user", api_key="key"))
+        monkeypatch.setattr(tasks_sync.habitica, "_request", lambda *_, **__: [{"id": "only-one"}])
+
+        tasks_sync._next_tasks_state()
+
+        new_tasks = _tasks_in_state(tasks_sync, StateHabiticaNew)
+        assert [(task.attempts, task.habitica_task_id) for task in new_tasks] == [(1, None), (1, None)]
+
+
+def _save_awaiting_deletion(tasks_sync: TasksSync) -> list[GenericTask]:
+    generic_tasks = [
+        GenericTask(
+            content=f"Task {i}",
+            difficulty=HabiticaDifficulty.EASY,
+            state=StateHabiticaAwaitingDeletion.name(),
+            habitica_task_id=f"id-{i}",
         )
-        labels = ["Urgent", "Important"]
-        assert TasksSync._get_task_difficulty(settings, labels, TodoistPriority.P1) == HabiticaDifficulty.HARD
+        for i in range(3)
+    ]
+    tasks_sync._task_cache.save_tasks(generic_tasks)
+    return generic_tasks
+
+
+class TestBulkCleanup:
+    @staticmethod
+    def should_clear_completed_todos_once(tasks_sync: TasksSync):
+        generic_tasks = _save_awaiting_deletion(tasks_sync)
+        _habitica(tasks_sync).get_completed_todos.return_value = [{"id": "id-0"}, {"id": "id-1"}]
+
+        StateHabiticaAwaitingDeletion.next_states(tasks_sync, generic_tasks)
+
+        _habitica(tasks_sync).clear_completed_todos.assert_called_once()
+        _habitica(tasks_sync).delete_task.assert_not_called()
+        assert not _tasks_in_state(tasks_sync, StateHabiticaAwaitingDeletion)
+
+    @staticmethod
+    def should_not_clear_todos_not_created_by_sync(tasks_sync: TasksSync):
+        generic_tasks = _save_awaiting_deletion(tasks_sync)
+        _habitica(tasks_sync).get_completed_todos.return_value = [{"id": "id-0"}, {"id": "user-own-todo"}]
+
+        StateHabiticaAwaitingDeletion.next_states(tasks_sync, generic_tasks)
+
+        _habitica(tasks_sync).clear_completed_todos.assert_not_called()
+        assert _habitica(tasks_sync).delete_task.call_count == len(generic_tasks)
+        assert not _tasks_in_state(tasks_sync, StateHabiticaAwaitingDeletion)
+
+
+def _score_habit(tasks_sync: TasksSync, difficulty: HabiticaDifficulty) -> None:
+    generic_task = GenericTask(content="Task", difficulty=difficulty, state=StateHabiticaHabit.name())
+    tasks_sync._task_cache.save_task(generic_task)
+    StateHabiticaHabit(context=tasks_sync, generic_task=generic_task).next_state()
+
+
+class TestHabitSyncMode:
+    @staticmethod
+    def should_create_all_habits_once_and_only_score_them(tasks_sync: TasksSync):
+        _habitica(tasks_sync).create_tasks.side_effect = lambda tasks, task_type: [
+            {"id": f"habit-{difficulty.name}"} for _, difficulty in tasks
+        ]
+
+        _score_habit(tasks_sync, HabiticaDifficulty.HARD)
+        _score_habit(tasks_sync, HabiticaDifficulty.EASY)
+
+        _habitica(tasks_sync).create_tasks.assert_called_once()
+        assert [call.args for call in _habitica(tasks_sync).score_task.call_args_list] == [
+            ("habit-HARD",),
+            ("habit-EASY",),
+        ]
+        assert not _tasks_in_state(tasks_sync, StateHabiticaHabit)
+
+    @staticmethod
+    def should_recreate_deleted_habit(tasks_sync: TasksSync):
+        tasks_sync._task_cache.set_habitica_habit_id(HabiticaDifficulty.HARD, "deleted-habit")
+        response = Response()
+        response.status_code = HTTPStatus.NOT_FOUND
+        _habitica(tasks_sync).score_task.side_effect = HTTPError(response=response)
+
+        _score_habit(tasks_sync, HabiticaDifficulty.HARD)
+
+        assert tasks_sync._task_cache.get_habitica_habit_id(HabiticaDifficulty.HARD) is None
+        assert _tasks_in_state(tasks_sync, StateHabiticaHabit)
+
+
+def _save_created_tasks(tasks_sync: TasksSync) -> list[GenericTask]:
+    generic_tasks = [
+        GenericTask(
+            content=content,
+            difficulty=HabiticaDifficulty.EASY,
+            state=StateHabiticaCreated.name(),
+            habitica_task_id=content,
+        )
+        for content in ["failing", "healthy"]
+    ]
+    tasks_sync._task_cache.save_tasks(generic_tasks)
+    return generic_tasks
+
+
+def _fail_score_on(task_id: str):
+    def score_task(habitica_task_id: str) -> None:
+        if habitica_task_id == task_id:
+            raise ConnectionError("Connection refused")
+
+    return score_task
+
+
+class TestRetryScheduling:
+    @staticmethod
+    def should_keep_processing_healthy_tasks(tasks_sync: TasksSync):
+        _save_created_tasks(tasks_sync)
+        _habitica(tasks_sync).score_task.side_effect = _fail_score_on("failing")
+
+        tasks_sync._next_tasks_state()
+
+        assert [task.content for task in _tasks_in_state(tasks_sync, StateHabiticaCreated)] == ["failing"]
+        _habitica(tasks_sync).delete_task.assert_called_once_with("healthy")
+
+    @staticmethod
+    def should_skip_tasks_not_due_yet(tasks_sync: TasksSync):
+        _save_created_tasks(tasks_sync)
+        _habitica(tasks_sync).score_task.side_effect = _fail_score_on("failing")
+        tasks_sync._next_tasks_state()
+        _habitica(tasks_sync).score_task.reset_mock()
+
+        tasks_sync._next_tasks_state()
+
+        _habitica(tasks_sync).score_task.assert_not_called()
+        failing_task = _tasks_in_state(tasks_sync, StateHabiticaCreated)[0]
+        assert failing_task.attempts == 1
+        assert failing_task.next_attempt_at > time.time()
+
+    @staticmethod
+    def should_give_up_after_max_attempts(tasks_sync: TasksSync):
+        failing_task = _save_created_tasks(tasks_sync)[0]
+        failing_task.attempts = tasks_sync._max_task_attempts - 1
+
+        tasks_sync.retry_later([failing_task])
+
+        assert _tasks_in_state(tasks_sync, StateDeadLetter)[0].id == failing_task.id
+
+
+class TestQueueCompletedTasks:
+    @staticmethod
+    def should_not_queue_the_same_completion_twice(tasks_sync: TasksSync):
+        completed_task = CompletedTask(
+            task_id="1", completed_at="2025-01-01T10:00:00.000000Z", content="Task", priority=TodoistPriority.P4
+        )
+
+        tasks_sync._on_webhook_completed(completed_task)
+        tasks_sync._queue_completed_tasks([completed_task])
+
+        assert len(_tasks_in_state(tasks_sync, StateHabiticaNew)) == 1
+        assert tasks_sync._wake_up.is_set()
+
+    @staticmethod
+    def should_queue_recurring_completion_once_when_workers_sync_the_same_changes(tasks_sync: TasksSync):
+        tasks_sync._task_cache.save_new_tasks(
+            {},
+            IncrementalSyncCursor(
+                sync_token="token", items={"1": TodoistItemSnapshot(checked=False, due_date="2025-01-01")}
+            ),
+        )
+        due = {"date": "2025-01-02", "string": "every day", "lang": "en", "is_recurring": True}
+        item = {"id": "1", "content": "Task", "checked": False, "is_deleted": False, "priority": 1, "due": due}
+        response = MagicMock(status_code=200)
+        response.content = json.dumps({"sync_token": "next-token", "full_sync": False, "items": [item]}).encode()
+        workers = [tasks_sync, TasksSync()]
+
+        # Both workers fetch the changes since the stored token before either stores them
+        pages: list[CompletedTasksPage] = []
+        for worker in workers:
+            worker._todoist._session = MagicMock(post=MagicMock(return_value=response))
+            pages += worker._todoist.sync_incremental("token", worker._task_cache.get_todoist_item_snapshots)
+        queued = [
+            worker._queue_completed_tasks(page.items, page.cursor) for worker, page in zip(workers, pages, strict=True)
+        ]
+
+        assert [len(page.items) for page in pages] == [1, 1]
+        assert queued == [1, 0]
+        workers[1].close()
+
+    @staticmethod
+    def should_commit_each_page_before_fetching_the_next(tasks_sync: TasksSync, database_file):
+        completed_task = CompletedTask(
+            task_id="1", completed_at="2025-01-01T10:00:00.000000Z", content="Task", priority=TodoistPriority.P4
+        )
+        cursor = CompletedSyncCursor(since=None, until=completed_task.completed_at)
+        committed: list[CompletedSyncCursor | None] = []
+
+        def sync(_cursor: CompletedSyncCursor) -> Iterator[CompletedTasksPage]:
+            yield CompletedTasksPage(items=[completed_task], cursor=cursor)
+            other_process = TasksCache(database_file)
+            committed.append(other_process.completed_sync_cursor)
+            other_process.close()
+            raise ConnectionError("Connection reset")
+
+        tasks_sync._todoist = MagicMock(spec=TodoistAPI, sync=sync)
+
+        assert tasks_sync._queue_todoist_completed_tasks() is None
+        assert committed == [cursor]
+
+
+_CONCURRENCY = 4
+
+
+@pytest.fixture
+def concurrent_tasks_sync(database_file, monkeypatch) -> TasksSync:  # pylint: disable=unused-argument
+    monkeypatch.setenv("SYNC_CONCURRENCY", str(_CONCURRENCY))
+    tasks_sync = TasksSync()
+    tasks_sync.habitica = MagicMock(spec=HabiticaAPI)
+    return tasks_sync
+
+
+class TestConcurrentSync:
+    @staticmethod
+    def should_process_tasks_in_the_same_state_concurrently(concurrent_tasks_sync: TasksSync):
+        generic_tasks = [
+            GenericTask(content=f"Task {i}", difficulty=HabiticaDifficulty.EASY, state=StateHabiticaNew.name())
+            for i in range(_CONCURRENCY)
+        ]
+        concurrent_tasks_sync._task_cache.save_tasks(generic_tasks)
+        _habitica(concurrent_tasks_sync).create_tasks.side_effect = lambda tasks: [{"id": text} for text, _ in tasks]
+        all_scoring = threading.Barrier(_CONCURRENCY, timeout=5)
+        calls: list[tuple[str, str]] = []
+
+        def score_task(task_id: str) -> None:
+            calls.append(("score", task_id))
+            all_scoring.wait()  # Fails unless all tasks are scored at the same time
+
+        _habitica(concurrent_tasks_sync).score_task.side_effect = score_task
+        _habitica(concurrent_tasks_sync).delete_task.side_effect = lambda task_id: calls.append(("delete", task_id))
+
+        concurrent_tasks_sync._next_tasks_state()
+
+        assert concurrent_tasks_sync._task_cache.tasks_stats() == {}
+        for generic_task in generic_tasks:
+            assert [_ for _ in calls if _[1] == generic_task.content] == [
+                ("score", generic_task.content),
+                ("delete", generic_task.content),
+            ]
+
+    @staticmethod
+    def should_raise_first_error_once_all_calls_finished(concurrent_tasks_sync: TasksSync):
+        finished: list[int] = []
+
+        def call(item: int) -> None:
+            if item == 0:
+                raise ValueError("Failed")
+            time.sleep(0.01)
+            finished.append(item)
+
+        with pytest.raises(ValueError, match="Failed"):
+            concurrent_tasks_sync.run_concurrently(call, list(range(_CONCURRENCY)))
+        assert sorted(finished) == list(range(1, _CONCURRENCY))
+
+
+@pytest.fixture
+def once_tasks_sync(tasks_sync: TasksSync) -> TasksSync:
+    tasks_sync._todoist = MagicMock(spec=TodoistAPI)
+    _todoist(tasks_sync).sync.return_value = iter([])
+    return tasks_sync
+
+
+class TestRunOnce:
+    @staticmethod
+    def should_succeed_when_all_tasks_are_synced(once_tasks_sync: TasksSync):
+        _save_created_tasks(once_tasks_sync)
+
+        assert once_tasks_sync.run_once() is ExitCode.SUCCESS
+        assert _habitica(once_tasks_sync).delete_task.call_count == 2  # noqa: PLR2004
+
+    @staticmethod
+    def should_close_api_sessions(once_tasks_sync: TasksSync):
+        once_tasks_sync.run_once()
+
+        _habitica(once_tasks_sync).close.assert_called_once()
+        _todoist(once_tasks_sync).close.assert_called_once()
+
+    @staticmethod
+    def should_fail_when_todoist_sync_fails(once_tasks_sync: TasksSync):
+        _todoist(once_tasks_sync).sync.side_effect = ConnectionError("Connection refused")
+
+        assert once_tasks_sync.run_once() is ExitCode.TODOIST_SYNC_FAILED
+
+    @staticmethod
+    def should_report_tasks_waiting_for_retry(once_tasks_sync: TasksSync):
+        _save_created_tasks(once_tasks_sync)
+        _habitica(once_tasks_sync).score_task.side_effect = _fail_score_on("failing")
+
+        assert once_tasks_sync.run_once() is ExitCode.TASKS_PENDING
+        _habitica(once_tasks_sync).delete_task.assert_called_once_with("healthy")
+
+    @staticmethod
+    def should_stop_processing_tasks_after_time_budget(once_tasks_sync: TasksSync):
+        _save_created_tasks(once_tasks_sync)
+
+        assert once_tasks_sync.run_once(time_budget=0) is ExitCode.TASKS_PENDING
+        _habitica(once_tasks_sync).score_task.assert_not_called()
+
+
+_MAX_IMPORT_SECONDS = 2
+_LAZY_MODULES = ["dateutil", "http.server", "todoist_webhook", "metrics_server", "traffic"]
+_MEASURE_IMPORT = f"""
+import json, sys, time
+start = time.perf_counter()
+import main
+print(json.dumps({{
+    "seconds": time.perf_counter() - start,
+    "lazy_modules_imported": [_ for _ in {_LAZY_MODULES!r} if _ in sys.modules],
+}}))
+"""
+
+
+class TestStartup:
+    @staticmethod
+    def should_import_quickly(project_root):
+        result = json.loads(
+            subprocess.run(
+                [sys.executable, "-c", _MEASURE_IMPORT],
+                cwd=project_root / "src",
+                capture_output=True,
+                check=True,
+                text=True,
+            ).stdout
+        )
+
+        assert result["lazy_modules_imported"] == []
+        assert result["seconds"] < _MAX_IMPORT_SECONDS
+
+
+_WORKERS = 3
+
+
+class TestMultipleWorkers:
+    @staticmethod
+    def should_sync_each_task_once(tasks_sync: TasksSync):
+        tasks_sync._task_cache.save_tasks(
+            [
+                GenericTask(content=f"Task {i}", difficulty=HabiticaDifficulty.EASY, state=StateHabiticaNew.name())
+                for i in range(10)
+            ]
+        )
+        created: list[str] = []
+
+        def create_tasks(tasks: list[tuple[str, HabiticaDifficulty]]) -> list[dict[str, str]]:
+            time.sleep(0.01)  # Let other workers claim tasks in the meantime
+            created.extend(text for text, _ in tasks)
+            return [{"id": text} for text, _ in tasks]
+
+        workers = [tasks_sync] + [TasksSync() for _ in range(_WORKERS - 1)]  # Each with its own connection
+        for worker in workers:
+            worker.habitica = MagicMock(spec=HabiticaAPI)
+            _habitica(worker).create_tasks.side_effect = create_tasks
+            worker._max_claimed_tasks = 2
+
+        threads = [threading.Thread(target=worker._next_tasks_state) for worker in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert sorted(created) == sorted(f"Task {i}" for i in range(10))
+        assert all(_habitica(worker).create_tasks.called for worker in workers)
+        assert tasks_sync._task_cache.tasks_stats() == {}
+
+    @staticmethod
+    def should_keep_renewing_leases_after_database_error(tasks_sync: TasksSync, monkeypatch):
+        monkeypatch.setattr(main, "_LEASE_RENEWAL_SECONDS", 0.01)
+        renewals: list[str] = []
+
+        def renew_leases(owner: str, _lease_seconds: float) -> None:
+            renewals.append(owner)
+            if len(renewals) == 1:
+                raise sqlite3.OperationalError("database is locked")
+
+        monkeypatch.setattr(tasks_sync._task_cache, "renew_leases", renew_leases)
+
+        with tasks_sync._leased():
+            time.sleep(0.1)
+
+        assert len(renewals) > 1
+
+    @staticmethod
+    def should_fail_todoist_sync_while_database_is_locked(once_tasks_sync: TasksSync, monkeypatch):
+        _save_created_tasks(once_tasks_sync)
+        monkeypatch.setattr(
+            once_tasks_sync._task_cache,
+            "forget_completions",
+            MagicMock(side_effect=sqlite3.OperationalError("database is locked")),
+        )
+
+        assert once_tasks_sync.run_once() is ExitCode.TODOIST_SYNC_FAILED
+        assert _habitica(once_tasks_sync).delete_task.call_count == 2  # noqa: PLR2004
+
+
+@pytest.fixture
+def accounts_sync(database_file, monkeypatch) -> AccountsSync:  # pylint: disable=unused-argument
+    monkeypatch.setenv(
+        "ACCOUNTS", json.dumps([{"todoist_api_key": "token", "habitica_user_id": "second", "habitica_api_key": "key"}])
+    )
+    get_settings.cache_clear()
+    accounts_sync = AccountsSync(get_settings().all_accounts)
+    for tasks_sync in accounts_sync._tasks_syncs:
+        tasks_sync.habitica = MagicMock(spec=HabiticaAPI)
+        tasks_sync._todoist = MagicMock(spec=TodoistAPI)
+        _todoist(tasks_sync).sync.return_value = iter([])
+    return accounts_sync
+
+
+class TestAccountsSync:
+    @staticmethod
+    def should_sync_each_account_from_its_own_cache(accounts_sync: AccountsSync, database_file):
+        main_account, second_account = accounts_sync._tasks_syncs
+        _save_created_tasks(second_account)
+
+        assert accounts_sync.run_once() is ExitCode.SUCCESS
+
+        _habitica(main_account).score_task.assert_not_called()
+        assert _habitica(second_account).score_task.call_count == 2  # noqa: PLR2004
+        assert database_file.with_name("sync_cache_second.sqlite").exists()
+
+    @staticmethod
+    def should_report_failed_todoist_sync_over_pending_tasks(accounts_sync: AccountsSync):
+        main_account, second_account = accounts_sync._tasks_syncs
+        _todoist(main_account).sync.side_effect = ConnectionError("Connection refused")
+        _save_created_tasks(second_account)
+        _habitica(second_account).score_task.side_effect = _fail_score_on("failing")
+
+        assert accounts_sync.run_once() is ExitCode.TODOIST_SYNC_FAILED
+
+    @staticmethod
+    def should_end_turn_when_time_slice_runs_out(accounts_sync: AccountsSync):
+        tasks_sync = accounts_sync._tasks_syncs[0]
+        _save_created_tasks(tasks_sync)
+
+        assert tasks_sync.sync_cycle(time_slice=0) == 0
+        _habitica(tasks_sync).score_task.assert_not_called()
+        accounts_sync.close()
+
+    @staticmethod
+    def should_wait_for_next_todoist_sync_once_no_task_is_due(accounts_sync: AccountsSync):
+        tasks_sync = accounts_sync._tasks_syncs[0]
+        _save_created_tasks(tasks_sync)
+
+        delay = tasks_sync.sync_cycle(time_slice=60)
+
+        assert 0 < delay <= get_settings().sync_delay_seconds
+        assert tasks_sync.tasks_stats() == {}
+        _todoist(tasks_sync).sync.return_value = iter([])
+        tasks_sync.sync_cycle(time_slice=60)
+        _todoist(tasks_sync).sync.assert_called_once()
+        accounts_sync.close()
+
+    @staticmethod
+    def should_take_turn_that_became_due_while_checking(accounts_sync: AccountsSync, monkeypatch):
+        class ClockStoppedError(Exception):
+            pass
+
+        clock = iter(range(100))  # Each reading of the clock is one second later
+
+        def monotonic() -> float:
+            if (now := next(clock)) > 20:  # noqa: PLR2004
+                raise ClockStoppedError
+            return now
+
+        def turn(index: int, finished: queue.SimpleQueue[tuple[int, float]]) -> None:
+            finished.put((index, 1.5))  # Due between checking the next turn and waiting for it
+
+        monkeypatch.setattr(main, "time", SimpleNamespace(monotonic=monotonic))
+        monkeypatch.setattr(accounts_sync, "_turn", turn)
+
+        with pytest.raises(ClockStoppedError):
+            accounts_sync._schedule_turns()
+        accounts_sync.close()
+
+
+def _recorded_exchange(service: str, method: str, path: str, data: object) -> dict[str, object]:
+    return {
+        "service": service,
+        "method": method,
+        "path": path,
+        "query": "",
+        "request_bytes": 0,
+        "status": 200,
+        "headers": {"content-type": "application/json"},
+        "body": json.dumps(data),
+        "elapsed": 0.1,
+        "recorded_at": 0,
+    }
+
+
+_RECORDED_COMPLETION = {
+    "task_id": "todoist-id",
+    "user_id": "1",
+    "completed_at": "2025-01-01T10:00:00.000000Z",
+    "item_object": {"id": "todoist-id", "checked": True, "content": "Task", "is_deleted": False, "priority": 1},
+}
+
+
+class TestReplay:
+    @staticmethod
+    def should_sync_recorded_tasks_without_network(tmp_path, database_file):
+        exchanges = [
+            _recorded_exchange("todoist", "GET", "/sync/v9/completed/get_all", {"items": [_RECORDED_COMPLETION]}),
+            _recorded_exchange("habitica", "POST", "/api/v3/tasks/user", {"data": [{"id": "habitica-id"}]}),
+            _recorded_exchange("habitica", "POST", "/api/v3/tasks/habitica-id/score/up", {"data": {}}),
+            _recorded_exchange("habitica", "DELETE", "/api/v3/tasks/habitica-id", {"data": {}}),
+        ]
+        traffic_file = tmp_path / "traffic.jsonl"
+        traffic_file.write_text("".join(json.dumps(exchange) + "\n" for exchange in exchanges))
+
+        assert TasksSync.replay(traffic_file, speedup=math.inf) is ExitCode.SUCCESS
+        assert not database_file.exists()
+
+    @staticmethod
+    @pytest.mark.usefixtures("database_file")
+    def should_report_tasks_without_recorded_responses(tmp_path):
+        exchange = _recorded_exchange("todoist", "GET", "/sync/v9/completed/get_all", {"items": [_RECORDED_COMPLETION]})
+        traffic_file = tmp_path / "traffic.jsonl"
+        traffic_file.write_text(json.dumps(exchange) + "\n")
+
+        assert TasksSync.replay(traffic_file, speedup=math.inf) is ExitCode.TASKS_PENDING
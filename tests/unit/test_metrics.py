@@ -0,0 +1,72 @@
+from metrics import Counter, Histogram, Registry, render_gauge
+
+
+class TestMetrics:
+    @staticmethod
+    def should_not_record_anything_when_disabled():
+        registry = Registry()
+        counter = Counter("calls_total", "Calls.", registry=registry)
+        histogram = Histogram("call_duration_seconds", "Duration.", registry=registry)
+
+        counter.inc()
+        histogram.observe(1)
+        histogram.timed()(lambda: None)()
+
+        assert registry.render().splitlines() == [
+            "# HELP calls_total Calls.",
+            "# TYPE calls_total counter",
+            "# HELP call_duration_seconds Duration.",
+            "# TYPE call_duration_seconds histogram",
+        ]
+
+    @staticmethod
+    def should_render_counter_with_labels():
+        registry = Registry()
+        registry.enable()
+        counter = Counter("transitions_total", "Transitions.", ("from_state", "to_state"), registry=registry)
+
+        counter.inc(from_state="New", to_state="Created")
+        counter.inc(from_state="New", to_state="Created")
+        counter.inc(2.5, from_state="Created", to_state='Say "hi"')
+
+        assert registry.render().splitlines()[2:] == [
+            'transitions_total{from_state="New",to_state="Created"} 2',
+            'transitions_total{from_state="Created",to_state="Say \\"hi\\""} 2.5',
+        ]
+
+    @staticmethod
+    def should_render_cumulative_histogram_buckets():
+        registry = Registry()
+        registry.enable()
+        histogram = Histogram("duration_seconds", "Duration.", ("method",), buckets=(0.1, 1), registry=registry)
+
+        for value in (0.05, 0.5, 0.5, 5):
+            histogram.observe(value, method="sync")
+
+        assert registry.render().splitlines()[2:] == [
+            'duration_seconds_bucket{method="sync",le="0.1"} 1',
+            'duration_seconds_bucket{method="sync",le="1"} 3',
+            'duration_seconds_bucket{method="sync",le="+Inf"} 4',
+            'duration_seconds_sum{method="sync"} 6.05',
+            'duration_seconds_count{method="sync"} 4',
+        ]
+
+    @staticmethod
+    def should_time_calls_when_enabled():
+        registry = Registry()
+        registry.enable()
+        histogram = Histogram("duration_seconds", "Duration.", registry=registry)
+
+        assert histogram.timed()(lambda value: value)(42) == 42  # noqa: PLR2004
+        assert "duration_seconds_count 1" in registry.render().splitlines()
+
+    @staticmethod
+    def should_include_collectors():
+        registry = Registry()
+        registry.register_collector(lambda: render_gauge("queue", "Queue depth.", [({"state": "New"}, 3)]))
+
+        assert registry.render().splitlines() == [
+            "# HELP queue Queue depth.",
+            "# TYPE queue gauge",
+            'queue{state="New"} 3',
+        ]
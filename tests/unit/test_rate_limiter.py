@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from rate_limiter import MemoryTokenBucketStore, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps: list[float] = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+class TestTokenBucket:
+    @staticmethod
+    def should_not_sleep_while_tokens_are_available(clock):
+        bucket = TokenBucket(3, 60, clock=clock, sleep=clock.sleep)
+        for _ in range(3):
+            bucket()
+        assert not clock.sleeps
+
+    @staticmethod
+    def should_sleep_until_window_resets_when_empty(clock):
+        bucket = TokenBucket(2, 60, clock=clock, sleep=clock.sleep)
+        bucket()
+        clock.now = 10
+        bucket()
+        bucket()
+        assert clock.sleeps == [50]
+
+    @staticmethod
+    def should_use_remaining_header(clock):
+        bucket = TokenBucket(30, 60, clock=clock, sleep=clock.sleep)
+        bucket()
+        bucket.update({"x-ratelimit-remaining": "0", "x-ratelimit-reset": "5"})
+        bucket()
+        assert clock.sleeps == [5]
+
+    @staticmethod
+    def should_parse_habitica_reset_date(clock):
+        bucket = TokenBucket(30, 60, clock=clock, sleep=clock.sleep)
+        reset_at = datetime.now(timezone.utc) + timedelta(seconds=20)
+        bucket.update(
+            {
+                "x-ratelimit-remaining": "0",
+                "x-ratelimit-reset": reset_at.strftime("%a %b %d %Y %H:%M:%S GMT+0000 (Coordinated Universal Time)"),
+            }
+        )
+        bucket()
+        assert clock.sleeps == [pytest.approx(20, abs=1.5)]
+
+    @staticmethod
+    def should_honor_retry_after_on_too_many_requests(clock):
+        bucket = TokenBucket(30, 60, clock=clock, sleep=clock.sleep)
+        bucket()
+        bucket.update({"retry-after": "7"}, too_many_requests=True)
+        bucket()
+        assert clock.sleeps == [7]
+
+    @staticmethod
+    def should_refill_after_reset(clock):
+        bucket = TokenBucket(1, 60, clock=clock, sleep=clock.sleep)
+        bucket()
+        clock.now = 61
+        bucket()
+        assert not clock.sleeps
+
+    @staticmethod
+    def should_reserve_tokens_of_following_windows_without_waiting_for_them(clock):
+        sleeps: list[float] = []
+        bucket = TokenBucket(1, 60, clock=clock, sleep=sleeps.append)
+        for _ in range(3):
+            bucket()
+        assert sleeps == [60, 120]
+
+    @staticmethod
+    def should_share_state_of_buckets_with_same_store(clock):
+        store = MemoryTokenBucketStore()
+        first, second = (TokenBucket(2, 60, clock=clock, sleep=clock.sleep, store=store) for _ in range(2))
+        first()
+        second()
+        first()
+        assert clock.sleeps == [60]
@@ -0,0 +1,234 @@
+import dataclasses
+import json
+import sqlite3
+import subprocess
+import sys
+import time
+
+import pytest
+
+from config import get_settings
+from models.generic_task import GenericTask
+from models.habitica import HabiticaDifficulty
+from models.todoist import IncrementalSyncCursor, TodoistItemSnapshot
+from rate_limiter import TokenBucket
+from tasks_cache import TasksCache
+
+_WORKERS = 3
+
+
+class TestTasksCacheMigrations:
+    @staticmethod
+    def should_migrate_tasks_stored_as_json(database_file):
+        generic_task = GenericTask(
+            content="Task", difficulty=HabiticaDifficulty.HARD, state="HabiticaCreated", habitica_task_id="habitica-id"
+        )
+        with sqlite3.connect(database_file) as conn:
+            conn.execute("CREATE TABLE tasks_cache (id TEXT PRIMARY KEY NOT NULL, task_data TEXT)")
+            conn.execute(
+                "INSERT INTO tasks_cache (id, task_data) VALUES (?, ?)",
+                (
+                    str(generic_task.id),
+                    json.dumps(
+                        {
+                            "content": generic_task.content,
+                            "difficulty": generic_task.difficulty.value,
+                            "state": generic_task.state,
+                            "habitica_task_id": generic_task.habitica_task_id,
+                            "id": str(generic_task.id),
+                        }
+                    ),
+                ),
+            )
+
+        tasks_cache = TasksCache()
+
+        migrated_task = tasks_cache.claim_tasks("HabiticaCreated", "worker", 0, due_at=time.time(), limit=1)[0]
+        assert dataclasses.replace(migrated_task, created_at=generic_task.created_at) == generic_task
+        tasks_cache.close()
+
+    @staticmethod
+    @pytest.mark.usefixtures("database_file")
+    def should_not_migrate_twice():
+        TasksCache().close()
+        TasksCache().close()
+
+    @staticmethod
+    @pytest.mark.parametrize("legacy_cache", [False, True], ids=["new cache", "cache stored as JSON"])
+    def should_migrate_once_when_workers_start_together(database_file, project_root, legacy_cache: bool):
+        if legacy_cache:
+            with sqlite3.connect(database_file) as conn:
+                conn.execute("CREATE TABLE tasks_cache (id TEXT PRIMARY KEY NOT NULL, task_data TEXT)")
+        start_at = time.time() + 1  # Once all workers have imported the cache
+        script = (
+            "import sys, time\nfrom tasks_cache import TasksCache\n"
+            "time.sleep(max(0.0, float(sys.argv[1]) - time.time()))\nTasksCache().close()"
+        )
+
+        workers = [
+            subprocess.Popen(
+                [sys.executable, "-c", script, str(start_at)],
+                cwd=project_root / "src",
+                stderr=subprocess.PIPE,
+                text=True,
+            )
+            for _ in range(_WORKERS)
+        ]
+        errors = [worker.communicate()[1] for worker in workers]
+
+        assert [worker.returncode for worker in workers] == [0] * _WORKERS, errors
+
+
+@pytest.mark.usefixtures("database_file")
+class TestTasksCacheStates:
+    @staticmethod
+    def should_claim_only_tasks_in_given_state_oldest_first():
+        tasks_cache = TasksCache()
+        generic_tasks = [
+            GenericTask(content="Newer", difficulty=HabiticaDifficulty.EASY, state="HabiticaNew", created_at=2),
+            GenericTask(content="Other", difficulty=HabiticaDifficulty.EASY, state="HabiticaCreated", created_at=0),
+            GenericTask(content="Older", difficulty=HabiticaDifficulty.EASY, state="HabiticaNew", created_at=1),
+        ]
+        tasks_cache.save_tasks(generic_tasks)
+
+        claimed = tasks_cache.claim_tasks("HabiticaNew", "worker", lease_seconds=0, due_at=time.time(), limit=3)
+        assert [task.content for task in claimed] == ["Older", "Newer"]
+        tasks_cache.close()
+
+    @staticmethod
+    def should_count_tasks_by_state():
+        tasks_cache = TasksCache()
+        tasks_cache.save_tasks(
+            [
+                GenericTask(content="Newer", difficulty=HabiticaDifficulty.EASY, state="HabiticaNew", created_at=2),
+                GenericTask(content="Other", difficulty=HabiticaDifficulty.EASY, state="HabiticaCreated", created_at=0),
+                GenericTask(content="Older", difficulty=HabiticaDifficulty.EASY, state="HabiticaNew", created_at=1),
+            ]
+        )
+
+        assert tasks_cache.tasks_stats() == {"HabiticaNew": (2, 1), "HabiticaCreated": (1, 0)}
+        tasks_cache.close()
+
+
+def _generic_task() -> GenericTask:
+    return GenericTask(content="Task", difficulty=HabiticaDifficulty.EASY, state="HabiticaNew")
+
+
+@pytest.mark.usefixtures("database_file")
+class TestTasksCacheCompletions:
+    @staticmethod
+    def should_queue_each_completion_once():
+        tasks_cache = TasksCache()
+        completion = ("task-id", "2025-01-01T00:00:00.000000Z")
+
+        first = tasks_cache.save_new_tasks({completion: _generic_task()}, sync_cursor=None)
+        second = tasks_cache.save_new_tasks({completion: _generic_task()}, sync_cursor=None)
+
+        assert (len(first), len(second)) == (1, 0)
+        tasks_cache.close()
+
+    @staticmethod
+    def should_forget_completions_queued_before_given_time():
+        tasks_cache = TasksCache()
+        completion = ("task-id", "2025-01-01T00:00:00.000000Z")
+        tasks_cache.save_new_tasks({completion: _generic_task()}, sync_cursor=None)
+
+        assert tasks_cache.forget_completions(queued_before=0) == 0
+        assert tasks_cache.forget_completions(queued_before=time.time() + 1) == 1
+        assert len(tasks_cache.save_new_tasks({completion: _generic_task()}, sync_cursor=None)) == 1
+        tasks_cache.close()
+
+    @staticmethod
+    def should_store_todoist_item_snapshots():
+        tasks_cache = TasksCache()
+        snapshot = TodoistItemSnapshot(checked=False, completed_at=1735689600, due_date="2025-01-02")
+        tasks_cache.save_new_tasks({}, IncrementalSyncCursor(sync_token="token", items={"1": snapshot, "2": snapshot}))
+
+        tasks_cache.save_new_tasks({}, IncrementalSyncCursor(sync_token="token", deleted_item_ids=["2"]))
+
+        assert tasks_cache.get_todoist_item_snapshots(["1", "2"]) == {"1": snapshot}
+        tasks_cache.close()
+
+
+@pytest.mark.usefixtures("database_file")
+class TestTasksCacheTokenBuckets:
+    @staticmethod
+    def should_share_rate_limit_between_processes():
+        sleeps: list[float] = []
+        tasks_caches = [TasksCache(), TasksCache()]
+        first, second = (
+            TokenBucket(2, 60, clock=lambda: 1000.0, sleep=sleeps.append, store=tasks_cache, name="habitica")
+            for tasks_cache in tasks_caches
+        )
+
+        first()
+        second()
+        first()
+
+        assert sleeps == [60]
+        for tasks_cache in tasks_caches:
+            tasks_cache.close()
+
+    @staticmethod
+    def should_apply_database_synchronous_setting(monkeypatch):
+        monkeypatch.setenv("DATABASE_SYNCHRONOUS", "OFF")
+        get_settings.cache_clear()
+        tasks_cache = TasksCache()
+
+        connections = [tasks_cache._connection, tasks_cache._token_buckets_connection]
+        assert [_.execute("PRAGMA synchronous").fetchone()[0] for _ in connections] == [0, 0]
+        tasks_cache.close()
+
+    @staticmethod
+    def should_keep_rate_limit_across_restarts():
+        sleeps: list[float] = []
+        tasks_cache = TasksCache()
+        bucket = TokenBucket(1, 60, clock=lambda: 1000.0, sleep=sleeps.append, store=tasks_cache, name="habitica")
+        bucket()
+        tasks_cache.close()
+
+        tasks_cache = TasksCache()
+        TokenBucket(1, 60, clock=lambda: 1030.0, sleep=sleeps.append, store=tasks_cache, name="habitica")()
+
+        assert sleeps == [30]
+        tasks_cache.close()
+
+
+_LEASE_SECONDS = 60
+
+
+@pytest.mark.usefixtures("database_file")
+class TestTasksCacheLeases:
+    @staticmethod
+    def should_not_claim_tasks_leased_to_another_worker():
+        tasks_caches = [TasksCache(), TasksCache()]
+        tasks_caches[0].save_tasks([_generic_task() for _ in range(3)])
+
+        first = tasks_caches[0].claim_tasks("HabiticaNew", "first", _LEASE_SECONDS, due_at=time.time(), limit=2)
+        second = tasks_caches[1].claim_tasks("HabiticaNew", "second", _LEASE_SECONDS, due_at=time.time(), limit=2)
+
+        assert (len(first), len(second)) == (2, 1)
+        assert not {task.id for task in first} & {task.id for task in second}
+        for tasks_cache in tasks_caches:
+            tasks_cache.close()
+
+    @staticmethod
+    def should_claim_tasks_again_once_lease_expired():
+        tasks_cache = TasksCache()
+        tasks_cache.save_tasks([_generic_task()])
+
+        tasks_cache.claim_tasks("HabiticaNew", "crashed", lease_seconds=0, due_at=time.time(), limit=1)
+
+        assert tasks_cache.claim_tasks("HabiticaNew", "alive", _LEASE_SECONDS, due_at=time.time(), limit=1)
+        tasks_cache.close()
+
+    @staticmethod
+    def should_release_leases_of_saved_tasks():
+        tasks_cache = TasksCache()
+        tasks_cache.save_tasks([_generic_task()])
+        generic_task = tasks_cache.claim_tasks("HabiticaNew", "first", _LEASE_SECONDS, due_at=time.time(), limit=1)[0]
+
+        tasks_cache.save_task(generic_task)
+
+        assert tasks_cache.claim_tasks("HabiticaNew", "second", _LEASE_SECONDS, due_at=time.time(), limit=1)
+        tasks_cache.close()
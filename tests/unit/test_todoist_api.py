@@ -0,0 +1,340 @@
+import json
+from datetime import date, datetime, timedelta, timezone
+from unittest.mock import MagicMock
+
+import pytest
+from pydantic import ValidationError
+
+from models.recurrence import Recurrence
+from models.todoist import (
+    CompletedSyncCursor,
+    IncrementalSyncCursor,
+    TodoistItemSnapshot,
+    TodoistTask,
+    TodoistTaskFilter,
+)
+from todoist_api import CompletedTasksPage, TodoistAPI
+
+
+def _completed_task(index: int) -> dict:
+    completed_at = f"2025-01-01T00:{index // 60:02d}:{index % 60:02d}.000000Z"
+    return {
+        "task_id": str(index),
+        "user_id": "1",
+        "completed_at": completed_at,
+        "item_object": {
+            "checked": True,
+            "content": f"Task {index}",
+            "id": str(index),
+            "is_deleted": False,
+            "priority": 1,
+            "completed_at": completed_at,
+        },
+    }
+
+
+def _archive(count: int):
+    """Fake completed/get_all with `count` tasks, paged newest first with an inclusive `until`."""
+    items = [_completed_task(i) for i in reversed(range(count))]
+
+    def get(_url, headers, params, timeout):  # pylint: disable=unused-argument
+        page = [_ for _ in items if params.get("until") is None or _["completed_at"] <= params["until"]]
+        response = MagicMock(status_code=200)
+        response.content = json.dumps({"items": page[: params["limit"]]}).encode()
+        return response
+
+    return get
+
+
+_SINCE = "2025-01-01T00:00:00.000000Z"
+
+
+def _completed_cursor(page: CompletedTasksPage) -> CompletedSyncCursor:
+    assert isinstance(page.cursor, CompletedSyncCursor)
+    return page.cursor
+
+
+def _incremental_cursor(page: CompletedTasksPage) -> IncrementalSyncCursor:
+    assert isinstance(page.cursor, IncrementalSyncCursor)
+    return page.cursor
+
+
+@pytest.fixture
+def todoist_api() -> TodoistAPI:
+    return TodoistAPI("token")
+
+
+class TestTodoistAPISync:
+    @staticmethod
+    def should_fetch_all_pages(todoist_api: TodoistAPI):
+        todoist_api._session = MagicMock(get=MagicMock(side_effect=_archive(450)))
+
+        pages = list(todoist_api.sync(CompletedSyncCursor(since=_SINCE)))
+
+        task_ids = [task.task_id for page in pages for task in page.items]
+        assert sorted(task_ids, key=int) == [str(i) for i in range(450)]
+        assert pages[-1].cursor == CompletedSyncCursor(since=_completed_task(449)["completed_at"])
+
+    @staticmethod
+    def should_not_move_cursor_past_unfetched_tasks(todoist_api: TodoistAPI):
+        todoist_api._session = MagicMock(get=MagicMock(side_effect=_archive(450)))
+
+        first_page = next(todoist_api.sync(CompletedSyncCursor(since=_SINCE)))
+
+        cursor = _completed_cursor(first_page)
+        assert cursor.since == _SINCE
+        assert cursor.until == first_page.items[-1].completed_at
+        assert cursor.next_since == first_page.items[0].completed_at
+
+    @staticmethod
+    def should_resume_interrupted_sync(todoist_api: TodoistAPI):
+        todoist_api._session = MagicMock(get=MagicMock(side_effect=_archive(450)))
+        first_page = next(todoist_api.sync(CompletedSyncCursor(since=_SINCE)))
+
+        pages = list(todoist_api.sync(_completed_cursor(first_page)))
+
+        task_ids = {task.task_id for page in [first_page, *pages] for task in page.items}
+        assert task_ids == {str(i) for i in range(450)}
+        assert _completed_cursor(pages[-1]).until is None
+
+    @staticmethod
+    def should_finish_sync_if_last_page_is_full(todoist_api: TodoistAPI):
+        todoist_api._session = MagicMock(get=MagicMock(side_effect=_archive(200)))
+
+        pages = list(todoist_api.sync(CompletedSyncCursor(since=_SINCE)))
+
+        assert [len(page.items) for page in pages] == [200, 0]
+        assert pages[-1].cursor == CompletedSyncCursor(since=_completed_task(199)["completed_at"])
+
+    @staticmethod
+    def should_time_out_requests():
+        todoist_api = TodoistAPI("token", timeout=(1, 2))
+        todoist_api._session = MagicMock(get=MagicMock(side_effect=_archive(1)))
+
+        list(todoist_api.sync(CompletedSyncCursor(since=_SINCE)))
+
+        assert todoist_api._session.get.call_args.kwargs["timeout"] == (1, 2)
+
+
+def _item(
+    item_id: str, checked: bool = False, due_date: str | None = None, due_string: str = "every day", **kwargs
+) -> dict:
+    item = {"id": item_id, "content": f"Task {item_id}", "checked": checked, "is_deleted": False, "priority": 1}
+    if due_date is not None:
+        item["due"] = {"date": due_date, "string": due_string, "lang": "en", "is_recurring": True}
+    return item | kwargs
+
+
+def _recurring_snapshots(*item_ids: str, due_date: str = "2025-01-01") -> dict[str, TodoistItemSnapshot]:
+    return {item_id: TodoistItemSnapshot(checked=False, due_date=due_date) for item_id in item_ids}
+
+
+def _sync_response(items: list[dict], full_sync: bool = False) -> MagicMock:
+    response = MagicMock(status_code=200)
+    response.content = json.dumps({"sync_token": "next-token", "full_sync": full_sync, "items": items}).encode()
+    return response
+
+
+class TestTodoistAPISyncIncremental:
+    @staticmethod
+    def should_only_record_items_on_full_sync(todoist_api: TodoistAPI):
+        todoist_api._session = MagicMock(post=MagicMock(return_value=_sync_response([_item("1")], full_sync=True)))
+
+        pages = list(todoist_api.sync_incremental(None, lambda _: {}))
+
+        assert todoist_api._session.post.call_args.kwargs["data"]["sync_token"] == "*"
+        assert not pages[0].items
+        cursor = _incremental_cursor(pages[0])
+        assert cursor.sync_token == "next-token"
+        assert cursor.items == {"1": TodoistItemSnapshot(checked=False)}
+
+    @staticmethod
+    def should_detect_checked_items(todoist_api: TodoistAPI):
+        items = [
+            _item("1", checked=True, completed_at="2025-01-02T00:00:00.000000Z"),
+            _item("2", checked=True, completed_at="2025-01-01T00:00:00.000000Z"),
+            _item("3"),
+        ]
+        todoist_api._session = MagicMock(post=MagicMock(return_value=_sync_response(items)))
+        snapshots = {
+            "1": TodoistItemSnapshot(checked=False),
+            "2": TodoistItemSnapshot(checked=True),
+        }
+
+        pages = list(
+            todoist_api.sync_incremental("token", lambda ids: {_: snapshots[_] for _ in ids if _ in snapshots})
+        )
+
+        assert [task.task_id for task in pages[0].items] == ["1"]
+
+    @staticmethod
+    def should_detect_completed_recurring_items(todoist_api: TodoistAPI):
+        items = [_item("1", due_date="2025-01-02"), _item("2", due_date="2025-01-01")]
+        todoist_api._session = MagicMock(post=MagicMock(return_value=_sync_response(items)))
+
+        pages = list(todoist_api.sync_incremental("token", lambda _: _recurring_snapshots("1", "2")))
+
+        assert [task.task_id for task in pages[0].items] == ["1"]
+        assert _incremental_cursor(pages[0]).items["1"] == TodoistItemSnapshot(checked=False, due_date="2025-01-02")
+
+    @staticmethod
+    def should_not_count_postponed_recurring_items(todoist_api: TodoistAPI):
+        items = [
+            _item("1", due_date="2025-01-05"),
+            _item("2", due_date="2025-01-02", due_string="every week"),
+            _item("3", due_date="2025-01-02", due_string="every 3rd friday"),
+        ]
+        todoist_api._session = MagicMock(post=MagicMock(return_value=_sync_response(items)))
+
+        pages = list(todoist_api.sync_incremental("token", lambda _: _recurring_snapshots("1", "2", "3")))
+
+        assert not pages[0].items
+
+    @staticmethod
+    def should_detect_recurring_items_completed_late(todoist_api: TodoistAPI):
+        tomorrow = (datetime.now(timezone.utc).date() + timedelta(days=1)).isoformat()
+        items = [_item("1", due_date=tomorrow), _item("2", due_date=tomorrow, due_string="every! day")]
+        todoist_api._session = MagicMock(post=MagicMock(return_value=_sync_response(items)))
+
+        pages = list(todoist_api.sync_incremental("token", lambda _: _recurring_snapshots("1", "2")))
+
+        assert [task.task_id for task in pages[0].items] == ["1"]
+
+    @staticmethod
+    def should_detect_recurring_items_completed_at_later_time(todoist_api: TodoistAPI):
+        items = [_item("1", due_date="2025-01-01", completed_at="2025-01-01T10:00:00.000000Z")]
+        todoist_api._session = MagicMock(post=MagicMock(return_value=_sync_response(items)))
+
+        pages = list(todoist_api.sync_incremental("token", lambda _: _recurring_snapshots("1")))
+
+        assert [task.task_id for task in pages[0].items] == ["1"]
+
+    @staticmethod
+    def should_forget_deleted_items(todoist_api: TodoistAPI):
+        todoist_api._session = MagicMock(post=MagicMock(return_value=_sync_response([_item("1", is_deleted=True)])))
+
+        pages = list(todoist_api.sync_incremental("token", lambda _: {}))
+
+        assert not pages[0].items
+        assert _incremental_cursor(pages[0]).deleted_item_ids == ["1"]
+
+
+class TestTodoistTaskParsing:
+    @staticmethod
+    def should_drop_unused_fields():
+        task = TodoistTask.model_validate_json(json.dumps({**_item("1"), "section_id": "2", "child_order": 3}))
+
+        assert task.model_dump().keys().isdisjoint({"section_id", "child_order"})
+
+    @staticmethod
+    @pytest.mark.parametrize(
+        "completed_at, timestamp",
+        [
+            pytest.param("2025-01-01T00:00:00.000000Z", 1735689600, id="UTC with microseconds"),
+            pytest.param("2025-01-01T01:00:00+01:00", 1735689600, id="UTC offset"),
+        ],
+    )
+    def should_parse_iso_dates(completed_at: str, timestamp: int):
+        task = TodoistTask(**_item("1", checked=True, completed_at=completed_at))
+
+        assert task.completed_at_utc_timestamp == timestamp
+
+    @staticmethod
+    def should_refuse_dates_not_in_iso_format():
+        with pytest.raises(ValidationError):
+            TodoistTask(**_item("1", checked=True, completed_at="Jan 1 2025"))
+
+
+class TestTodoistTaskFilter:
+    @staticmethod
+    @pytest.mark.parametrize(
+        "task_filter, item, matches",
+        [
+            pytest.param(TodoistTaskFilter(), _item("1"), True, id="empty filter"),
+            pytest.param(TodoistTaskFilter(include_project_ids={"2"}), _item("1", project_id="2"), True, id="project"),
+            pytest.param(
+                TodoistTaskFilter(include_project_ids={"2"}), _item("1", project_id="3"), False, id="other project"
+            ),
+            pytest.param(
+                TodoistTaskFilter(exclude_project_ids={"2"}), _item("1", project_id="2"), False, id="excluded project"
+            ),
+            pytest.param(TodoistTaskFilter(include_labels={"work"}), _item("1", labels=["Work"]), True, id="label"),
+            pytest.param(TodoistTaskFilter(include_labels={"work"}), _item("1"), False, id="no label"),
+            pytest.param(
+                TodoistTaskFilter(include_labels={"work"}, exclude_labels={"later"}),
+                _item("1", labels=["Work", "Later"]),
+                False,
+                id="excluded label",
+            ),
+            pytest.param(TodoistTaskFilter(user_id="9"), _item("1"), True, id="completed by user"),
+            pytest.param(
+                TodoistTaskFilter(user_id="9"), _item("1", responsible_uid="8"), False, id="assigned to other user"
+            ),
+        ],
+    )
+    def should_match(task_filter: TodoistTaskFilter, item: dict, matches: bool):
+        assert task_filter.matches(TodoistTask(**item), user_id="9") is matches
+
+    @staticmethod
+    def should_request_tasks_of_single_included_project():
+        todoist_api = TodoistAPI("token", task_filter=TodoistTaskFilter(include_project_ids={"2"}))
+        todoist_api._session = MagicMock(get=MagicMock(side_effect=_archive(1)))
+
+        list(todoist_api.sync(CompletedSyncCursor(since=_SINCE)))
+
+        assert todoist_api._session.get.call_args.kwargs["params"]["project_id"] == "2"
+
+    @staticmethod
+    def should_move_cursor_past_skipped_tasks():
+        todoist_api = TodoistAPI("token", task_filter=TodoistTaskFilter(include_labels={"work"}))
+        todoist_api._session = MagicMock(get=MagicMock(side_effect=_archive(450)))
+
+        pages = list(todoist_api.sync(CompletedSyncCursor(since=_SINCE)))
+
+        assert not [task for page in pages for task in page.items]
+        assert pages[-1].cursor == CompletedSyncCursor(since=_completed_task(449)["completed_at"])
+
+    @staticmethod
+    def should_skip_incremental_completions_not_matching():
+        todoist_api = TodoistAPI("token", task_filter=TodoistTaskFilter(exclude_project_ids={"2"}))
+        items = [
+            _item("1", checked=True, project_id="2", completed_at="2025-01-02T00:00:00.000000Z"),
+            _item("2", checked=True, project_id="3", completed_at="2025-01-02T00:00:00.000000Z"),
+        ]
+        todoist_api._session = MagicMock(post=MagicMock(return_value=_sync_response(items)))
+
+        pages = list(todoist_api.sync_incremental("token", lambda _: {}))
+
+        assert [task.task_id for task in pages[0].items] == ["2"]
+        assert set(_incremental_cursor(pages[0]).items) == {"1", "2"}
+
+
+class TestRecurrence:
+    @staticmethod
+    @pytest.mark.parametrize(
+        "due_string, next_due",
+        [
+            pytest.param("every day", date(2025, 2, 1), id="day"),
+            pytest.param("Every day at 9am", date(2025, 2, 1), id="day with time"),
+            pytest.param("daily", date(2025, 2, 1), id="alias"),
+            pytest.param("every 2 weeks", date(2025, 2, 14), id="weeks"),
+            pytest.param("every other month", date(2025, 3, 31), id="other month"),
+            pytest.param("every month", date(2025, 2, 28), id="month to shorter month"),
+            pytest.param("every year starting jan 31", date(2026, 1, 31), id="year with start"),
+            pytest.param("every weekday", date(2025, 2, 3), id="weekday"),
+            pytest.param("every tue, thu", date(2025, 2, 4), id="days of week"),
+        ],
+    )
+    def should_advance_by_one_occurrence(due_string: str, next_due: date):
+        recurrence = Recurrence.parse(due_string)
+
+        assert recurrence is not None
+        assert recurrence.advance(date(2025, 1, 31)) == next_due  # Friday
+
+    @staticmethod
+    def should_parse_strict_recurrence():
+        assert Recurrence.parse("every! 3 days") == Recurrence(unit="day", count=3, strict=True)
+
+    @staticmethod
+    def should_not_parse_unknown_recurrence():
+        assert Recurrence.parse("every 3rd friday") is None
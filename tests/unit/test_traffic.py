@@ -0,0 +1,134 @@
+import dataclasses
+import json
+import math
+from dataclasses import asdict
+from pathlib import Path
+
+import pytest
+from requests import ConnectionError as RequestsConnectionError
+from requests import HTTPError
+from requests.adapters import BaseAdapter
+
+from habitica_api import HabiticaAPI, HabiticaAPIHeaders
+from traffic import Exchange, TrafficRecorder, TrafficReplay
+
+_API_KEY = "secret-api-key"
+_COMPLETED_TODOS_PATH = "/api/v3/tasks/user"
+
+
+def _exchange(
+    path: str = _COMPLETED_TODOS_PATH, status: int = 200, body: object = None, headers: dict[str, str] | None = None
+) -> Exchange:
+    return Exchange(
+        service=HabiticaAPI.TRAFFIC_SERVICE,
+        method="GET",
+        path=path,
+        query="",
+        request_bytes=0,
+        status=status,
+        headers={"content-type": "application/json", **(headers or {})},
+        body=json.dumps({"data": [] if body is None else body}),
+        elapsed=0.5,
+        recorded_at=0,
+    )
+
+
+def _write_traffic(traffic_file: Path, exchanges: list[Exchange]) -> Path:
+    traffic_file.write_text("".join(json.dumps(asdict(exchange)) + "\n" for exchange in exchanges))
+    return traffic_file
+
+
+def _habitica_api(traffic: object) -> HabiticaAPI:
+    return HabiticaAPI(HabiticaAPIHeaders(user_id="user-id", api_key=_API_KEY), traffic=traffic)  # type: ignore[arg-type]
+
+
+class _RecordedReplay:  # pylint: disable=too-few-public-methods
+    """Records traffic served by a replay instead of the network."""
+
+    def __init__(self, recorder: TrafficRecorder, replay: TrafficReplay):
+        self._recorder = recorder
+        self._replay = replay
+
+    def adapter(self, service: str, default: BaseAdapter) -> BaseAdapter:
+        return self._recorder.adapter(service, self._replay.adapter(service, default))
+
+
+class TestTrafficRecorder:
+    @staticmethod
+    def should_record_responses_without_credentials(tmp_path):
+        source = TrafficReplay(_write_traffic(tmp_path / "source.jsonl", [_exchange(body=[{"id": "1"}])]), math.inf)
+        recorder = TrafficRecorder(tmp_path / "recorded.jsonl")
+
+        _habitica_api(_RecordedReplay(recorder, source)).get_completed_todos()
+        recorder.close()
+
+        recorded = (tmp_path / "recorded.jsonl").read_text()
+        assert _API_KEY not in recorded
+        exchange = json.loads(recorded)
+        assert (exchange["method"], exchange["path"], exchange["query"]) == (
+            "GET",
+            _COMPLETED_TODOS_PATH,
+            "type=_allCompletedTodos",
+        )
+        assert json.loads(exchange["body"]) == {"data": [{"id": "1"}]}
+
+    @staticmethod
+    def should_record_rate_limit_reset_relative_to_response(tmp_path):
+        headers = {"x-ratelimit-remaining": "29", "x-ratelimit-reset": "30", "set-cookie": "session"}
+        source = TrafficReplay(_write_traffic(tmp_path / "source.jsonl", [_exchange(headers=headers)]), math.inf)
+        recorder = TrafficRecorder(tmp_path / "recorded.jsonl")
+
+        _habitica_api(_RecordedReplay(recorder, source)).get_completed_todos()
+        recorder.close()
+
+        recorded_headers = json.loads((tmp_path / "recorded.jsonl").read_text())["headers"]
+        assert recorded_headers == {
+            "content-type": "application/json",
+            "x-ratelimit-remaining": "29",
+            "x-ratelimit-reset": "0.000",  # Replayed immediately
+        }
+
+
+class TestTrafficReplay:
+    @staticmethod
+    def should_replay_responses_in_recorded_order(tmp_path):
+        traffic_file = _write_traffic(tmp_path / "traffic.jsonl", [_exchange(body=[{"id": "1"}]), _exchange()])
+        habitica_api = _habitica_api(TrafficReplay(traffic_file, math.inf))
+
+        assert [habitica_api.get_completed_todos(), habitica_api.get_completed_todos()] == [[{"id": "1"}], []]
+        with pytest.raises(RequestsConnectionError):
+            habitica_api.get_completed_todos()
+
+    @staticmethod
+    def should_replay_errors(tmp_path):
+        traffic_file = _write_traffic(
+            tmp_path / "traffic.jsonl",
+            [_exchange(status=404), dataclasses.replace(_exchange(), status=0, body="Read timed out.")],
+        )
+        habitica_api = _habitica_api(TrafficReplay(traffic_file, math.inf))
+
+        with pytest.raises(HTTPError) as http_error:
+            habitica_api.get_completed_todos()
+        assert http_error.value.response is not None
+        assert http_error.value.response.status_code == 404  # noqa: PLR2004
+        with pytest.raises(RequestsConnectionError, match="Read timed out."):
+            habitica_api.get_completed_todos()
+
+    @staticmethod
+    def should_respond_faster_by_speedup(tmp_path):
+        sleeps: list[float] = []
+        traffic_file = _write_traffic(tmp_path / "traffic.jsonl", [_exchange(headers={"x-ratelimit-reset": "30"})])
+        replay = TrafficReplay(traffic_file, speedup=10, sleep=sleeps.append)
+
+        exchange = replay.take((HabiticaAPI.TRAFFIC_SERVICE, "GET", _COMPLETED_TODOS_PATH))
+
+        assert sleeps == [0.05]
+        assert replay.headers(exchange)["x-ratelimit-reset"] == "3.000"
+
+    @staticmethod
+    def should_skip_line_truncated_by_crash(tmp_path):
+        traffic_file = _write_traffic(tmp_path / "traffic.jsonl", [_exchange()])
+        with traffic_file.open("a") as lines:
+            lines.write('{"service": "habitica", "met')
+
+        assert TrafficReplay(traffic_file).total == 1